@@ -0,0 +1,65 @@
+import time
+
+
+class MCP3008Scanner():
+    """Reads a set of MCP3008 channels in one pass over the SPI bus
+
+    `AnalogIn` locks, configures and releases the bus for every single
+    conversion. Here, that happens once per scan; in between conversions we
+    only toggle chip select, which the chip needs to start the next one.
+
+    Values are scaled to 16 bit, like `AnalogIn.value`.
+
+    Args:
+        spi (busio.SPI): Needs `try_lock`, `configure`, `write_readinto` and `unlock`
+        cs (digitalio.DigitalInOut): Chip select, e.g. on CE0
+        channels (list): Single-ended channels to read, 0-7
+        vref (float, optional): Reference voltage. Defaults to 3.3.
+        baudrate (int, optional): Defaults to 1 MHz, like the lib.
+    """
+
+    def __init__(self, spi, cs, channels, vref=3.3, baudrate=1000000):
+        channels = list(channels)
+        if not channels:
+            raise ValueError('Need at least one channel')
+        for ch in channels:
+            if not 0 <= ch <= 7:
+                raise ValueError(f'MCP3008 has channels 0-7, not {ch}')
+        self.spi = spi
+        self.cs = cs
+        self.cs.switch_to_output(value=True)
+        self.channels = channels
+        self.reference_voltage = vref
+        self.baudrate = baudrate
+        # One command per channel, built once: start bit, single-ended + channel
+        self._out = [bytearray([0x01, (0x08 | ch) << 4, 0x00]) for ch in channels]
+        self._in = bytearray(3)
+        self.scans = 0
+
+    def scan(self, passes=1) -> list:
+        """Convert every channel `passes` times
+
+        Returns:
+            list: Samples per channel, in the order of `channels`
+        """
+        samples = [[] for _ in self.channels]
+        spi, cs, buf = self.spi, self.cs, self._in
+        while not spi.try_lock():
+            time.sleep(0)
+        try:
+            spi.configure(baudrate=self.baudrate, polarity=0, phase=0)
+            for _ in range(passes):
+                for out, values in zip(self._out, samples):
+                    cs.value = False
+                    spi.write_readinto(out, buf)
+                    cs.value = True
+                    values.append((((buf[1] & 0x03) << 8) | buf[2]) << 6)
+        finally:
+            cs.value = True
+            spi.unlock()
+        self.scans += 1
+        return samples
+
+    def volts(self, value: float) -> float:
+        """Same as AnalogIn.voltage, for a 16 bit value"""
+        return value * self.reference_voltage / 65535
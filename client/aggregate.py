@@ -0,0 +1,125 @@
+import math
+from datetime import datetime, timezone
+
+from deadband import in_alarm, metrics_of
+from reading import INT_FIELDS
+
+# Not metrics, so never aggregated
+KEYS = ('sensorId', 'measurementTs')
+
+
+class WindowStats():
+    """Streaming mean of one column in one window. O(1) memory."""
+    __slots__ = ('count', 'total')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, v):
+        # None means "no reading", it doesn't count towards the mean
+        if v is None:
+            return
+        self.count += 1
+        self.total += v
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+def _is_number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+class Aggregator():
+    """Downsamples readings into fixed windows before they're sent
+
+    Per window (aligned to the wall clock, e.g. every full minute) and numeric
+    column, we keep the mean. The emitted reading keeps the usual schema, with
+    the mean as the column's value (rounded for the server's integer columns,
+    INT_FIELDS), so the server stores it as-is. Non-numeric columns (e.g.
+    relMoisture) keep their last value. `measurementTs` is the start of the window.
+
+    A mean would hide a short spike past one of the server's alert thresholds
+    (see deadband.in_alarm), so a raw reading that crosses one, either way,
+    is passed on as well, right away.
+    """
+
+    def __init__(self, window_s: float):
+        if window_s <= 0:
+            raise ValueError(f'Window must be > 0, got {window_s}')
+        self.window_s = window_s
+        self._windows = {}
+        # sensorId -> column -> whether the last value was in alarm
+        self._alarms = {}
+
+    def _bucket(self, ts: str) -> int:
+        dt = datetime.fromisoformat(ts)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return math.floor(dt.timestamp() / self.window_s)
+
+    def add(self, reading: dict) -> list:
+        """Add a raw reading
+
+        Args:
+            reading (dict): From `read_sensors`
+
+        Returns:
+            list: Aggregated readings for every window this one closed (usually none),
+                then this one if it crossed an alert threshold
+        """
+        sid = reading.get('sensorId')
+        bucket = self._bucket(reading['measurementTs'])
+        out = []
+        window = self._windows.get(sid)
+        if window is not None and window[0] != bucket:
+            out.append(self._emit(sid, *window))
+            window = None
+        if window is None:
+            window = (bucket, {}, {})
+            self._windows[sid] = window
+        _, stats, other = window
+        for k, v in reading.items():
+            if k in KEYS:
+                continue
+            if v is None or _is_number(v):
+                if k not in stats:
+                    stats[k] = WindowStats()
+                stats[k].add(v)
+            else:
+                other[k] = v
+        if self._crossed(sid, reading):
+            out.append(reading)
+        return out
+
+    def _crossed(self, sid, reading) -> bool:
+        alarms = self._alarms.setdefault(sid, {})
+        crossed = False
+        for k, v in metrics_of(reading)[0].items():
+            alarm = in_alarm(k.rpartition('/')[2], v)
+            if alarm != alarms.get(k, False):
+                crossed = True
+            alarms[k] = alarm
+        return crossed
+
+    def _emit(self, sid, bucket, stats, other) -> dict:
+        start = datetime.fromtimestamp(bucket * self.window_s, tz=timezone.utc)
+        r = {'sensorId': sid}
+        for k, s in stats.items():
+            mean = s.mean
+            r[k] = int(round(mean)) if k in INT_FIELDS and mean is not None else mean
+        r.update(other)
+        r['measurementTs'] = start.isoformat()
+        return r
+
+    def flush(self) -> list:
+        """Emit all open windows, e.g. on shutdown
+
+        Returns:
+            list: Aggregated readings
+        """
+        out = [self._emit(sid, *w) for sid, w in self._windows.items()]
+        self._windows = {}
+        return out
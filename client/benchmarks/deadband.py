@@ -0,0 +1,113 @@
+"""Report by exception: compression ratio and rebuild error on a recorded trace
+
+Replays a trace through `deadband.ExceptionReporter` in both modes and
+reports readings sent vs. received, JSON bytes, and the worst error when
+the server rebuilds each column from what was sent (vs. its tolerance).
+
+The trace is a history file, as recorded with `monitor.py --history_file`.
+Without one, a day at 1 reading/s from the simulated sensors is used.
+
+Usage: python3 benchmarks/deadband.py [--history_file history.bin] [--tolerance tempC=0.2 ...] [--heartbeat 900]
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from deadband import ExceptionReporter, MODES, TOLERANCES, rebuild  # noqa: E402
+from scheduler import parse_intervals  # noqa: E402
+from wire import encode_batch  # noqa: E402
+
+
+def _iso(t: float) -> str:
+    return datetime.fromtimestamp(t, tz=timezone.utc).isoformat()
+
+
+def from_history(path: str) -> list:
+    from history import History, COLUMNS
+    h = History(path)
+    rows = {}
+    for column in COLUMNS:
+        for t, v in h.query(column):
+            rows.setdefault(t, {})[column] = v
+    h.close()
+    return [{'sensorId': 'history', 'measurementTs': _iso(t), **values} for t, values in sorted(rows.items())]
+
+
+def simulated(seconds=86400, seed=42) -> list:
+    # The waves behind simulated.py's chips, sampled like the drivers would
+    from simulated import Simulation
+    sim = Simulation(seed=seed)
+    rng = random.Random(seed)
+    t0 = 1625133600
+    out = []
+    for t in range(seconds):
+        # MCP9808: 1/16 C steps, MCP3008: 10 bit
+        code = max(0, min(1023, int(round(sim.adc.channels[0](t, rng) / 3.3 * 1023))))
+        out.append({
+            'sensorId': 'simulated',
+            'measurementTs': _iso(t0 + t),
+            'tempC': round(sim.temp.temp(t, rng) * 16) / 16,
+            'lumen': max(0.0, sim.lux.lux(t, rng)),
+            'visLight': int(sim.uv.vis(t, rng)),
+            'irLight': int(sim.uv.ir(t, rng)),
+            'uvIx': round(sim.uv.uv(t, rng), 2),
+            'rawMoisture': code << 6,
+            'voltMoisture': (code << 6) * 3.3 / 65535,
+        })
+    return out
+
+
+def replay(readings: list, mode: str, tolerances: dict, heartbeat_s: float) -> dict:
+    reporter = ExceptionReporter(mode, tolerances, heartbeat_s)
+    sent = []
+    for r in readings:
+        sent += reporter.add(r)
+    sent += reporter.flush()
+    columns = {k for r in readings for k, v in r.items() if isinstance(v, (int, float))}
+    errors = {}
+    for column in sorted(columns):
+        points = [(datetime.fromisoformat(r['measurementTs']).timestamp(), r[column])
+                  for r in sent if r.get(column) is not None]
+        worst = 0.0
+        for r in readings:
+            v = r.get(column)
+            if v is None:
+                continue
+            rebuilt = rebuild(points, datetime.fromisoformat(r['measurementTs']).timestamp(), mode)
+            if rebuilt is not None:
+                worst = max(worst, abs(rebuilt - v))
+        errors[column] = worst
+    return {
+        'sent': len(sent),
+        'ratio': reporter.ratio,
+        'bytes': len(encode_batch(sent)[0]),
+        'errors': errors,
+        'tolerances': {k: reporter._tolerance(k) for k in errors},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report by exception on a recorded trace')
+    parser.add_argument('--history_file', dest='history_file', required=False, default=None, type=str)
+    parser.add_argument('--seconds', dest='seconds', required=False, default=86400, type=int,
+                        help='Length of the simulated trace, without --history_file')
+    parser.add_argument('--tolerance', dest='tolerance', required=False, default=[], type=str, nargs='+')
+    parser.add_argument('--heartbeat', dest='heartbeat_s', required=False, default=900.0, type=float)
+    args = parser.parse_args()
+
+    readings = from_history(args.history_file) if args.history_file else simulated(args.seconds)
+    tolerances = parse_intervals(args.tolerance)
+    raw_bytes = len(encode_batch(readings)[0])
+    print(f'{len(readings)} readings, {raw_bytes / 1024:.0f} KiB as JSON, heartbeat {args.heartbeat_s:g}s')
+    print(f'Tolerances: {dict(TOLERANCES, **tolerances)}')
+    for mode in MODES:
+        res = replay(readings, mode, tolerances, args.heartbeat_s)
+        print(f'  {mode:<14} {res["sent"]} sent, {res["ratio"]:.1f}:1, {res["bytes"] / 1024:.0f} KiB')
+        for column, err in res['errors'].items():
+            tol = res['tolerances'][column]
+            flag = '' if err <= tol + 1e-9 else '  OVER'
+            print(f'    {column:<14} max error {err:g} (tolerance {tol:g}){flag}')
@@ -0,0 +1,345 @@
+"""Fleet load generator: thousands of virtual nodes posting to the ingest server
+
+Every virtual node behaves like `monitor.py`'s uploader: it keeps one
+keep-alive connection and POSTs a batch of `--buffer_max` readings every
+`--buffer_max * --frequency` seconds (+/- `--jitter`), encoded by `wire.py`.
+Nodes start spread over one period, so the load is even.
+
+Reports requests/s, readings/s, latency percentiles and errors every
+`--report_s`, and in total. `lag` is how late nodes were in sending: if it
+grows, the generator itself is the bottleneck and the numbers are a floor.
+
+Targets:
+- the Go server, e.g. `go run . -disableNotifications -fakeStorage` (see
+  server/README.md), then `--url http://127.0.0.1:7777/`
+- without `--url`, a stand-in server in this process. It decodes batches
+  like the Go handler and "inserts" them into a stand-in database: a pool
+  of `--db_pool` connections, each statement holding one for
+  `--db_statement_ms` plus `--db_row_us` per row.
+
+Usage: python3 benchmarks/fleet.py [--url http://127.0.0.1:7777/] [--nodes 2000] [--buffer_max 10] [--frequency 1] [--duration 60]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from reading import Reading  # noqa: E402
+from wire import COLUMNAR, decode_columnar, encode_batch  # noqa: E402
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest rank, `values` sorted"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Stats():
+    """Per report interval, and in total"""
+
+    def __init__(self):
+        self.latencies = []
+        self.lags = []
+        self.requests = 0
+        self.readings = 0
+        self.bytes = 0
+        self.errors = {}
+
+    def observe(self, latency_s: float, lag_s: float, readings: int, size: int, error: str = None):
+        self.requests += 1
+        self.lags.append(lag_s)
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+            return
+        self.latencies.append(latency_s)
+        self.readings += readings
+        self.bytes += size
+
+    def merge(self, other):
+        self.latencies += other.latencies
+        self.lags += other.lags
+        self.requests += other.requests
+        self.readings += other.readings
+        self.bytes += other.bytes
+        for k, v in other.errors.items():
+            self.errors[k] = self.errors.get(k, 0) + v
+
+    def summary(self, seconds: float) -> dict:
+        lat = sorted(self.latencies)
+        errors = sum(self.errors.values())
+        return {
+            'requests_per_s': self.requests / seconds,
+            'readings_per_s': self.readings / seconds,
+            'kib_per_s': self.bytes / 1024 / seconds,
+            'p50_ms': percentile(lat, 50) * 1000,
+            'p90_ms': percentile(lat, 90) * 1000,
+            'p99_ms': percentile(lat, 99) * 1000,
+            'max_ms': (lat[-1] if lat else 0.0) * 1000,
+            'error_rate': errors / self.requests if self.requests else 0.0,
+            'errors': dict(self.errors),
+            'lag_p99_ms': percentile(sorted(self.lags), 99) * 1000,
+        }
+
+
+def _format(s: dict) -> str:
+    out = (f'{s["requests_per_s"]:.0f} req/s, {s["readings_per_s"]:.0f} readings/s, {s["kib_per_s"]:.0f} KiB/s, '
+           f'p50 {s["p50_ms"]:.1f}ms, p90 {s["p90_ms"]:.1f}ms, p99 {s["p99_ms"]:.1f}ms, max {s["max_ms"]:.0f}ms, '
+           f'errors {s["error_rate"]:.2%}, lag p99 {s["lag_p99_ms"]:.0f}ms')
+    if s['errors']:
+        out += f' {s["errors"]}'
+    return out
+
+
+class Node():
+    """One virtual Pi. Readings look like `read_sensors` output."""
+
+    def __init__(self, i: int, rng: random.Random):
+        self.sensor_id = f'load-{i:05d}'
+        self.rng = rng
+        self.temp = rng.uniform(15, 25)
+        self.moisture = rng.uniform(0.9, 1.8)
+        self.reader = self.writer = None
+
+    def readings(self, n: int, end: float, frequency_s: float) -> list:
+        rng = self.rng
+        out = []
+        for k in range(n):
+            ts = datetime.fromtimestamp(end - (n - 1 - k) * frequency_s, tz=timezone.utc).isoformat()
+            volt = self.moisture + rng.gauss(0, 0.01)
+            raw = int(volt / 3.3 * 1023) << 6
+            out.append(Reading(
+                sensorId=self.sensor_id, measurementTs=ts,
+                tempC=round(self.temp + rng.gauss(0, 0.05), 4), visLight=rng.randint(250, 350),
+                irLight=rng.randint(300, 500), uvIx=round(rng.uniform(0, 5), 2), rawMoisture=raw,
+                voltMoisture=raw * 3.3 / 65535, lumen=round(rng.uniform(0, 20000), 2),
+                relMoisture='ok' if volt <= 1.5 else 'dry'))
+        return out
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def post(node: Node, host: str, port: int, path: str, body: bytes, headers: dict) -> int:
+    """POST on the node's keep-alive connection, (re)connecting as needed
+
+    Returns:
+        int: HTTP status
+    """
+    if node.writer is None:
+        node.reader, node.writer = await asyncio.open_connection(host, port)
+    head = [f'POST {path} HTTP/1.1', f'Host: {host}:{port}', f'Content-Length: {len(body)}']
+    head += [f'{k}: {v}' for k, v in headers.items()]
+    node.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+    await node.writer.drain()
+    status_line = await node.reader.readline()
+    if not status_line:
+        raise ConnectionResetError('Server closed the connection')
+    status = int(status_line.split()[1])
+    length, close = 0, False
+    while True:
+        line = await node.reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection' and value.strip().lower() == 'close':
+            close = True
+    if length:
+        await node.reader.readexactly(length)
+    if close:
+        await node.close()
+    return status
+
+
+async def run_node(node: Node, args, url, stats_box: list, t0: float, deadline: float):
+    period = args.buffer_max * args.frequency_s
+    loop = asyncio.get_running_loop()
+    wall0 = time.time() - loop.time()
+    planned = t0 + node.rng.uniform(0, period)
+    while planned < deadline:
+        delay = planned - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        start = loop.time()
+        lag = start - planned
+        body, headers = encode_batch(node.readings(args.buffer_max, wall0 + planned, args.frequency_s),
+                                     args.wire_format, args.compress)
+        error = None
+        try:
+            status = await asyncio.wait_for(post(node, url.hostname, url.port or 80, url.path or '/', body, headers),
+                                            args.http_timeout_s)
+            if not 200 <= status < 300:
+                error = f'http_{status}'
+        except asyncio.TimeoutError:
+            error = 'timeout'
+            await node.close()
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+            error = type(e).__name__
+            await node.close()
+        # The box is swapped every report interval
+        stats_box[0].observe(loop.time() - start, lag, args.buffer_max, len(body), error)
+        planned += period * (1 + node.rng.uniform(-args.jitter, args.jitter))
+    await node.close()
+
+
+class StandIn():
+    """Stand-in for the Go server and its database
+
+    Decodes batches like RetrieveSensorDataHandler (JSON or columnar,
+    optionally gzipped), then holds one of `pool` connections for
+    `statement_s + rows * row_s` per batch, like one multi-row INSERT.
+    """
+
+    def __init__(self, pool=7, statement_s=0.002, row_s=0.00002):
+        self.pool_size = pool
+        self.statement_s = statement_s
+        self.row_s = row_s
+        self.statements = 0
+        self.rows = 0
+        self._pool = None
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._pool = asyncio.Semaphore(self.pool_size)
+        self._server = await asyncio.start_server(self._handle, host, port, backlog=4096)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def insert(self, rows: int):
+        async with self._pool:
+            await asyncio.sleep(self.statement_s + rows * self.row_s)
+        self.statements += 1
+        self.rows += rows
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                try:
+                    if headers.get('content-encoding') == 'gzip':
+                        body = gzip.decompress(body)
+                    if headers.get('content-type', '').split(';')[0] == COLUMNAR:
+                        readings = decode_columnar(json.loads(body))
+                    else:
+                        readings = json.loads(body)
+                    await self.insert(len(readings))
+                    status = b'200 OK'
+                except ValueError:
+                    status = b'400 Bad Request'
+                writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Length: 0\r\n\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _raise_fd_limit(wanted: int):
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+        if hard < wanted:
+            print(f'Only {hard} file descriptors allowed, some nodes will fail to connect')
+
+
+async def run(args) -> dict:
+    standin = None
+    url = args.url
+    if not url:
+        standin = StandIn(args.db_pool, args.db_statement_ms / 1000, args.db_row_us / 1e6)
+        port = await standin.start()
+        url = f'http://127.0.0.1:{port}/'
+        print(f'Stand-in server on {url}, {args.db_pool} DB connections, '
+              f'{args.db_statement_ms}ms + {args.db_row_us}us/row per INSERT')
+    url = urlsplit(url)
+
+    rng = random.Random(args.seed)
+    nodes = [Node(i, random.Random(rng.random())) for i in range(args.nodes)]
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    deadline = t0 + args.duration_s
+    total = Stats()
+    box = [Stats()]
+    tasks = [asyncio.ensure_future(run_node(n, args, url, box, t0, deadline)) for n in nodes]
+    period = args.buffer_max * args.frequency_s
+    print(f'{args.nodes} nodes, {args.buffer_max} readings per POST every {period:g}s (+/- {args.jitter:.0%}), '
+          f'expecting {args.nodes / period:.0f} req/s, {args.nodes * args.buffer_max / period:.0f} readings/s')
+
+    last = t0
+    while loop.time() < deadline:
+        await asyncio.sleep(min(args.report_s, max(0.0, deadline - loop.time())))
+        now = loop.time()
+        window, box[0] = box[0], Stats()
+        total.merge(window)
+        # The first period is the ramp up
+        print(f'[{now - t0:5.0f}s] {_format(window.summary(now - last))}')
+        last = now
+    # Sends planned before the deadline, but late
+    await asyncio.gather(*tasks)
+    total.merge(box[0])
+    result = total.summary(loop.time() - t0)
+    print(f'Total: {_format(result)}')
+    if standin:
+        print(f'Stand-in DB: {standin.statements} INSERTs, {standin.rows} rows')
+        await standin.stop()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fleet load generator')
+    parser.add_argument('--url', dest='url', required=False, default=None, type=str,
+                        help='Ingest endpoint. Without it, a stand-in server is started')
+    parser.add_argument('--nodes', dest='nodes', required=False, default=1000, type=int)
+    parser.add_argument('--buffer_max', dest='buffer_max', required=False, default=10, type=int,
+                        help='Readings per POST, like monitor.py --buffer_max')
+    parser.add_argument('--frequency', dest='frequency_s', required=False, default=1.0, type=float,
+                        help='Seconds per reading, like monitor.py --frequency')
+    parser.add_argument('--jitter', dest='jitter', required=False, default=0.1, type=float,
+                        help='Randomize each node\'s send interval by up to this fraction')
+    parser.add_argument('--duration', dest='duration_s', required=False, default=60.0, type=float)
+    parser.add_argument('--wire_format', dest='wire_format', required=False, default='json',
+                        choices=['json', 'columnar'])
+    parser.add_argument('--compress', dest='compress', required=False, default=False, action='store_true')
+    parser.add_argument('--http_timeout', dest='http_timeout_s', required=False, default=10.0, type=float)
+    parser.add_argument('--report_s', dest='report_s', required=False, default=5.0, type=float)
+    parser.add_argument('--seed', dest='seed', required=False, default=42, type=int)
+    parser.add_argument('--db_pool', dest='db_pool', required=False, default=7, type=int,
+                        help='Stand-in: DB connections, like the server\'s SetMaxOpenConns')
+    parser.add_argument('--db_statement_ms', dest='db_statement_ms', required=False, default=2.0, type=float,
+                        help='Stand-in: time per INSERT')
+    parser.add_argument('--db_row_us', dest='db_row_us', required=False, default=20.0, type=float,
+                        help='Stand-in: time per row of an INSERT')
+    args = parser.parse_args()
+
+    _raise_fd_limit(args.nodes * (1 if args.url else 2) + 100)
+    asyncio.run(run(args))
@@ -0,0 +1,60 @@
+"""Local history: appends/s, and query times on a full file
+
+Fills a history file (default: 16 MiB, about 3 days at 1 reading/s), then
+times `last()` and `downsample()` over different ranges.
+
+Usage: python3 benchmarks/history.py [--mb 16] [--dir /tmp]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from history import History  # noqa: E402
+
+
+def timed(fn, *args, runs=5) -> tuple:
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        res = fn(*args)
+        took = time.perf_counter() - start
+        best = took if best is None else min(best, took)
+    return best * 1000, res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='History benchmark')
+    parser.add_argument('--mb', dest='mb', required=False, default=16, type=float)
+    parser.add_argument('--dir', dest='dir', required=False, default=None, type=str)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as d:
+        path = os.path.join(d, 'history.bin')
+        h = History(path, max_bytes=int(args.mb * 1024 * 1024))
+        now = time.time()
+        t0 = now - h.capacity
+        reading = {'sensorId': 'pi', 'tempC': 21.5, 'visLight': 260, 'irLight': 253, 'uvIx': 0.02,
+                   'rawMoisture': 23360, 'voltMoisture': 1.17, 'lumen': 120.5, 'relMoisture': 'ok'}
+        start = time.perf_counter()
+        for i in range(h.capacity):
+            reading['measurementTs'] = datetime.fromtimestamp(t0 + i, tz=timezone.utc).isoformat()
+            reading['voltMoisture'] = 1.0 + (i % 1000) / 1000
+            h.append(reading)
+        took = time.perf_counter() - start
+        print(f'{h.capacity} rows, {os.path.getsize(path) / 1024 / 1024:.1f} MiB')
+        print(f'  append: {h.capacity / took:.0f}/s, {took / h.capacity * 1e6:.1f}us each')
+        h.close()
+
+        h = History(path)
+        for label, seconds in [('1 min', 60), ('10 min', 600), ('1 h', 3600), ('1 day', 86400)]:
+            ms, rows = timed(h.last, 'voltMoisture', seconds, now)
+            print(f'  last {label:<7} {len(rows):>6} rows in {ms:.2f}ms')
+        for label, seconds, step in [('1 h / 1 min', 3600, 60), ('1 day / 15 min', 86400, 900)]:
+            ms, rows = timed(h.downsample, 'voltMoisture', step, now - seconds)
+            print(f'  downsample {label:<15} {len(rows):>4} rows in {ms:.2f}ms')
+        h.close()
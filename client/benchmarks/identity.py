@@ -0,0 +1,24 @@
+"""Compare resolving the machine ID per reading vs. once at startup
+
+Usage: python3 benchmarks/identity.py [--number 1000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import identity  # noqa: E402
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Machine ID microbenchmark')
+    parser.add_argument('--number', dest='number', required=False,
+                        default=1000, type=int, help='Calls per path')
+    args = parser.parse_args()
+
+    identity.init_machine_id()
+    for name, fn in (('derive_machine_id (old, per reading)', identity.derive_machine_id),
+                     ('get_machine_id (cached)', identity.get_machine_id)):
+        t = timeit.timeit(fn, number=args.number)
+        print(f'{name}: {t / args.number * 1e6:.2f}us/call ({args.number} calls)')
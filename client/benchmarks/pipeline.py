@@ -0,0 +1,157 @@
+"""Throughput of the whole client against simulated sensors
+
+Two parts:
+- `read_sensors` in a tight loop: readings/s, p50/p99 latency, and allocations
+  per reading (net blocks still alive after the loop, peak while it ran)
+- `main()` end-to-end (scheduler, spool, uploader) against a local HTTP
+  stand-in for the server, which decodes every batch like server.go does.
+  Skipped ticks count as ticks, so readings can be a bit below --ticks
+
+--latency_ms and --error_rate only apply to the first part.
+
+Usage: python3 benchmarks/pipeline.py [--readings 2000] [--ticks 500] [--frequency 0.002]
+       [--latency_ms 0] [--error_rate 0] [--wire_format columnar] [--compress]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import monitor  # noqa: E402
+import wire  # noqa: E402
+from scheduler import FixedRateScheduler  # noqa: E402
+from simulated import Simulation, current  # noqa: E402
+
+SENSORS = ['temp', 'lumen', 'uv', 'moisture']
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench_read_sensors(n: int) -> dict:
+    sensors = monitor.create_sensors(*SENSORS)
+    sampler = monitor.BusSampler()
+    # Warm up: first reads connect and fill caches
+    for _ in range(10):
+        monitor.read_sensors(sensors, sampler=sampler)
+
+    latencies = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        monitor.read_sensors(sensors, sampler=sampler)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    sampler.shutdown()
+
+    net_blocks = sum(s.count_diff for s in after.compare_to(before, 'filename'))
+    return {
+        'readings_per_s': n / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'net_blocks_per_reading': net_blocks / n,
+        'peak_kib': peak / 1024,
+    }
+
+
+class Collector(BaseHTTPRequestHandler):
+    received = 0
+    batches = 0
+    bytes = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        raw = gzip.decompress(body) if self.headers.get('Content-Encoding') == 'gzip' else body
+        if self.headers.get('Content-Type', wire.JSON).startswith(wire.COLUMNAR):
+            readings = wire.decode_columnar(json.loads(raw))
+        else:
+            readings = json.loads(raw)
+        with Collector.lock:
+            Collector.received += len(readings)
+            Collector.batches += 1
+            Collector.bytes += len(body)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_main(ticks: int, frequency_s: float, wire_format: str, compress: bool) -> dict:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Collector)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Time spent between the deadline and the tick handed out
+    lags = []
+    wait = FixedRateScheduler.wait
+
+    def timed_wait(self):
+        tick = wait(self)
+        lags.append(tick.late_s)
+        return tick
+
+    FixedRateScheduler.wait = timed_wait
+    start = time.perf_counter()
+    try:
+        monitor.main(f'http://127.0.0.1:{server.server_port}', frequency_s, 50, 0, False, False, *SENSORS,
+                     wire_format=wire_format, compress=compress, simulate=True, max_ticks=ticks)
+    finally:
+        FixedRateScheduler.wait = wait
+        if current():
+            current().uninstall()
+        server.shutdown()
+    elapsed = time.perf_counter() - start
+    return {
+        'ticks_per_s': ticks / elapsed,
+        'received': Collector.received,
+        'batches': Collector.batches,
+        'bytes_per_reading': Collector.bytes / max(1, Collector.received),
+        'tick_lag_p50_ms': percentile(lags, 0.5) * 1000,
+        'tick_lag_p99_ms': percentile(lags, 0.99) * 1000,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pipeline benchmark')
+    parser.add_argument('--readings', dest='readings', required=False, default=2000, type=int)
+    parser.add_argument('--ticks', dest='ticks', required=False, default=500, type=int)
+    parser.add_argument('--frequency', dest='frequency_s', required=False, default=0.002, type=float)
+    parser.add_argument('--latency_ms', dest='latency_ms', required=False, default=0.0, type=float,
+                        help='Simulated bus latency per transaction')
+    parser.add_argument('--error_rate', dest='error_rate', required=False, default=0.0, type=float,
+                        help='Simulated bus errors per transaction')
+    parser.add_argument('--wire_format', dest='wire_format', required=False, default='json',
+                        choices=wire.FORMATS)
+    parser.add_argument('--compress', dest='compress', required=False, default=False, action='store_true')
+    args = parser.parse_args()
+
+    sim = Simulation(seed=0, latency_s=args.latency_ms / 1000, error_rate=args.error_rate).install()
+    try:
+        res = bench_read_sensors(args.readings)
+    finally:
+        sim.uninstall()
+    print(f'read_sensors, {args.readings} readings, {len(SENSORS)} sensors')
+    print(f'  {res["readings_per_s"]:.0f} readings/s, p50 {res["p50_ms"]:.3f}ms, p99 {res["p99_ms"]:.3f}ms')
+    print(f'  {res["net_blocks_per_reading"]:.2f} net blocks/reading, peak {res["peak_kib"]:.0f}KiB')
+
+    res = bench_main(args.ticks, args.frequency_s, args.wire_format, args.compress)
+    print(f'main(), {args.ticks} ticks every {args.frequency_s * 1000:g}ms, {args.wire_format}'
+          f'{" + gzip" if args.compress else ""}')
+    print(f'  {res["ticks_per_s"]:.0f} ticks/s, {res["received"]} readings in {res["batches"]} batches, '
+          f'{res["bytes_per_reading"]:.0f} bytes/reading')
+    print(f'  tick lag p50 {res["tick_lag_p50_ms"]:.3f}ms, p99 {res["tick_lag_p99_ms"]:.3f}ms')
@@ -0,0 +1,84 @@
+"""Building and buffering 10k readings: dicts merged per sensor vs. `Reading`
+
+What `read_sensors` does per tick, minus the sensors: start from the schema,
+merge in four sensors' metrics, keep the result in the (in-memory) spool,
+then encode the lot for the REST endpoint. Reports time per reading and
+memory held by the buffer (tracemalloc).
+
+Usage: python3 benchmarks/reading.py [--readings 10000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from reading import Reading  # noqa: E402
+from wire import encode_batch  # noqa: E402
+
+METRICS = [
+    {'tempC': 21.5},
+    {'visLight': 260, 'irLight': 253, 'uvIx': 0.02},
+    {'rawMoisture': 23360, 'voltMoisture': 1.17, 'relMoisture': 'ok'},
+    {'lumen': 120.5},
+]
+
+
+def as_dict(ts: str) -> dict:
+    # How read_sensors used to do it
+    reading = {
+        'sensorId': 'pi-b8:27:eb:00:00:01',
+        'tempC': None,
+        'visLight': None,
+        'irLight': None,
+        'uvIx': None,
+        'rawMoisture': None,
+        'voltMoisture': None,
+        'lumen': None,
+        'measurementTs': ts,
+    }
+    for metrics in METRICS:
+        reading = {**reading, **metrics}
+    return reading
+
+
+def as_record(ts: str) -> Reading:
+    reading = Reading(sensorId='pi-b8:27:eb:00:00:01', measurementTs=ts)
+    for metrics in METRICS:
+        reading.update(metrics)
+    return reading
+
+
+def bench(make, n: int) -> dict:
+    ts = [datetime.fromtimestamp(1625133600 + i, tz=timezone.utc).isoformat() for i in range(n)]
+    start = time.perf_counter()
+    buffer = [make(t) for t in ts]
+    build_s = time.perf_counter() - start
+    del buffer
+    # Separately: tracing slows allocation down
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    buffer = [make(t) for t in ts]
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    res = {'build_us': build_s / n * 1e6, 'held_bytes': (held - before) / n}
+    for fmt in ('json', 'columnar'):
+        start = time.perf_counter()
+        body, _ = encode_batch(buffer, fmt)
+        res[f'{fmt}_us'] = (time.perf_counter() - start) / n * 1e6
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reading record benchmark')
+    parser.add_argument('--readings', dest='readings', required=False, default=10000, type=int)
+    args = parser.parse_args()
+
+    print(f'{args.readings} readings, 4 sensors each')
+    for label, make in [('dict, merged per sensor', as_dict), ('Reading, in place', as_record)]:
+        res = bench(make, args.readings)
+        print(f'  {label:<24} build {res["build_us"]:.2f}us, {res["held_bytes"]:.0f} bytes/reading held, '
+              f'encode json {res["json_us"]:.2f}us, columnar {res["columnar_us"]:.2f}us')
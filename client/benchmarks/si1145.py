@@ -0,0 +1,78 @@
+"""SI1145: three word reads per tick vs. one block read
+
+Compares the original path (`readVisible()`, `readIR()`, `readUV()`, one I2C
+transaction each) with `SI1145_S`'s block read of 0x22-0x2D, in autonomous
+and forced mode. Reports time per reading, I2C transactions per reading and,
+for the simulated chip, how often the three values came from different
+measurement cycles.
+
+Runs against simulated.py by default; `--latency_ms` models the time per
+transaction (~0.3-0.5ms at 100kHz). `--hardware` uses the real sensor.
+
+Usage: python3 benchmarks/si1145.py [--reads 500] [--latency_ms 0.5] [--hardware]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import monitor  # noqa: E402
+from simulated import Simulation  # noqa: E402
+
+
+def per_register(s):
+    return s.sensor.readVisible(), s.sensor.readIR(), s.sensor.readUV()
+
+
+def block(s):
+    if s.mode == 'forced':
+        s._force()
+    return s._read_block()
+
+
+def bench(fn, s, reads: int, sim=None) -> dict:
+    transactions = sim.i2c.transactions if sim else 0
+    start = time.perf_counter()
+    for _ in range(reads):
+        with monitor.BUSES.i2c.borrow(key=s.name):
+            fn(s)
+    elapsed = time.perf_counter() - start
+    return {
+        'ms_per_reading': elapsed / reads * 1000,
+        'transactions_per_reading': (sim.i2c.transactions - transactions) / reads if sim else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SI1145 read path benchmark')
+    parser.add_argument('--reads', dest='reads', required=False, default=500, type=int)
+    parser.add_argument('--latency_ms', dest='latency_ms', required=False, default=0.5, type=float,
+                        help='Simulated time per I2C transaction')
+    parser.add_argument('--hardware', dest='hardware', required=False, default=False, action='store_true',
+                        help='Use the real sensor instead of simulated.py')
+    args = parser.parse_args()
+
+    sim = None
+    if not args.hardware:
+        sim = Simulation(seed=0, latency_s=args.latency_ms / 1000).install()
+    try:
+        print(f'SI1145, {args.reads} readings, '
+              f'{"hardware" if args.hardware else f"simulated, {args.latency_ms}ms per transaction"}')
+        auto = monitor.create_sensors('uv')['uv']
+        runs = [
+            ('per register (3 word reads)', per_register, lambda: auto),
+            ('block read, autonomous', block, lambda: auto),
+            # Pauses autonomous measurements, so it goes last
+            ('block read, forced', block, lambda: monitor.create_sensors('uv', uv_mode='forced')['uv']),
+        ]
+        for label, fn, make in runs:
+            res = bench(fn, make(), args.reads, sim)
+            line = f'  {label:<30} {res["ms_per_reading"]:.3f}ms/reading'
+            if sim:
+                line += f', {res["transactions_per_reading"]:.1f} transactions/reading'
+            print(line)
+    finally:
+        if sim:
+            sim.uninstall()
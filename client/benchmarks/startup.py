@@ -0,0 +1,73 @@
+"""Cold start: time-to-first-reading and peak RSS of monitor.py
+
+Every run is a fresh interpreter, like a systemd restart. Exits non-zero if
+a limit is exceeded, so it can gate regressions.
+
+Usage: python3 benchmarks/startup.py --sensors temp [--runs 5] [--max_first_reading_ms 2000] [--max_rss_mb 40]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import monitor
+imported = time.perf_counter()
+sensors = monitor.create_sensors(*sys.argv[1:])
+reading = monitor.read_sensors(sensors)
+first = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'in_process_ms': (first - start) * 1000,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': len(sys.modules),
+}))
+'''
+
+
+def run_once(sensors: list) -> dict:
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', CHILD] + sensors, cwd=CLIENT_DIR,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    res = json.loads(out.stdout.decode('utf-8').strip().splitlines()[-1])
+    # Includes interpreter startup
+    res['first_reading_ms'] = (time.perf_counter() - start) * 1000
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Startup benchmark')
+    parser.add_argument('--sensors', dest='sensors', required=False,
+                        default=['temp'], type=str, nargs='+', help='Sensors to create')
+    parser.add_argument('--runs', dest='runs', required=False, default=5, type=int)
+    parser.add_argument('--max_first_reading_ms', dest='max_first_reading_ms',
+                        required=False, default=None, type=float, help='Fail above this median')
+    parser.add_argument('--max_rss_mb', dest='max_rss_mb',
+                        required=False, default=None, type=float, help='Fail above this peak RSS')
+    args = parser.parse_args()
+
+    runs = [run_once(args.sensors) for _ in range(args.runs)]
+    first_ms = statistics.median(r['first_reading_ms'] for r in runs)
+    import_ms = statistics.median(r['import_ms'] for r in runs)
+    rss_mb = max(r['rss_mb'] for r in runs)
+    print(f'Sensors: {args.sensors}, {args.runs} runs')
+    print(f'import monitor:     {import_ms:.1f}ms (median)')
+    print(f'time-to-first-read: {first_ms:.1f}ms (median, incl. interpreter)')
+    print(f'peak RSS:           {rss_mb:.1f}MB')
+    print(f'modules loaded:     {runs[-1]["modules"]}')
+
+    failed = False
+    if args.max_first_reading_ms and first_ms > args.max_first_reading_ms:
+        print(f'FAIL: time-to-first-read above {args.max_first_reading_ms}ms')
+        failed = True
+    if args.max_rss_mb and rss_mb > args.max_rss_mb:
+        print(f'FAIL: peak RSS above {args.max_rss_mb}MB')
+        failed = True
+    sys.exit(1 if failed else 0)
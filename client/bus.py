@@ -0,0 +1,210 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+
+def _busio_i2c():
+    import busio
+    from board import SCL, SDA
+    return busio.I2C(SCL, SDA)
+
+
+def _smbus_i2c():
+    from smbus2 import SMBus
+    return SMBus(1)
+
+
+def _busio_spi():
+    import busio
+    from board import SCK, MISO, MOSI
+    return busio.SPI(clock=SCK, MISO=MISO, MOSI=MOSI)
+
+
+class Bus():
+    """A long-lived physical bus (i2c-1, spi0), shared by all sensors on it
+
+    A bus can be driven through several libraries (e.g. `busio` and `smbus2`
+    both talk to /dev/i2c-1), so handles are keyed by `kind` and opened
+    lazily, once. All of them share a single lock, since it's one set of wires.
+
+    Some drivers (SI1145, i2clcd) open their own handle internally. They still
+    borrow the bus with `kind=None` to serialize with everyone else.
+    """
+
+    def __init__(self, name: str, lock_timeout_s=5.0, **factories):
+        self.name = name
+        self.lock_timeout_s = lock_timeout_s
+        self._factories = factories
+        self._handles = {}
+        self._lock = threading.RLock()
+        # Bumped on every reconnect, so drivers know to rebuild their device objects
+        self.generation = 0
+        self.reconnects = 0
+        self.stats = {}
+        # With worker processes: a file they all flock, see `share`
+        self._shared_path = None
+        self._shared = None
+        self._depth = 0
+
+    def _handle(self, kind):
+        if kind is None:
+            return None
+        if kind not in self._handles:
+            logger.debug('Opening %s handle on %s', kind, self.name)
+            self._handles[kind] = self._factories[kind]()
+        return self._handles[kind]
+
+    def reset(self):
+        """Close all open handles. The next `borrow` reconnects."""
+        with self._lock:
+            for kind, handle in self._handles.items():
+                for close in ('deinit', 'close'):
+                    fn = getattr(handle, close, None)
+                    if fn:
+                        try:
+                            fn()
+                        except Exception as e:
+                            logger.debug('Error closing %s on %s: %s', kind, self.name, e)
+                        break
+            self._handles = {}
+            self.generation += 1
+
+    def share(self, path: str):
+        """Also lock the bus against other processes, e.g. sensor workers
+
+        Uses flock on `path`, which the kernel drops when the holder dies,
+        so a killed worker can't keep the bus locked.
+        """
+        self._shared_path = path
+        self._shared = open(path, 'a')
+
+    def unshare(self):
+        with self._lock:
+            if self._shared:
+                self._shared.close()
+            self._shared_path = self._shared = None
+
+    def after_fork(self, lock_timeout_s: float = None):
+        """In a forked worker: drop what came along from the parent
+
+        The lock may have been held by one of the parent's threads, and the
+        handles are the parent's file descriptors. They are not closed, that
+        would only close the copies; the next `borrow` opens fresh ones.
+
+        Args:
+            lock_timeout_s (float, optional): Wait at most this long for the bus from now on
+        """
+        if lock_timeout_s is not None:
+            self.lock_timeout_s = min(self.lock_timeout_s, lock_timeout_s)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._handles = {}
+        self.stats = {}
+        self.generation += 1
+        if self._shared_path:
+            # flock goes by open file, and the inherited one is the parent's
+            self._shared.close()
+            self._shared = open(self._shared_path, 'a')
+
+    def _lock_shared(self) -> bool:
+        deadline = time.monotonic() + self.lock_timeout_s
+        while True:
+            try:
+                fcntl.flock(self._shared, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.001)
+
+    def _stats_for(self, key) -> LatencyStats:
+        if key not in self.stats:
+            self.stats[key] = LatencyStats()
+        return self.stats[key]
+
+    @contextmanager
+    def borrow(self, kind=None, key=None):
+        """Lock the bus and hand out a (shared) handle
+
+        I/O errors reset the bus, so the next borrow gets a fresh handle.
+
+        Args:
+            kind (str, optional): Handle type, e.g. 'busio' or 'smbus'. Defaults to None (lock only).
+            key (str, optional): Name to record latency under. Defaults to the bus name.
+
+        Raises:
+            TimeoutError: If the bus is held by someone else for too long
+
+        Yields:
+            object: The handle, or None
+        """
+        if not self._lock.acquire(timeout=self.lock_timeout_s):
+            raise TimeoutError(f'Timed out waiting for bus {self.name}')
+        if self._shared and not self._depth and not self._lock_shared():
+            self._lock.release()
+            raise TimeoutError(f'Timed out waiting for bus {self.name}, held by another process')
+        self._depth += 1
+        start = time.monotonic()
+        error = False
+        try:
+            yield self._handle(kind)
+        except OSError as e:
+            error = True
+            self.reconnects += 1
+            logger.warning('I/O error on %s, reconnecting: %s', self.name, e)
+            self.reset()
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._stats_for(key or self.name).observe(
+                time.monotonic() - start, error=error)
+            self._depth -= 1
+            if self._shared and not self._depth:
+                fcntl.flock(self._shared, fcntl.LOCK_UN)
+            self._lock.release()
+
+
+class BusManager():
+    """Owns all buses on this machine. Sensors borrow from here."""
+
+    def __init__(self, i2c: Bus = None, spi: Bus = None):
+        self.i2c = i2c or Bus('i2c', busio=_busio_i2c, smbus=_smbus_i2c)
+        self.spi = spi or Bus('spi', busio=_busio_spi)
+
+    def get(self, name: str) -> Bus:
+        return getattr(self, name)
+
+    def share(self, lock_dir: str):
+        """See `Bus.share`. One lock file per bus in `lock_dir`"""
+        for bus in (self.i2c, self.spi):
+            bus.share(os.path.join(lock_dir, f'{bus.name}.lock'))
+
+    def unshare(self):
+        for bus in (self.i2c, self.spi):
+            bus.unshare()
+
+    def after_fork(self, lock_timeout_s: float = None):
+        """See `Bus.after_fork`"""
+        for bus in (self.i2c, self.spi):
+            bus.after_fork(lock_timeout_s)
+
+    def stats(self) -> dict:
+        """Per-read latency counters, by bus and sensor
+
+        Returns:
+            dict: bus -> key -> counters
+        """
+        return {b.name: {k: s.as_dict() for k, s in b.stats.items()}
+                for b in (self.i2c, self.spi)}
+
+
+BUSES = BusManager()
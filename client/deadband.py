@@ -0,0 +1,285 @@
+"""Report by exception: only send readings the server can't work out itself
+
+Per metric, a value is only sent once it leaves a tolerance around what
+the server would rebuild from the values it already has:
+
+- 'deadband': the server holds the last value it got. A value is sent
+  once it's more than `tolerance` away from that.
+- 'swinging_door': the server draws straight lines between the values it
+  got. A value is held back as long as one line from the last value sent
+  passes within `tolerance` of everything held back since; once none does,
+  the last held-back reading is sent and becomes the new start.
+
+Readings are sent whole: if one metric needs a point, the others ride along
+(and restart from it, too). So the server still gets one row per reading,
+just fewer of them.
+"""
+import math
+from datetime import datetime, timezone
+
+from metrics import METRICS
+
+# Same as server/server.go. Crossing one of these is sent right away, so
+# the server alerts on time
+MIN_TEMP_C = 5
+MAX_TEMP_C = 60
+LOW_MOISTURE_THRESHOLD_V = 2.2
+
+# Column -> tolerance, in the column's unit. Around 3x the sensors' noise:
+# any column leaving its tolerance sends the whole reading, so one that's
+# too tight costs all the others. Anything not listed only suppresses
+# exact repeats
+TOLERANCES = {
+    'tempC': 0.2,
+    'visLight': 10,
+    'irLight': 10,
+    'uvIx': 0.2,
+    'rawMoisture': 1000,
+    'voltMoisture': 0.05,
+    'lumen': 250,
+}
+
+# Not metrics
+KEYS = ('sensorId', 'measurementTs')
+
+
+def _ts(ts: str) -> float:
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _is_number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def in_alarm(column: str, v: float) -> bool:
+    """Whether the server would alert on this value"""
+    if column == 'tempC':
+        return v <= MIN_TEMP_C or v >= MAX_TEMP_C
+    if column == 'voltMoisture':
+        return v >= LOW_MOISTURE_THRESHOLD_V
+    return False
+
+
+class Deadband():
+    """Rebuilt by holding the last value sent"""
+    __slots__ = ('tolerance', 'value')
+    # Fails on the point that has to be sent
+    holds = False
+
+    def __init__(self, tolerance: float):
+        self.tolerance = tolerance
+        self.value = None
+
+    def fits(self, t: float, v: float) -> bool:
+        return abs(v - self.value) <= self.tolerance
+
+    def hold(self, t: float, v: float):
+        pass
+
+    def sent(self, t: float, v: float):
+        self.value = v
+
+
+class SwingingDoor():
+    """Rebuilt by straight lines between the values sent
+
+    Keeps the range of slopes from the last value sent that pass within
+    `tolerance` of every point held back since. A new point fits if the
+    line to it is in that range.
+    """
+    __slots__ = ('tolerance', 't0', 'v0', 'lo', 'hi')
+    # Fails on the point after the one that has to be sent
+    holds = True
+
+    def __init__(self, tolerance: float):
+        self.tolerance = tolerance
+        self.t0 = self.v0 = None
+        self.lo, self.hi = -math.inf, math.inf
+
+    def fits(self, t: float, v: float) -> bool:
+        dt = t - self.t0
+        if dt <= 0:
+            return abs(v - self.v0) <= self.tolerance
+        return self.lo <= (v - self.v0) / dt <= self.hi
+
+    def hold(self, t: float, v: float):
+        dt = t - self.t0
+        if dt <= 0:
+            return
+        # Close the door a bit
+        self.lo = max(self.lo, (v - self.tolerance - self.v0) / dt)
+        self.hi = min(self.hi, (v + self.tolerance - self.v0) / dt)
+
+    def sent(self, t: float, v: float):
+        self.t0, self.v0 = t, v
+        self.lo, self.hi = -math.inf, math.inf
+
+
+MODES = {
+    'deadband': Deadband,
+    'swinging_door': SwingingDoor,
+}
+
+
+def metrics_of(reading) -> tuple:
+    """Split a reading into numbers and everything else
+
+    Probes count as metrics of their own, e.g. `bed1/voltMoisture`.
+
+    Returns:
+        tuple: (column -> number, column -> other value), without Nones
+    """
+    numbers, labels = {}, {}
+
+    def add(k, v):
+        if v is None:
+            return
+        if _is_number(v):
+            numbers[k] = v
+        else:
+            labels[k] = v
+
+    for k, v in reading.items():
+        if k in KEYS:
+            continue
+        if k == 'probes' and v:
+            for p in v:
+                pid = p.get('probeId')
+                for pk, pv in p.items():
+                    if pk != 'probeId':
+                        add(f'{pid}/{pk}', pv)
+            continue
+        add(k, v)
+    return numbers, labels
+
+
+class ExceptionReporter():
+    """Decides which readings to send
+
+    Besides a value leaving its tolerance, a reading is sent right away if
+    a value crosses a server alert threshold (either way), a non-numeric
+    value (e.g. relMoisture) changes, a metric shows up for the first time,
+    or nothing was sent for `heartbeat_s`.
+
+    Args:
+        mode (str, optional): 'deadband' or 'swinging_door'. Defaults to 'swinging_door'.
+        tolerances (dict, optional): Column -> tolerance, on top of TOLERANCES. Probes
+            use their column's, e.g. voltMoisture.
+        heartbeat_s (float, optional): Send at least this often. 0 disables it. Defaults to 900.
+    """
+
+    def __init__(self, mode='swinging_door', tolerances: dict = None, heartbeat_s=900.0, metrics=METRICS):
+        if mode not in MODES:
+            raise ValueError(f'Unknown mode {mode}, expected one of {list(MODES)}')
+        self.mode = mode
+        self._make = MODES[mode]
+        self.tolerances = {**TOLERANCES, **(tolerances or {})}
+        self.heartbeat_s = heartbeat_s
+        self._states = {}
+        self._labels = {}
+        self._alarms = {}
+        # Held back, for when the door closes on the next one
+        self._held = None
+        self._last_sent_t = None
+        self.received = 0
+        self.sent = 0
+        self._suppressed_total = metrics.counter('report_readings_suppressed_total',
+                                                 'Readings held back by report by exception')
+
+    def _tolerance(self, key: str) -> float:
+        return self.tolerances.get(key.rpartition('/')[2], 0.0)
+
+    def _send(self, t: float, reading, numbers: dict, labels: dict):
+        for k, v in numbers.items():
+            state = self._states.get(k)
+            if state is None:
+                state = self._states[k] = self._make(self._tolerance(k))
+            state.sent(t, v)
+        self._labels.update(labels)
+        self._held = None
+        self._last_sent_t = t
+        self.sent += 1
+        return reading
+
+    def add(self, reading) -> list:
+        """Add a raw (or aggregated) reading
+
+        Returns:
+            list: Readings to send: none, this one, and/or the one held back before it
+        """
+        self.received += 1
+        t = _ts(reading['measurementTs'])
+        numbers, labels = metrics_of(reading)
+        out = []
+
+        # Can the server still draw a line through what we held back?
+        if self._held is not None:
+            if any(s.holds and not s.fits(t, numbers[k]) for k, s in self._states.items() if k in numbers):
+                out.append(self._send(*self._held))
+
+        force = self._last_sent_t is None or (self.heartbeat_s and t - self._last_sent_t >= self.heartbeat_s)
+        for k, v in numbers.items():
+            column = k.rpartition('/')[2]
+            alarm = in_alarm(column, v)
+            if alarm != self._alarms.get(k, False):
+                force = True
+            self._alarms[k] = alarm
+            state = self._states.get(k)
+            if state is None or (not state.holds and not state.fits(t, v)):
+                force = True
+        if any(self._labels.get(k) != v for k, v in labels.items()):
+            force = True
+
+        if force:
+            out.append(self._send(t, reading, numbers, labels))
+            return out
+        for k, v in numbers.items():
+            self._states[k].hold(t, v)
+        self._held = (t, reading, numbers, labels)
+        self._suppressed_total.inc()
+        return out
+
+    def flush(self) -> list:
+        """The reading held back, if any, e.g. on shutdown, so the series ends where it did"""
+        if self._held is None:
+            return []
+        return [self._send(*self._held)]
+
+    @property
+    def ratio(self) -> float:
+        """Readings received per reading sent"""
+        return self.received / self.sent if self.sent else 0.0
+
+    def stats(self) -> dict:
+        return {'received': self.received, 'sent': self.sent, 'ratio': self.ratio}
+
+
+def rebuild(points: list, t: float, mode='swinging_door') -> float:
+    """What the server makes of the values it got, at time t
+
+    Args:
+        points (list): (time, value) as sent, in time order
+        t (float): Between the first and last point
+        mode (str, optional): Defaults to 'swinging_door'.
+
+    Returns:
+        float: The held value or the value on the line, None outside the points
+    """
+    if not points or t < points[0][0] or t > points[-1][0]:
+        return None
+    lo, hi = 0, len(points) - 1
+    # Last point at or before t
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if points[mid][0] <= t:
+            lo = mid
+        else:
+            hi = mid - 1
+    t0, v0 = points[lo]
+    if mode == 'deadband' or lo == len(points) - 1 or t == t0:
+        return v0
+    t1, v1 = points[lo + 1]
+    return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
@@ -0,0 +1,201 @@
+import logging
+import threading
+import time
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+
+def soil_page(reading: dict) -> tuple:
+    relMoisture = reading.get('relMoisture')
+    voltMoisture = reading.get('voltMoisture')
+    if relMoisture and voltMoisture:
+        ln1 = 'Soil: {} [{:.2f}]'.format(relMoisture, voltMoisture)
+    else:
+        ln1 = 'Soil: N/A'
+    tempC = reading.get('tempC')
+    if tempC:
+        ln2 = 'Temp: {:.2f}C'.format(tempC)
+    else:
+        ln2 = 'Temp: N/A'
+    return ln1, ln2
+
+
+def light_page(reading: dict) -> tuple:
+    lumen = reading.get('lumen')
+    uvIx = reading.get('uvIx')
+    ln1 = 'Lux: {:.0f}'.format(lumen) if lumen is not None else 'Lux: N/A'
+    ln2 = 'UV: {:.2f}'.format(uvIx) if uvIx is not None else 'UV: N/A'
+    return ln1, ln2
+
+
+def spectrum_page(reading: dict) -> tuple:
+    vis = reading.get('visLight')
+    ir = reading.get('irLight')
+    ln1 = 'Vis: {}'.format(vis) if vis is not None else 'Vis: N/A'
+    ln2 = 'IR: {}'.format(ir) if ir is not None else 'IR: N/A'
+    return ln1, ln2
+
+
+# Name -> reading -> lines, for `--lcd_pages`
+PAGES = {
+    'soil': soil_page,
+    'light': light_page,
+    'spectrum': spectrum_page,
+}
+
+
+class FrameBuffer():
+    """What's on the screen, so we only send what changed
+
+    Args:
+        width (int, optional): Characters per line. Defaults to 16.
+        lines (int, optional): Defaults to 2.
+    """
+
+    def __init__(self, width=16, lines=2):
+        self.width = width
+        self.lines = lines
+        # None: unknown, e.g. after an error. Forces a full redraw
+        self._screen = None
+
+    def _pad(self, text: str) -> bytes:
+        return text.encode('ascii', 'replace')[:self.width].ljust(self.width)
+
+    def diff(self, lines) -> tuple:
+        """Changed runs between the screen and `lines`
+
+        Runs closer than 4 characters are merged: moving the cursor costs
+        about as much as writing the characters in between.
+
+        Args:
+            lines (list): One str per line
+
+        Returns:
+            tuple: (line, column, bytes) runs to write, and the new screen for `commit`
+        """
+        new = [self._pad(lines[i] if i < len(lines) else '') for i in range(self.lines)]
+        runs = []
+        for i, text in enumerate(new):
+            old = self._screen[i] if self._screen else None
+            if old is None:
+                runs.append((i, 0, text))
+                continue
+            start = end = None
+            for col in range(self.width):
+                if text[col] == old[col]:
+                    continue
+                if start is not None and col - end > 4:
+                    runs.append((i, start, text[start:end]))
+                    start = None
+                if start is None:
+                    start = col
+                end = col + 1
+            if start is not None:
+                runs.append((i, start, text[start:end]))
+        return runs, new
+
+    def commit(self, new: list):
+        self._screen = new
+
+    def invalidate(self):
+        self._screen = None
+
+
+class LcdRenderer():
+    """Draws readings on an HD44780-style LCD in the background
+
+    `update()` only stores the latest reading, so the sampling loop never
+    waits on the display. The renderer wakes every `refresh_s`, rotates to the
+    next page every `page_s`, and only writes the characters that changed.
+
+    Args:
+        lcd (i2clcd.i2clcd): Needs `move_cursor(line, column)` and `print(bytes)`
+        borrow (callable): Context manager holding the bus while we write
+        pages (list, optional): Callables reading -> lines. Defaults to the soil page.
+        refresh_s (float, optional): Defaults to 1.0.
+        page_s (float, optional): 0 never rotates. Defaults to 0.
+    """
+
+    def __init__(self, lcd, borrow, pages=None, refresh_s=1.0, page_s=0.0, width=16, lines=2,
+                 clock=time.monotonic):
+        self.lcd = lcd
+        self._borrow = borrow
+        self.pages = pages or [soil_page]
+        self.refresh_s = refresh_s
+        self.page_s = page_s
+        self.fb = FrameBuffer(width, lines)
+        self._clock = clock
+        self._start = clock()
+        self._reading = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.chars_written = 0
+        self.frames = 0
+        self.draw = LatencyStats()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='lcd', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout_s=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout_s)
+
+    def update(self, reading: dict):
+        """Show this reading on the next refresh. Never blocks on I/O."""
+        with self._lock:
+            self._reading = reading
+
+    def page(self):
+        if self.page_s <= 0 or len(self.pages) == 1:
+            return self.pages[0]
+        return self.pages[int((self._clock() - self._start) // self.page_s) % len(self.pages)]
+
+    def render(self) -> int:
+        """Draw the latest reading, if any
+
+        Returns:
+            int: Characters written
+        """
+        with self._lock:
+            reading = self._reading
+        if reading is None:
+            return 0
+        runs, new = self.fb.diff(self.page()(reading))
+        self.frames += 1
+        if not runs:
+            return 0
+        start = time.perf_counter()
+        try:
+            with self._borrow():
+                for line, col, text in runs:
+                    self.lcd.move_cursor(line, col)
+                    self.lcd.print(text)
+        except Exception as e:
+            # Half-written, we don't know what's on screen anymore
+            self.fb.invalidate()
+            self.draw.observe(time.perf_counter() - start, error=True)
+            logger.error('LCD failed showing data %s: %s', reading, e)
+            return 0
+        self.draw.observe(time.perf_counter() - start)
+        self.fb.commit(new)
+        written = sum(len(text) for _, _, text in runs)
+        self.chars_written += written
+        return written
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.render()
+            self._stop.wait(self.refresh_s)
+
+    def stats(self) -> dict:
+        return {
+            'frames': self.frames,
+            'chars_written': self.chars_written,
+            'draw': self.draw.as_dict(),
+        }
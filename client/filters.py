@@ -0,0 +1,69 @@
+import statistics
+from bisect import bisect_left
+
+# Name -> callable(samples) -> value, for `--oversample_filter`
+FILTERS = {}
+
+
+def _filter(name):
+    def register(fn):
+        FILTERS[name] = fn
+        return fn
+    return register
+
+
+@_filter('median')
+def median(samples: list) -> float:
+    """Middle sample. Ignores single spikes entirely."""
+    return statistics.median(samples)
+
+
+@_filter('trimmed')
+def trimmed_mean(samples: list, trim=0.2) -> float:
+    """Mean without the lowest and highest `trim` fraction of samples
+
+    Smoother than the median on Gaussian noise, still robust to the odd spike.
+    With fewer than 3 samples, nothing is trimmed.
+    """
+    samples = sorted(samples)
+    k = int(len(samples) * trim)
+    if k and len(samples) - 2 * k > 0:
+        samples = samples[k:-k]
+    return sum(samples) / len(samples)
+
+
+@_filter('mean')
+def mean(samples: list) -> float:
+    return sum(samples) / len(samples)
+
+
+class Hysteresis():
+    """Maps a value to a label by thresholds, but only changes the label once
+    the value is more than `band` past the threshold
+
+    Without it, a value sitting right on a threshold flips the label every tick.
+
+    Args:
+        thresholds (list): Ascending upper bounds (inclusive) of all but the last label
+        labels (list): One more than thresholds
+        band (float, optional): Dead band around each threshold. Defaults to 0.0.
+    """
+
+    def __init__(self, thresholds: list, labels: list, band=0.0):
+        if len(labels) != len(thresholds) + 1:
+            raise ValueError(f'Need {len(thresholds) + 1} labels, got {len(labels)}')
+        self.thresholds = list(thresholds)
+        self.labels = list(labels)
+        self.band = band
+        self._state = None
+
+    def __call__(self, value: float) -> str:
+        i = bisect_left(self.thresholds, value)
+        if self._state is not None and i != self._state:
+            if i > self._state:
+                # Rising: must clear the threshold by the band
+                i = max(self._state, bisect_left(self.thresholds, value - self.band))
+            else:
+                i = min(self._state, bisect_left(self.thresholds, value + self.band))
+        self._state = i
+        return self.labels[i]
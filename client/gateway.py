@@ -0,0 +1,307 @@
+"""Edge gateway: takes uploads from many nodes, forwards them in large batches
+
+Runs on a hub in the greenhouse. Nodes point `--rest_endpoint` at it instead
+of the server; it speaks the same protocol as the server's `/` handler (JSON
+array or columnar, optionally gzipped). Readings are spooled, then sent
+upstream by one `Uploader`, i.e. over one keep-alive connection, with
+backoff, once `--batch_max` readings are in or the oldest waited
+`--batch_wait` seconds.
+
+Metrics (see `--metrics_port`): `gateway_*` for the nodes' side, `upload_*`
+for the server's, incl. `upload_reading_age_seconds` from measurement to
+the server acknowledging it.
+
+Usage: python3 gateway.py --upstream http://server.local:7777 [--port 7777] [--batch_max 1000] [--batch_wait 2] [--spool_dir /var/lib/raspberry-gardener/gateway]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import METRICS, MetricsExporter
+from spool import MemorySpool, Spool
+from uploader import Uploader
+from wire import COLUMNAR, decode_columnar
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 405: 'Method Not Allowed', 411: 'Length Required',
+            413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def _gunzip(body: bytes, max_bytes: int) -> bytes:
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        out = d.decompress(body, max_bytes + 1)
+    except zlib.error as e:
+        raise ValueError(f'Bad gzip body: {e}')
+    if len(out) > max_bytes:
+        raise BodyTooLarge(f'Body inflates to more than {max_bytes} bytes')
+    if not d.eof:
+        raise ValueError('Bad gzip body: truncated')
+    return out
+
+
+def decode_body(body: bytes, content_type: str, content_encoding: str, max_bytes=64 * 1024 * 1024) -> list:
+    """Like decodeBody in server/wire.go
+
+    Args:
+        max_bytes (int, optional): Limit on the decompressed body. Defaults to 64 MiB.
+
+    Raises:
+        BodyTooLarge: If a gzipped body inflates past `max_bytes`
+        ValueError: If it's not a batch of readings
+
+    Returns:
+        list: Reading dicts
+    """
+    if content_encoding == 'gzip':
+        body = _gunzip(body, max_bytes)
+    payload = json.loads(body)
+    if content_type.split(';')[0].strip() == COLUMNAR:
+        if not isinstance(payload, dict):
+            raise ValueError('Expected a columnar batch')
+        try:
+            payload = decode_columnar(payload)
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError(f'Bad columnar batch: {e}')
+    if not isinstance(payload, list) or not all(isinstance(r, dict) for r in payload):
+        raise ValueError('Expected an array of readings')
+    return payload
+
+
+class Gateway():
+    """Accepts batches from nodes, coalesces them, and forwards them
+
+    A batch is acknowledged once it's in the spool. A batch that would take
+    the spool past `max_buffered` readings gets a 503, so nodes keep it in
+    their own spools and retry, rather than the gateway dropping anything.
+
+    Args:
+        uploader (Uploader): Sends the spool upstream
+        batch_wait_s (float, optional): Max time a reading waits for a full batch. Defaults to 2.0.
+        max_buffered (int, optional): Defaults to 100000.
+        max_body_bytes (int, optional): Defaults to 8 MiB.
+        max_inflated_bytes (int, optional): Limit on a gzipped body, decompressed. Defaults to 64 MiB.
+    """
+
+    def __init__(self, uploader: Uploader, batch_wait_s=2.0, max_buffered=100000,
+                 max_body_bytes=8 * 1024 * 1024, max_inflated_bytes=64 * 1024 * 1024, metrics=METRICS):
+        self.uploader = uploader
+        self.spool = uploader.spool
+        self.batch_wait_s = batch_wait_s
+        self.max_buffered = max_buffered
+        self.max_body_bytes = max_body_bytes
+        self.max_inflated_bytes = max_inflated_bytes
+        # Readings accepted, but not in the spool yet
+        self._reserved = 0
+        self.received = 0
+        self._timer = None
+        self._server = None
+        # Spool appends write (and sometimes fsync) files, so not on the
+        # event loop. One thread keeps batches whole and in order.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gateway-spool')
+        self._metrics = metrics
+        self._readings_total = metrics.counter('gateway_readings_received_total', 'Readings accepted from nodes')
+        self._request_hist = metrics.histogram('gateway_request_seconds', 'Time to accept a batch from a node')
+        metrics.gauge('gateway_connections', lambda: self.connections, 'Open connections from nodes')
+        self.connections = 0
+
+    def _requests_total(self, status: int):
+        return self._metrics.counter('gateway_requests_total', 'Batches from nodes, by response', code=str(status))
+
+    async def start(self, host='0.0.0.0', port=7777) -> int:
+        self._server = await asyncio.start_server(self._handle, host, port, backlog=1024)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        # Whatever was acknowledged is in the spool before the uploader stops
+        self._writer.shutdown(wait=True)
+
+    def _flush_due(self):
+        self._timer = None
+        self.uploader.notify(flush=True)
+
+    def _append(self, readings: list):
+        for r in readings:
+            self.spool.append(r)
+
+    async def accept(self, readings: list):
+        """Spool a batch from a node and tell the uploader"""
+        self._reserved += len(readings)
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._writer, self._append, readings)
+        finally:
+            self._reserved -= len(readings)
+        self.received += len(readings)
+        self._readings_total.inc(len(readings))
+        if len(self.spool) >= self.uploader.batch_size:
+            self.uploader.notify()
+        elif self._timer is None:
+            # Covers everything spooled until it fires
+            self._timer = asyncio.get_running_loop().call_later(self.batch_wait_s, self._flush_due)
+
+    def _respond(self, writer, status: int, close=False):
+        head = f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\nContent-Length: 0\r\n'
+        if close:
+            head += 'Connection: close\r\n'
+        writer.write((head + '\r\n').encode('latin-1'))
+        self._requests_total(status).inc()
+
+    async def _request(self, reader, writer) -> bool:
+        """One request on a keep-alive connection
+
+        Returns:
+            bool: Whether to keep the connection open
+        """
+        request = await reader.readline()
+        if not request:
+            return False
+        start = time.perf_counter()
+        method = request.split(b' ', 1)[0]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'content-length' not in headers:
+            # No chunked uploads, the nodes don't send them
+            self._respond(writer, 411, close=True)
+            return False
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._respond(writer, 400, close=True)
+            return False
+        if length > self.max_body_bytes:
+            self._respond(writer, 413, close=True)
+            return False
+        body = await reader.readexactly(length)
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if method != b'POST':
+            status = 405
+        elif len(self.spool) + self._reserved >= self.max_buffered:
+            # Don't even decode it
+            status = 503
+        else:
+            try:
+                # Inflating and parsing a big batch takes a while
+                readings = await asyncio.get_running_loop().run_in_executor(
+                    None, decode_body, body, headers.get('content-type', ''),
+                    headers.get('content-encoding', ''), self.max_inflated_bytes)
+            except ValueError as e:
+                logger.warning('Bad batch from %s: %s', writer.get_extra_info('peername'), e)
+                status = 413 if isinstance(e, BodyTooLarge) else 400
+            else:
+                # Checked again: other batches may have come in while decoding. A batch that
+                # doesn't fit whole is refused, or the spool would drop what we acknowledged
+                if len(self.spool) + self._reserved + len(readings) > self.max_buffered:
+                    status = 503
+                else:
+                    await self.accept(readings)
+                    status = 200
+        self._respond(writer, status, close=not keep_alive)
+        await writer.drain()
+        self._request_hist.observe(time.perf_counter() - start)
+        return keep_alive
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while await self._request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    def stats(self) -> dict:
+        return {'received': self.received, 'connections': self.connections, 'upstream': self.uploader.stats()}
+
+
+async def serve(args):
+    if args.spool_dir:
+        spool = Spool(args.spool_dir, max_bytes=int(args.spool_mb * 1024 * 1024))
+        if len(spool) > 0:
+            logger.warning('Replaying %d spooled readings', len(spool))
+    else:
+        spool = MemorySpool(max_items=args.max_buffered)
+    uploader = Uploader(args.upstream, spool, batch_size=args.batch_max, timeout_s=args.http_timeout_s,
+                        wire_format=args.wire_format, compress=args.compress,
+                        dead_letter_path=args.dead_letter_file)
+    uploader.start()
+    gateway = Gateway(uploader, batch_wait_s=args.batch_wait_s, max_buffered=args.max_buffered)
+    port = await gateway.start(args.host, args.port)
+    logger.warning('Gateway on %s:%d, forwarding to %s', args.host, port, args.upstream)
+    exporter = None
+    if args.metrics_port is not None:
+        exporter = MetricsExporter(port=args.metrics_port).start()
+    # Whatever is left after a restart
+    uploader.notify(flush=True)
+    try:
+        while True:
+            await asyncio.sleep(60)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('Gateway stats: %s', gateway.stats())
+    finally:
+        await gateway.stop()
+        uploader.stop()
+        uploader.flush()
+        spool.close()
+        if exporter:
+            exporter.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Coalescing gateway between nodes and the server')
+    parser.add_argument('--upstream', dest='upstream', required=True, type=str, help='The server, e.g. http://server.local:7777')
+    parser.add_argument('--host', dest='host', required=False, default='0.0.0.0', type=str)
+    parser.add_argument('--port', dest='port', required=False, default=7777, type=int)
+    parser.add_argument('--batch_max', dest='batch_max', required=False, default=1000, type=int,
+                        help='Readings per request to the server')
+    parser.add_argument('--batch_wait', dest='batch_wait_s', required=False, default=2.0, type=float,
+                        help='Forward a partial batch once its oldest reading waited this many seconds')
+    parser.add_argument('--max_buffered', dest='max_buffered', required=False, default=100000, type=int,
+                        help='Answer 503 to batches that would take the readings waiting to be forwarded past this')
+    parser.add_argument('--spool_dir', dest='spool_dir', required=False, default=None, type=str,
+                        help='Spool readings to disk until the server acknowledged them. In-memory if not set')
+    parser.add_argument('--dead_letter_file', dest='dead_letter_file', required=False, default=None, type=str,
+                        help='Append batches the server rejects for good (4xx) to this file, as JSON lines. Dropped if not set')
+    parser.add_argument('--spool_mb', dest='spool_mb', required=False, default=256, type=float)
+    parser.add_argument('--http_timeout', dest='http_timeout_s', required=False, default=30.0, type=float)
+    parser.add_argument('--wire_format', dest='wire_format', required=False, default='json',
+                        choices=['json', 'columnar'], help='Batch encoding for the server. columnar needs a matching server')
+    parser.add_argument('--compress', dest='compress', required=False, default=False, action='store_true',
+                        help='gzip batches sent to the server')
+    parser.add_argument('--metrics_port', dest='metrics_port', required=False, default=None, type=int,
+                        help='Serve Prometheus-style metrics on 127.0.0.1:<port>/metrics')
+    parser.add_argument('--verbose', dest='verbose', required=False, default=False, action='store_true')
+    args = parser.parse_args()
+
+    from logs import setup_logging
+    log_listener = setup_logging(logging.INFO if args.verbose else logging.WARNING)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if log_listener:
+            log_listener.stop()
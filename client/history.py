@@ -0,0 +1,238 @@
+"""Local history of readings, for looking at a node offline
+
+Usage: python3 history.py --file /var/lib/raspberry-gardener/history.bin --column voltMoisture [--minutes 60] [--step 300]
+"""
+import argparse
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Numeric columns of the `data` table
+COLUMNS = ('tempC', 'visLight', 'irLight', 'uvIx', 'rawMoisture', 'voltMoisture', 'lumen')
+
+_MAGIC = b'RGTS'
+_VERSION = 1
+# magic, version, capacity, total appends, number of columns
+_HEADER = struct.Struct('<4sIQQI')
+# Header plus column names, so the arrays start page aligned
+_HEADER_BYTES = 4096
+_NAN = float('nan')
+
+
+def _ts_us(ts: str) -> int:
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(round(dt.timestamp() * 1e6))
+
+
+class History():
+    """Fixed-size ring of readings in a memory-mapped file, one array per column
+
+    Layout: a 4 KiB header, then `capacity` int64 timestamps (us since epoch),
+    then `capacity` float64 values per column (NaN for no reading). Once full,
+    the oldest rows are overwritten. Rows are written before the header's
+    append counter, so a crash loses at most the row in flight.
+
+    Queries binary search the timestamps and only touch the rows in range,
+    so they don't load the file. That assumes time goes forward; around a
+    clock jump back, ranges are approximate.
+
+    Args:
+        path (str): File, created if missing
+        max_bytes (int, optional): File size, sets the retention. Only used when creating
+            the file. Defaults to 16 MiB (~260k rows, 3 days at 1s).
+        columns (tuple, optional): Numeric columns to keep. Defaults to COLUMNS.
+    """
+
+    def __init__(self, path: str, max_bytes=16 * 1024 * 1024, columns=COLUMNS):
+        self.path = path
+        self._lock = threading.Lock()
+        exists = os.path.exists(path) and os.path.getsize(path) >= _HEADER_BYTES
+        self._f = open(path, 'r+b' if exists else 'w+b')
+        if exists:
+            magic, version, capacity, total, ncols = _HEADER.unpack(self._f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f'{path} is not a history file')
+            stored = tuple(json.loads(self._f.read(_HEADER_BYTES - _HEADER.size).rstrip(b'\0')))
+            if stored != tuple(columns):
+                raise ValueError(f'{path} has columns {stored}, not {tuple(columns)}')
+            if os.path.getsize(path) != _HEADER_BYTES + capacity * 8 * (1 + ncols):
+                raise ValueError(f'{path} is truncated')
+        else:
+            capacity = (max_bytes - _HEADER_BYTES) // (8 * (1 + len(columns)))
+            if capacity < 1:
+                raise ValueError(f'{max_bytes} bytes is too small')
+            names = json.dumps(list(columns)).encode('utf-8')
+            if _HEADER.size + len(names) > _HEADER_BYTES:
+                raise ValueError('Too many columns')
+            self._f.truncate(_HEADER_BYTES + capacity * 8 * (1 + len(columns)))
+            self._f.write(_HEADER.pack(_MAGIC, _VERSION, capacity, 0, len(columns)) + names)
+            self._f.flush()
+            total = 0
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self._total = total
+        self._mm = mmap.mmap(self._f.fileno(), 0)
+        mv = memoryview(self._mm)
+        size = capacity * 8
+        self._ts = mv[_HEADER_BYTES:_HEADER_BYTES + size].cast('q')
+        self._cols = {}
+        for i, name in enumerate(self.columns):
+            start = _HEADER_BYTES + size * (i + 1)
+            self._cols[name] = mv[start:start + size].cast('d')
+        self._views = [mv, self._ts] + list(self._cols.values())
+
+    def __len__(self):
+        return min(self._total, self.capacity)
+
+    def _slot(self, i: int) -> int:
+        # Logical row i (0 = oldest) -> slot in the arrays
+        return (self._total - len(self) + i) % self.capacity
+
+    def append(self, reading: dict):
+        """Store the numeric columns of a reading. Everything else is ignored."""
+        ts = _ts_us(reading['measurementTs'])
+        with self._lock:
+            slot = self._total % self.capacity
+            self._ts[slot] = ts
+            for name, col in self._cols.items():
+                v = reading.get(name)
+                col[slot] = _NAN if v is None or isinstance(v, bool) else float(v)
+            self._total += 1
+            # Commit point
+            struct.pack_into('<Q', self._mm, 16, self._total)
+
+    def _bisect(self, ts_us: int) -> int:
+        # First logical row at or after ts_us
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts[self._slot(mid)] < ts_us:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, column: str, since_s: float = None, until_s: float = None) -> list:
+        """Values of one column between two times
+
+        Args:
+            column (str): e.g. 'voltMoisture'
+            since_s (float, optional): Unix time, inclusive. Defaults to the oldest row.
+            until_s (float, optional): Unix time, exclusive. Defaults to the newest row.
+
+        Raises:
+            KeyError: Unknown column
+
+        Returns:
+            list: (unix time, value), oldest first, without empty readings
+        """
+        ts, values = self._read(column, since_s, until_s)
+        return [(t / 1e6, v) for t, v in zip(ts, values) if not math.isnan(v)]
+
+    def _read(self, column: str, since_s: float, until_s: float) -> tuple:
+        col = self._cols[column]
+        with self._lock:
+            lo = 0 if since_s is None else self._bisect(int(since_s * 1e6))
+            hi = len(self) if until_s is None else self._bisect(int(until_s * 1e6))
+            ts, values = [], []
+            # At most two contiguous pieces: up to the end of the arrays, and after the wrap
+            for a, b in self._segments(lo, hi):
+                ts.extend(self._ts[a:b].tolist())
+                values.extend(col[a:b].tolist())
+        return ts, values
+
+    def _segments(self, lo: int, hi: int) -> list:
+        if lo >= hi:
+            return []
+        a, b = self._slot(lo), self._slot(hi - 1) + 1
+        if a < b:
+            return [(a, b)]
+        return [(a, self.capacity), (0, b)]
+
+    def last(self, column: str, seconds: float, now: float = None) -> list:
+        """e.g. the last 10 minutes of voltMoisture: `last('voltMoisture', 600)`"""
+        now = time.time() if now is None else now
+        return self.query(column, now - seconds)
+
+    def downsample(self, column: str, step_s: float, since_s: float = None, until_s: float = None) -> list:
+        """Like `query`, but one row per `step_s` bucket (aligned to the epoch)
+
+        Rows are in time order, so buckets are built in one pass.
+
+        Returns:
+            list: (bucket start, mean, min, max, count), oldest first, empty buckets left out
+        """
+        step_us = step_s * 1e6
+        out = []
+        current = None
+        total = lo = hi = count = 0
+        ts, values = self._read(column, since_s, until_s)
+        for t, v in zip(ts, values):
+            if v != v:
+                # NaN
+                continue
+            b = t // step_us
+            if b != current:
+                if current is not None:
+                    out.append((current * step_s, total / count, lo, hi, count))
+                current, total, lo, hi, count = b, v, v, v, 1
+                continue
+            total += v
+            count += 1
+            if v < lo:
+                lo = v
+            elif v > hi:
+                hi = v
+        if current is not None:
+            out.append((current * step_s, total / count, lo, hi, count))
+        return out
+
+    def flush(self):
+        with self._lock:
+            self._mm.flush()
+
+    def close(self):
+        with self._lock:
+            if self._mm.closed:
+                return
+            self._mm.flush()
+            for v in reversed(self._views):
+                v.release()
+            self._mm.close()
+            self._f.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the local history')
+    parser.add_argument('--file', dest='file', required=True, type=str)
+    parser.add_argument('--column', dest='column', required=True, type=str, choices=COLUMNS)
+    parser.add_argument('--minutes', dest='minutes', required=False, default=60, type=float)
+    parser.add_argument('--step', dest='step_s', required=False, default=0, type=float,
+                        help='Downsample to one row per this many seconds')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        raise SystemExit(f'{args.file} does not exist')
+    h = History(args.file)
+    since = time.time() - args.minutes * 60
+    start = time.perf_counter()
+    if args.step_s:
+        rows = h.downsample(args.column, args.step_s, since)
+    else:
+        rows = h.query(args.column, since)
+    took_ms = (time.perf_counter() - start) * 1000
+    for row in rows:
+        ts = datetime.fromtimestamp(row[0], tz=timezone.utc).isoformat()
+        print('\t'.join([ts] + [f'{v:g}' for v in row[1:]]))
+    print(f'{len(rows)} rows of {len(h)} in {took_ms:.1f}ms')
+    h.close()
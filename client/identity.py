@@ -0,0 +1,95 @@
+import logging
+import os
+import platform
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_MACHINE_ID = None
+
+
+def derive_machine_id(attempts=30, wait_s=1.0, sleep=None) -> str:
+    """Work out a unique ID for this machine from hostname and MAC
+
+    Slow: getmac may shell out or scan /sys and the ARP table.
+    Use `get_machine_id` instead.
+
+    Early in boot, there may be no interface with a MAC yet. That's retried
+    for a while, rather than making up an ID that would then be persisted.
+
+    Args:
+        attempts (int, optional): Defaults to 30.
+        wait_s (float, optional): Between attempts. Defaults to 1.0.
+
+    Raises:
+        RuntimeError: If there's still no MAC
+
+    Returns:
+        str: The ID
+    """
+    import getmac
+    sleep = sleep or time.sleep
+    for attempt in range(attempts):
+        mac = getmac.get_mac_address()
+        if mac:
+            return '{}-{}'.format(platform.uname().node, mac)
+        if attempt < attempts - 1:
+            logger.warning('No MAC address yet, retrying in %.0fs', wait_s)
+            sleep(wait_s)
+    raise RuntimeError(f'No MAC address after {attempts} attempts, set --sensor_id')
+
+
+def init_machine_id(override: str = None, path: str = None) -> str:
+    """Resolve the machine ID once, at startup
+
+    In order: `override` (from config), the ID persisted at `path`, or a
+    freshly derived one, which then gets persisted to `path`. Persisting means
+    the ID survives swapping the WiFi dongle. Without a MAC to derive it from,
+    the ID is random, and persisted all the same.
+
+    Args:
+        override (str, optional): Fixed ID. Defaults to None.
+        path (str, optional): File to persist the ID to. Defaults to None.
+
+    Returns:
+        str: The ID
+    """
+    global _MACHINE_ID
+    if override:
+        _MACHINE_ID = override
+        return _MACHINE_ID
+    if path and os.path.exists(path):
+        with open(path) as f:
+            persisted = f.read().strip()
+        if persisted:
+            _MACHINE_ID = persisted
+            return _MACHINE_ID
+    try:
+        _MACHINE_ID = derive_machine_id()
+    except RuntimeError as e:
+        _MACHINE_ID = '{}-{}'.format(platform.uname().node, uuid.uuid4())
+        logger.warning('%s. Using a random ID instead: %s', e, _MACHINE_ID)
+    if path:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(_MACHINE_ID + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error('Cannot persist machine ID to %s: %s', path, e)
+    return _MACHINE_ID
+
+
+def get_machine_id() -> str:
+    """Get the unique ID for this machine. Cheap; resolved only once.
+
+    Returns:
+        str: The ID
+    """
+    if _MACHINE_ID is None:
+        return init_machine_id()
+    return _MACHINE_ID
@@ -0,0 +1,200 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# The format monitor.py always used
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s %(filename)s:%(funcName)s():%(lineno)d - %(message)s'
+TEXT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+# Attributes every LogRecord has; anything else came in via `extra=`
+_RESERVED = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line
+
+    `extra=` fields become top-level keys, e.g.
+    `logger.error('Read failed', extra={'sensor': 'temp'})`
+    -> `{"ts": "...", "level": "ERROR", "logger": "monitor", "msg": "Read failed", "sensor": "temp", ...}`
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'src': f'{record.filename}:{record.lineno}',
+        }
+        for k, v in record.__dict__.items():
+            if k not in _RESERVED and k not in out:
+                out[k] = v
+        if record.exc_info:
+            out['exc'] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """TEXT_FORMAT, plus how many similar records were throttled"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT, datefmt=TEXT_DATEFMT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        s = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            s += f' ({suppressed} similar suppressed)'
+        return s
+
+
+class ThrottleFilter(logging.Filter):
+    """Keeps a sensor that fails every tick from flooding the log
+
+    Records with the same logger, line, message and `sensor` extra (or the
+    same `rate_key` extra) pass at most once per `interval_s`. The next one
+    that passes carries `suppressed`, the number dropped in between. Below
+    WARNING, only every `sample_every`th record of a kind passes, unthrottled
+    otherwise.
+
+    Args:
+        interval_s (float, optional): Defaults to 60.0. 0 disables throttling.
+        sample_every (int, optional): Defaults to 1, i.e. keep all.
+    """
+
+    # Kinds of record to remember, before forgetting old ones
+    max_kinds = 1000
+
+    def __init__(self, interval_s=60.0, sample_every=1, clock=time.monotonic):
+        super().__init__()
+        self.interval_s = interval_s
+        self.sample_every = max(1, sample_every)
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> [last passed, suppressed since]
+        self._seen = {}
+        self._samples = {}
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        msg = record.msg
+        # `logger.info(reading)` logs a dict, which can't be a key
+        # One failing sensor mustn't hide another's errors from the same line
+        key = getattr(record, 'rate_key', None) or (record.name, record.lineno,
+                                                     msg if isinstance(msg, str) else str(msg),
+                                                     getattr(record, 'sensor', None))
+        with self._lock:
+            if record.levelno < logging.WARNING:
+                if key not in self._samples and len(self._samples) >= self.max_kinds:
+                    # Unique messages; start counting over
+                    self._samples = {}
+                n = self._samples.get(key, 0)
+                self._samples[key] = n + 1
+                if n % self.sample_every:
+                    self.suppressed += 1
+                    return False
+                return True
+            if not self.interval_s:
+                return True
+            now = self._clock()
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] < self.interval_s:
+                seen[1] += 1
+                self.suppressed += 1
+                return False
+            if seen is not None and seen[1]:
+                record.suppressed = seen[1]
+            self._seen[key] = [now, 0]
+            if len(self._seen) > self.max_kinds:
+                # Don't grow forever on unique messages
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.interval_s}
+            return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread as they are
+
+    The stock QueueHandler formats the message in the calling thread; here,
+    formatting happens in the listener. Don't mutate what you pass as
+    arguments after logging it. If the queue is full, records are dropped
+    (and counted) instead of blocking the caller.
+    """
+
+    def __init__(self, q, downstream: logging.Handler = None):
+        super().__init__(q)
+        self.dropped = 0
+        # What the listener writes to, for `after_fork`
+        self.downstream = downstream
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=logging.WARNING, fmt='text', background=True, throttle_s=60.0,
+                  sample_every=1, stream=None, max_queue=10000):
+    """Configure the root logger
+
+    Args:
+        level (int, optional): Defaults to logging.WARNING.
+        fmt (str, optional): 'text' or 'json' (JSON lines). Defaults to 'text'.
+        background (bool, optional): Format and write on a separate thread. Defaults to True.
+        throttle_s (float, optional): See ThrottleFilter. Defaults to 60.0.
+        sample_every (int, optional): See ThrottleFilter. Defaults to 1.
+        stream (file, optional): Defaults to sys.stderr.
+        max_queue (int, optional): Records waiting for the background thread. Defaults to 10000.
+
+    Returns:
+        QueueListener: Call `stop()` on shutdown to flush. None if not in the background.
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter())
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.setLevel(level)
+
+    listener = None
+    if background:
+        q = queue.Queue(max_queue)
+        front = LazyQueueHandler(q, handler)
+        listener = logging.handlers.QueueListener(q, handler, respect_handler_level=True)
+        listener.start()
+    else:
+        front = handler
+    # Throttle before queueing, so dropped records cost nothing downstream
+    front.addFilter(ThrottleFilter(throttle_s, sample_every))
+    root.addHandler(front)
+    return listener
+
+
+def after_fork():
+    """In a forked worker: write records in the calling thread
+
+    The parent's listener thread doesn't come along, and the queue's lock may
+    have been held at the time of the fork. Swaps the queue for the handler
+    behind it, with fresh throttling.
+    """
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        if not isinstance(h, LazyQueueHandler) or h.downstream is None:
+            continue
+        root.removeHandler(h)
+        for f in h.filters:
+            if isinstance(f, ThrottleFilter):
+                h.downstream.addFilter(ThrottleFilter(f.interval_s, f.sample_every, f._clock))
+        root.addHandler(h.downstream)
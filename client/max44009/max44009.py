@@ -1,6 +1,13 @@
 from smbus2 import SMBus
+import logging
 import time
 
+logger = logging.getLogger(__name__)
+
+
+class SensorUnavailable(RuntimeError):
+    """Retries ran out, or the circuit breaker is open"""
+
 class MAX44009:
     # Thanks to https://github.com/rcolistete/MicroPython_MAX44009_driver/blob/master/max44009.py
     # With slight adjustments by chollinger93 for Python3 etc.
@@ -26,20 +33,93 @@ class MAX44009:
     MAX44009_REG_CONFIG_INTRTIMER_12_5       = 0x06    # Integration Time = 12.5ms, manual mode only
     MAX44009_REG_CONFIG_INTRTIMER_6_25       = 0x07    # Integration Time = 6.25ms, manual mode only
 
-    def __init__(self, bus=None) -> None:
+    INTEGRATION_MS = [800, 400, 200, 100, 50, 25, 12.5, 6.25]    # By INTRTIMER bits
+
+    # Auto-ranging steps: (lux the step is good for, INTRTIMER, CDR)
+    # Every halving of the integration time doubles the range, the last step also divides the current by 8
+    RANGES = [
+        (1000, MAX44009_REG_CONFIG_INTRTIMER_800, MAX44009_REG_CONFIG_CDR_NODIVIDED),
+        (2000, MAX44009_REG_CONFIG_INTRTIMER_400, MAX44009_REG_CONFIG_CDR_NODIVIDED),
+        (4000, MAX44009_REG_CONFIG_INTRTIMER_200, MAX44009_REG_CONFIG_CDR_NODIVIDED),
+        (8000, MAX44009_REG_CONFIG_INTRTIMER_100, MAX44009_REG_CONFIG_CDR_NODIVIDED),
+        (16000, MAX44009_REG_CONFIG_INTRTIMER_50, MAX44009_REG_CONFIG_CDR_NODIVIDED),
+        (32000, MAX44009_REG_CONFIG_INTRTIMER_25, MAX44009_REG_CONFIG_CDR_NODIVIDED),
+        (64000, MAX44009_REG_CONFIG_INTRTIMER_12_5, MAX44009_REG_CONFIG_CDR_NODIVIDED),
+        (188000, MAX44009_REG_CONFIG_INTRTIMER_6_25, MAX44009_REG_CONFIG_CDR_DIVIDED),
+    ]
+    # Switch to a shorter integration time above this share of the range,
+    # and back to a longer one below this share of the longer one's range
+    RANGE_UP = 0.8
+    RANGE_DOWN = 0.4
+
+    def __init__(self, bus=None, auto_range=False, attempts=3, backoff_s=0.01, cooldown_s=30.0,
+                 clock=time.monotonic, sleep=time.sleep) -> None:
+        """
+        Args:
+            bus (SMBus, optional): Defaults to SMBus(1).
+            auto_range (bool, optional): Continuous mode, with the integration time and
+                CDR picked from the last reading. Defaults to False (manual, 800ms).
+            attempts (int, optional): Reads per `read_lumen_with_retry`. Defaults to 3.
+            backoff_s (float, optional): Sleep before the first retry, doubles per retry. Defaults to 0.01.
+            cooldown_s (float, optional): How long to leave the sensor alone after
+                all attempts failed. Defaults to 30.0.
+        """
         if not bus:
             bus = SMBus(1)
         self.bus = bus
         self.addr = self.MAX44009_I2C_DEFAULT_ADDRESS
+        self.attempts = max(1, attempts)
+        self.backoff_s = backoff_s
+        self.cooldown_s = cooldown_s
+        self._clock = clock
+        self._sleep = sleep
+        # Circuit breaker: no reads before this (monotonic) time
+        self._open_until = None
+        self.retries = 0
+        self.address_flips = 0
+        self.breaker_trips = 0
+        self.auto_range = auto_range
+        # Start long, i.e. sensitive. The first bright reading moves us up
+        self._range = 0
+        self.range_changes = 0
+        # Integration time of the last reading
+        self.integration_ms = self.INTEGRATION_MS[self.MAX44009_REG_CONFIG_INTRTIMER_800]
+        if self.probe() is None:
+            logger.warning('No MAX44009 on %#x or %#x', self.MAX44009_I2C_DEFAULT_ADDRESS, self.MAX44009_I2C_FALLBACK_ADDRESS)
         self.configure()
 
+    def _config_byte(self) -> int:
+        if not self.auto_range:
+            return self.MAX44009_REG_CONFIG_MANUAL_ON
+        _, timer, cdr = self.RANGES[self._range]
+        return (self.MAX44009_REG_CONFIG_CONTMODE_CONTINUOUS
+                | self.MAX44009_REG_CONFIG_MANUAL_ON | cdr | timer)
+
     def configure(self):
         try:
             self.bus.write_byte_data(self.addr, 
                 self.MAX44009_REG_CONFIGURATION, 
-                self.MAX44009_REG_CONFIG_MANUAL_ON)
+                self._config_byte())
         except Exception as e:
-            print(e)
+            logger.error('Cannot configure MAX44009 on %#x: %s', self.addr, e)
+
+    def _pick_range(self, lux: float) -> int:
+        i = self._range
+        # Brighter: shorter integration until there's headroom
+        while i < len(self.RANGES) - 1 and lux > self.RANGES[i][0] * self.RANGE_UP:
+            i += 1
+        # Darker: longer integration, with a gap so we don't flap between two steps
+        while i > 0 and lux < self.RANGES[i - 1][0] * self.RANGE_DOWN:
+            i -= 1
+        return i
+
+    def _adapt(self, lux: float):
+        i = self._pick_range(lux)
+        if i != self._range:
+            self._range = i
+            self.range_changes += 1
+            # Takes effect with the next conversion, one integration time from now
+            self.configure()
 
     def _convert_lumen(self, raw) -> float:
         exponent = (raw[0] & 0xF0) >> 4
@@ -47,27 +127,85 @@ class MAX44009:
         return ((2 ** exponent) * mantissa) * 0.045
 
     def read_lumen(self)-> float:
+        # In continuous mode, this is the latest finished conversion, no waiting
         data = self.bus.read_i2c_block_data(self.addr,
             self.MAX44009_REG_LUX_HIGH_BYTE, 2)
-        return self._convert_lumen(data)
+        lux = self._convert_lumen(data)
+        if self.auto_range:
+            self.integration_ms = self.INTEGRATION_MS[self.RANGES[self._range][1]]
+            self._adapt(lux)
+        return lux
     
-    def _switch_addr(self):
+    def _other_addr(self) -> int:
         if self.addr == self.MAX44009_I2C_DEFAULT_ADDRESS:
-            self.addr = self.MAX44009_I2C_FALLBACK_ADDRESS
-        else:
-            self.addr = self.MAX44009_I2C_DEFAULT_ADDRESS
-
-    def read_lumen_with_retry(self):
-        # To avoid 121 I/O error
-        # Sometimes, the sensor listens on 0x4A,
-        # sometimes, on 0x4B (ಠ.ಠ)
-        try:
-            return self.read_lumen()
-        except Exception as e:
-            print(f'Error reading lumen on {self.addr}, retrying')
-            self._switch_addr()
-            self.configure()
-            return self.read_lumen_with_retry()
+            return self.MAX44009_I2C_FALLBACK_ADDRESS
+        return self.MAX44009_I2C_DEFAULT_ADDRESS
+
+    def probe(self):
+        """Find the address the sensor answers on
+
+        Sometimes, the sensor listens on 0x4A, sometimes, on 0x4B (ಠ.ಠ).
+        Tries the current one first and only reconfigures if it moved.
+
+        Returns:
+            int: The address, or None if nothing answered
+        """
+        for addr in (self.addr, self._other_addr()):
+            try:
+                self.bus.read_byte_data(addr, self.MAX44009_REG_CONFIGURATION)
+            except OSError:
+                continue
+            if addr != self.addr:
+                logger.warning('MAX44009 moved from %#x to %#x', self.addr, addr)
+                self.addr = addr
+                self.address_flips += 1
+                self.configure()
+            return addr
+        return None
+
+    def read_lumen_with_retry(self) -> float:
+        """`read_lumen`, with a bounded number of attempts and a circuit breaker
+
+        Between attempts, we back off and probe both addresses. Once all attempts
+        failed, the sensor is left alone for `cooldown_s`.
+
+        Raises:
+            SensorUnavailable: If all attempts failed, or we're still cooling down
+
+        Returns:
+            float: Lux
+        """
+        if self._open_until is not None:
+            if self._clock() < self._open_until:
+                raise SensorUnavailable(f'MAX44009 is cooling down for {self._open_until - self._clock():.1f}s')
+            # Half open: one more round of attempts
+            self._open_until = None
+        last = None
+        for attempt in range(self.attempts):
+            if attempt:
+                self.retries += 1
+                self._sleep(self.backoff_s * 2 ** (attempt - 1))
+                self.probe()
+            try:
+                return self.read_lumen()
+            except OSError as e:
+                logger.debug('Error reading lumen on %#x, attempt %d/%d: %s', self.addr, attempt + 1, self.attempts, e)
+                last = e
+        self.breaker_trips += 1
+        self._open_until = self._clock() + self.cooldown_s
+        raise SensorUnavailable(f'MAX44009 failed {self.attempts} times, '
+                                f'pausing for {self.cooldown_s}s: {last}') from last
+
+    def stats(self) -> dict:
+        return {
+            'addr': self.addr,
+            'retries': self.retries,
+            'address_flips': self.address_flips,
+            'breaker_trips': self.breaker_trips,
+            'breaker_open': self._open_until is not None and self._clock() < self._open_until,
+            'integration_ms': self.integration_ms,
+            'range_changes': self.range_changes,
+        }
 
 if __name__ == '__main__':
     # Get I2C bus
@@ -0,0 +1,279 @@
+import logging
+import os
+import threading
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats():
+    """Running latency counters for a hot path
+
+    Cheap enough to update on every read: no samples are kept, just
+    count, total, min, max and the last observation (all in seconds).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.total_s = 0.0
+        self.min_s = None
+        self.max_s = None
+        self.last_s = None
+
+    def observe(self, seconds: float, error=False):
+        """Record a single observation
+
+        Args:
+            seconds (float): Duration
+            error (bool, optional): Whether the call failed. Defaults to False.
+        """
+        with self._lock:
+            self.count += 1
+            if error:
+                self.errors += 1
+            self.total_s += seconds
+            self.last_s = seconds
+            if self.min_s is None or seconds < self.min_s:
+                self.min_s = seconds
+            if self.max_s is None or seconds > self.max_s:
+                self.max_s = seconds
+
+    @property
+    def mean_s(self) -> float:
+        if not self.count:
+            return None
+        return self.total_s / self.count
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'count': self.count,
+                'errors': self.errors,
+                'mean_s': self.total_s / self.count if self.count else None,
+                'min_s': self.min_s,
+                'max_s': self.max_s,
+                'last_s': self.last_s,
+            }
+
+
+# Seconds. Sensor reads take ms to an 800ms conversion, HTTP sends up to the timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """Fixed buckets, Prometheus style. `observe` is a bisect and three adds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # Last one is +Inf
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> tuple:
+        """
+        Returns:
+            tuple: Cumulative count per bucket (incl. +Inf), sum, count
+        """
+        with self._lock:
+            counts, total, count = list(self._counts), self.sum, self.count
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, count
+
+
+class Counter():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+def _labels(labels: dict, **extra) -> str:
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+
+def _value(v) -> str:
+    if v is None:
+        return 'NaN'
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class MetricsRegistry():
+    """Named, labelled metrics, rendered as Prometheus text
+
+    Look up a metric once and keep the object: `histogram()` and `counter()`
+    take a lock and build a key. Gauges are callbacks, evaluated on render.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> [type, help, {labels: metric}]
+        self._families = {}
+
+    def _get(self, kind: str, name: str, help: str, labels: dict, make):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = [kind, help, {}]
+            elif family[0] != kind:
+                raise ValueError(f'{name} is a {family[0]}, not a {kind}')
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = make()
+            return metric
+
+    def histogram(self, name: str, help='', buckets=DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self._get('histogram', name, help, labels, lambda: Histogram(buckets))
+
+    def counter(self, name: str, help='', **labels) -> Counter:
+        return self._get('counter', name, help, labels, Counter)
+
+    def gauge(self, name: str, fn, help='', **labels):
+        """Register a callback, e.g. `lambda: len(spool)`. Replaces an earlier one."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(name, ['gauge', help, {}])
+            family[2][key] = fn
+
+    def render(self) -> str:
+        """Prometheus text exposition format, version 0.0.4"""
+        with self._lock:
+            families = [(name, kind, help, dict(metrics))
+                        for name, (kind, help, metrics) in sorted(self._families.items())]
+        lines = []
+        for name, kind, help, metrics in families:
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, m in metrics.items():
+                labels = dict(key)
+                if kind == 'histogram':
+                    cumulative, total, count = m.snapshot()
+                    for le, c in zip(m.buckets + (float('inf'),), cumulative):
+                        lines.append(f'{name}_bucket{_labels(labels, le=_value(float(le)))} {c}')
+                    lines.append(f'{name}_sum{_labels(labels)} {_value(total)}')
+                    lines.append(f'{name}_count{_labels(labels)} {count}')
+                elif kind == 'counter':
+                    lines.append(f'{name}{_labels(labels)} {m.value}')
+                else:
+                    try:
+                        v = m()
+                    except Exception as e:
+                        logger.debug('Gauge %s failed: %s', name, e)
+                        v = None
+                    lines.append(f'{name}{_labels(labels)} {_value(v)}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str):
+        """Write `render()` to a file, atomically (e.g. for node_exporter's textfile collector)"""
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+# Shared by everything in the client
+METRICS = MetricsRegistry()
+
+
+class MetricsExporter():
+    """Exposes a registry over HTTP (`GET /metrics`) and/or as a file, rewritten every `interval_s`
+
+    Args:
+        registry (MetricsRegistry, optional): Defaults to METRICS.
+        port (int, optional): Serve on 127.0.0.1:port. Defaults to None (off).
+        path (str, optional): Dump to this file. Defaults to None (off).
+        interval_s (float, optional): Dump interval. Defaults to 15.0.
+        host (str, optional): Defaults to '127.0.0.1', i.e. local only.
+    """
+
+    def __init__(self, registry=None, port=None, path=None, interval_s=15.0, host='127.0.0.1'):
+        self.registry = registry or METRICS
+        self.port = port
+        self.path = path
+        self.interval_s = interval_s
+        self.host = host
+        self._server = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.port is not None:
+            self._serve()
+        if self.path:
+            self._thread = threading.Thread(
+                target=self._run, name='metrics', daemon=True)
+            self._thread.start()
+        return self
+
+    def _serve(self):
+        # Only needed if enabled
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        # Port 0 picks a free one
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.registry.dump(self.path)
+            except OSError as e:
+                logger.error('Cannot write metrics to %s: %s', self.path, e)
+            self._stop.wait(self.interval_s)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        if self.path:
+            # Final numbers
+            try:
+                self.registry.dump(self.path)
+            except OSError as e:
+                logger.error('Cannot write metrics to %s: %s', self.path, e)
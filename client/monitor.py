@@ -1,75 +1,118 @@
-from typing import Set
-import busio
-import adafruit_mcp9808
-import os
-import time
-import busio
-import digitalio
-import adafruit_mcp3xxx.mcp3008 as MCP
-from adafruit_mcp3xxx.analog_in import AnalogIn
-import platform
-import getmac
-import requests
 import logging
-import json
 import argparse
+import time
 from datetime import datetime, timezone
-import max44009.max44009 as m4
-from smbus2 import SMBus
-import SI1145
-import i2clcd
-
-
-class Sensor():
-    # We define a unique name per sensor, so we can spawn instances
-    name = None
-
-    def __init__(self, **kwargs):
-        """Implemented in each sensor (constructor, duh)
-
-        Should set `self.sensor` at least
-        """
-        pass
+from bus import BUSES
+from registry import Sensor, SENSORS, plan_intervals
+from sampler import BusSampler
+from spool import Spool, MemorySpool
+from scheduler import FixedRateScheduler, parse_intervals
+from aggregate import Aggregator
+from filters import FILTERS, Hysteresis
+from identity import get_machine_id, init_machine_id
+from metrics import METRICS, MetricsExporter
+from reading import Reading
 
-    def read_metric(self) -> dict:
-        """Implemented in each sensor
-
-        Returns a `dict` of readings, mapping to the SQL schema.
-
-        Return None if no reading. Equals NULL in DB.
-
-        Returns:
-            dict: Column -> Reading
-        """
-        pass
 
 # Temp
 class MCP9808_S(Sensor):
     name = 'temp'
+    # 250ms conversion at max. resolution
+    min_interval_s = 0.25
+    columns = ('tempC',)
 
     def __init__(self, **kwargs):
         # This is a weird bug in the lib - we don't set the self.sensor
-        pass
+        # here, but build it on the first read (and after every reconnect)
+        self.sensor = None
+        self._gen = None
+
+    def _connect(self, i2c):
+        import adafruit_mcp9808
+        self.sensor = adafruit_mcp9808.MCP9808(i2c)
 
     def read_metric(self):
-        from board import SCL, SDA
-        with busio.I2C(SCL, SDA) as i2c:
-            t = adafruit_mcp9808.MCP9808(i2c)
+        bus = BUSES.i2c
+        with bus.borrow('busio', self.name) as i2c:
+            if self._gen != bus.generation:
+                self._connect(i2c)
+                self._gen = bus.generation
             return {
-                'tempC': t.temperature
+                'tempC': self.sensor.temperature
             }
 
 # UV
 class SI1145_S(Sensor):
     name = 'uv'
+    columns = ('visLight', 'irLight', 'uvIx')
+
+    # Registers, see the SI1145 lib
+    REG_IRQSTAT = 0x21
+    REG_COMMAND = 0x18
+    REG_MEASRATE0 = 0x08
+    REG_MEASRATE1 = 0x09
+    # ALSVISDATA0 (0x22) through UVINDEX1 (0x2D), little endian words
+    REG_DATA = 0x22
+    DATA_LEN = 12
+    IRQSTAT_ALS = 0x01
+    CMD_ALS_FORCE = 0x06
+    CMD_PSALS_PAUSE = 0x0B
+    # A forced ALS conversion takes a few ms
+    FORCE_TIMEOUT_S = 0.05
 
     def __init__(self, **kwargs):
+        # 'auto': the chip measures every 8ms, we read the latest values.
+        # 'forced': we trigger one conversion per reading, so all values are from the same cycle
+        self.mode = kwargs.get('uv_mode', 'auto')
+        if self.mode not in ('auto', 'forced'):
+            raise ValueError(f'Unknown uv_mode {self.mode}')
+        bus = BUSES.i2c
+        # The lib opens its own handle, so we only borrow the lock
+        with bus.borrow(key=self.name):
+            self._connect()
+            self._setup()
+            self._gen = bus.generation
+
+    def _connect(self):
+        import SI1145
         self.sensor = SI1145.SI1145()
 
+    def _setup(self):
+        if self.mode == 'forced':
+            # Stop autonomous measurements
+            dev = self.sensor._device
+            dev.write8(self.REG_MEASRATE0, 0)
+            dev.write8(self.REG_MEASRATE1, 0)
+            dev.write8(self.REG_COMMAND, self.CMD_PSALS_PAUSE)
+
+    def _force(self):
+        dev = self.sensor._device
+        dev.write8(self.REG_IRQSTAT, self.IRQSTAT_ALS)
+        dev.write8(self.REG_COMMAND, self.CMD_ALS_FORCE)
+        deadline = time.monotonic() + self.FORCE_TIMEOUT_S
+        while not dev.readU8(self.REG_IRQSTAT) & self.IRQSTAT_ALS:
+            if time.monotonic() > deadline:
+                raise TimeoutError('SI1145 forced measurement timed out')
+            time.sleep(0.001)
+
+    def _read_block(self) -> tuple:
+        # One transaction instead of one per value
+        data = self.sensor._device.readList(self.REG_DATA, self.DATA_LEN)
+        vis = data[0] | data[1] << 8
+        ir = data[2] | data[3] << 8
+        uv = data[10] | data[11] << 8
+        return vis, ir, uv
+
     def read_metric(self):
-        vis = self.sensor.readVisible()
-        IR = self.sensor.readIR()
-        UV = self.sensor.readUV()
+        bus = BUSES.i2c
+        with bus.borrow(key=self.name):
+            if self._gen != bus.generation:
+                self._connect()
+                self._setup()
+                self._gen = bus.generation
+            if self.mode == 'forced':
+                self._force()
+            vis, IR, UV = self._read_block()
         uvIndex = UV / 100.0
         # UV sensor sometimes doesn't play along
         if int(vis) == 0 or int(IR) == 0:
@@ -85,169 +128,272 @@ class SI1145_S(Sensor):
 # pass spi_chan
 class HD38_S(Sensor):
     name = 'moisture'
+    bus = 'spi'
+    columns = ('rawMoisture', 'voltMoisture', 'relMoisture')
 
     def __init__(self, **kwargs):
-        from board import SCK, MISO, MOSI, CE0
-
-        # SPI
-        # create the spi bus
-        spi = busio.SPI(clock=SCK, MISO=MISO, MOSI=MOSI)
-        # create the cs (chip select)
-        cs = digitalio.DigitalInOut(CE0)
-        # create the mcp object
-        mcp = MCP.MCP3008(spi, cs)
-        # create an analog input channel on pin 0
-        self.sensor = AnalogIn(mcp, kwargs.get('spi_in', 0))
-
-    def _translate_moisture(self, moisture):
-        if moisture <= 0.77:
-            return 'wet'
-        elif moisture > 0.77 and moisture <= 1.5:
-            return 'ok'
-        else:
-            return 'dry'
+        self.spi_in = kwargs.get('spi_in', 0)
+        # Conversions per reading, filtered down to one value. A single
+        # MCP3008 sample is noisy
+        self.oversample = max(1, int(kwargs.get('oversample', 1)))
+        self._filter = FILTERS[kwargs.get('oversample_filter', 'median')]
+        # Volts a reading has to move past a threshold to change relMoisture
+        self._translate_moisture = Hysteresis([0.77, 1.5], ['wet', 'ok', 'dry'],
+                                              kwargs.get('hysteresis_v', 0.0))
+        # The GPIO pin isn't part of the bus, so it outlives reconnects
+        self._cs = None
+        bus = BUSES.spi
+        with bus.borrow('busio', self.name) as spi:
+            self._connect(spi)
+            self._gen = bus.generation
+
+    def _chip_select(self):
+        from board import CE0
+        import digitalio
+        return digitalio.DigitalInOut(CE0)
+
+    def _connect(self, spi):
+        from adc import MCP3008Scanner
+        if self._cs is None:
+            self._cs = self._chip_select()
+        # Not `AnalogIn`, which locks and configures the bus per conversion
+        self.scanner = MCP3008Scanner(spi, self._cs, [self.spi_in])
 
     def read_metric(self):
-        raw_moisture = self.sensor.value
-        volt_moisture = self.sensor.voltage
-        rel_moisture = self._translate_moisture(volt_moisture)
-        if int(raw_moisture) == 0:
+        bus = BUSES.spi
+        # All conversions in one go, while we hold the bus
+        with bus.borrow('busio', self.name) as spi:
+            if self._gen != bus.generation:
+                self._connect(spi)
+                self._gen = bus.generation
+            samples, = self.scanner.scan(self.oversample)
+        raw_moisture = int(round(self._filter(samples)))
+        if raw_moisture == 0:
             return None
+        volt_moisture = self.scanner.volts(raw_moisture)
         return {
             'rawMoisture': raw_moisture,
             'voltMoisture': volt_moisture,
-            'relMoisture': rel_moisture,
+            'relMoisture': self._translate_moisture(volt_moisture),
+        }
+
+# Moisture: several HD-38s on one MCP3008, one per channel
+# pass probe_channels and (optionally) probe_ids
+class HD38_Multi_S(Sensor):
+    name = 'probes'
+    bus = 'spi'
+    # The first probe also fills the single-probe columns
+    columns = ('probes', 'rawMoisture', 'voltMoisture', 'relMoisture')
+
+    def __init__(self, **kwargs):
+        self.channels = list(kwargs.get('probe_channels') or [kwargs.get('spi_in', 0)])
+        # IDs stay with the channel, so a probe keeps its history when others are added
+        self.probe_ids = list(kwargs.get('probe_ids') or [f'ch{ch}' for ch in self.channels])
+        if len(self.probe_ids) != len(self.channels):
+            raise ValueError(f'{len(self.channels)} probe channels, but {len(self.probe_ids)} probe IDs')
+        if len(set(self.channels)) != len(self.channels) or len(set(self.probe_ids)) != len(self.probe_ids):
+            raise ValueError('Probe channels and IDs must be unique')
+        self.oversample = max(1, int(kwargs.get('oversample', 1)))
+        self._filter = FILTERS[kwargs.get('oversample_filter', 'median')]
+        # Each probe has its own state
+        self._translate = [Hysteresis([0.77, 1.5], ['wet', 'ok', 'dry'], kwargs.get('hysteresis_v', 0.0))
+                           for _ in self.channels]
+        # The GPIO pin isn't part of the bus, so it outlives reconnects
+        self._cs = None
+        bus = BUSES.spi
+        with bus.borrow('busio', self.name) as spi:
+            self._connect(spi)
+            self._gen = bus.generation
+
+    def _chip_select(self):
+        from board import CE0
+        import digitalio
+        return digitalio.DigitalInOut(CE0)
+
+    def _connect(self, spi):
+        from adc import MCP3008Scanner
+        if self._cs is None:
+            self._cs = self._chip_select()
+        self.scanner = MCP3008Scanner(spi, self._cs, self.channels)
+
+    def read_metric(self):
+        bus = BUSES.spi
+        # All channels, all conversions, one lock of the SPI bus
+        with bus.borrow('busio', self.name) as spi:
+            if self._gen != bus.generation:
+                self._connect(spi)
+                self._gen = bus.generation
+            samples = self.scanner.scan(self.oversample)
+        probes = []
+        for probe_id, values, translate in zip(self.probe_ids, samples, self._translate):
+            raw_moisture = int(round(self._filter(values)))
+            if raw_moisture == 0:
+                # Unplugged. Still listed, so the probes don't shift
+                probes.append({'probeId': probe_id, 'rawMoisture': None,
+                               'voltMoisture': None, 'relMoisture': None})
+                continue
+            volt_moisture = self.scanner.volts(raw_moisture)
+            probes.append({
+                'probeId': probe_id,
+                'rawMoisture': raw_moisture,
+                'voltMoisture': volt_moisture,
+                'relMoisture': translate(volt_moisture),
+            })
+        if all(p['rawMoisture'] is None for p in probes):
+            return None
+        first = probes[0]
+        return {
+            'probes': probes,
+            'rawMoisture': first['rawMoisture'],
+            'voltMoisture': first['voltMoisture'],
+            'relMoisture': first['relMoisture'],
         }
 
 # Lumen: pass MAX44009
 class MAX44009_S(Sensor):
     name = 'lumen'
+    # Default integration time
+    min_interval_s = 0.8
+    columns = ('lumen',)
 
     def __init__(self, **kwargs):
-        self.sensor = m4.MAX44009(SMBus(1))
+        import max44009.max44009 as m4
+        # Continuous mode with adaptive integration time, instead of 800ms
+        self.auto_range = kwargs.get('lux_auto_range', False)
+        if self.auto_range:
+            # The latest conversion is always ready; in the dark, faster reads just repeat it
+            self.min_interval_s = 0.0
+        bus = BUSES.i2c
+        with bus.borrow('smbus', self.name) as smbus:
+            self.sensor = m4.MAX44009(smbus, auto_range=self.auto_range)
+            self._gen = bus.generation
 
     def read_metric(self):
-        return {
-            'lumen': self.sensor.read_lumen_with_retry()
-        }
+        bus = BUSES.i2c
+        with bus.borrow('smbus', self.name) as smbus:
+            if self._gen != bus.generation:
+                self.sensor.bus = smbus
+                self.sensor.configure()
+                self._gen = bus.generation
+            metrics = {
+                'lumen': self.sensor.read_lumen_with_retry()
+            }
+        if self.auto_range:
+            metrics['lumenIntegrationMs'] = self.sensor.integration_ms
+        return metrics
 
 class LCM106_LCD():
     """For all intents and purposes, this is a sensor.
-    But it's not collecting data, just showing it"""
+    But it's not collecting data, just showing it
+
+    Drawing happens in the background, see `display.LcdRenderer`.
+
+    Args:
+        refresh_s (float, optional): How often to redraw. Defaults to 1.0.
+        pages (list, optional): Page names from `display.PAGES`. Defaults to ['soil'].
+        page_s (float, optional): Seconds per page. Defaults to 5.0.
+    """
     name = 'lcd'
 
-    def __init__(self):
-        lcd = i2clcd.i2clcd(i2c_bus=1, i2c_addr=0x27, lcd_width=16)
-        lcd.init()
-        lcd.clear()
+    def __init__(self, refresh_s=1.0, pages=None, page_s=5.0):
+        import i2clcd
+        from display import LcdRenderer, PAGES
+        # i2clcd opens its own handle, but it shares the wires with the sensors
+        with BUSES.i2c.borrow(key=self.name):
+            lcd = i2clcd.i2clcd(i2c_bus=1, i2c_addr=0x27, lcd_width=16)
+            lcd.init()
+            lcd.clear()
         self.sensor = lcd
+        self.renderer = LcdRenderer(lcd, lambda: BUSES.i2c.borrow(key=self.name),
+                                    pages=[PAGES[p] for p in pages or ['soil']],
+                                    refresh_s=refresh_s, page_s=page_s)
+        self.renderer.start()
 
     def show(self, reading):
-        try:
-            # Try to get the moisture
-            relMoisture = reading.get('relMoisture', None)
-            voltMoisture = reading.get('voltMoisture', None)
-            if relMoisture and voltMoisture:
-                ln1 = 'Soil: {} [{:.2f}]'.format(
-                    relMoisture, voltMoisture)
-            else:
-                ln1 = 'Soil: N/A'
-            # Try to read temp
-            tempC = reading.get('tempC', None)
-            if tempC:
-                ln2 = 'Temp: {:.2f}C'.format(tempC)
-            else:
-                ln2 = 'Temp: N/A'
-            # Display
-            self.sensor.print_line(ln1, line=0)
-            self.sensor.print_line(ln2, line=1)
-        except Exception as e:
-            logger.error(f'LCD failed showing data {reading}: {e}')
-
+        # Doesn't wait for the display
+        self.renderer.update(reading)
 
-def get_all_subclasses(cls) -> Set[object]:
-    """Gets all subclasses of a given class; Sensor in this cae
-
-    See: https://github.com/chollinger93/scarecrow/blob/master/scarecrow_core/plugin_base/interceptor.py
-
-    Args:
-        names: All sensor names
-
-    Returns:
-        set: All classes
-    """
-    return set(cls.__subclasses__()).union(
-        [s for c in cls.__subclasses__() for s in get_all_subclasses(c)])
+    def close(self):
+        self.renderer.stop()
 
 
 def gen_sensors_by_name(*names):
     """Get all sensors (classes) if they match the name
 
     Yields:
-        [type]: [description]
+        type: Sensor class, from the registry
     """
-    for cls in get_all_subclasses(Sensor):
-        if cls.name in names:
+    SENSORS.load_entry_points()
+    for name in dict.fromkeys(names):
+        cls = SENSORS.get(name)
+        if cls:
             yield cls
 
-def create_sensors(*names, spi_in=0) -> dict:
+def create_sensors(*names, spi_in=0, pool=None, **options) -> dict:
     """Actually create the sensor instances
 
     Args:
         spi_in (int, optional): [description]. Defaults to 0.
+        pool (WorkerPool, optional): Create each sensor in a worker process of its own instead, see workers.py
+        options: Passed on to every sensor, e.g. `oversample`. Sensors ignore what they don't know
 
     Returns:
         dict: Dict of sensor objects/instances
     """
     sensors = {}
     for s in gen_sensors_by_name(*names):
+        if pool is not None:
+            # Errors creating it show up as read errors
+            sensors[s.name] = pool.add(s, spi_in=spi_in, **options)
+            continue
         # Within here, it'll create the underlying library objects
         try:
-            sensors[s.name] = s(spi_in=spi_in)
+            sensors[s.name] = s(spi_in=spi_in, **options)
         except Exception as e:
-            logger.error(f'Error creating sensor: {s.name}: {e}')
+            logger.error('Error creating sensor: %s: %s', s.name, e)
             continue
     return sensors
 
-def get_machine_id() -> str:
-    """Get a unique ID for this machine
+def read_sensors(sensors: dict, lcd=None, sampler: BusSampler = None, last: dict = None) -> Reading:
+    """Read `sensors` into one Reading
+
+    Args:
+        sensors (dict): Name -> sensor, the ones due now
+        lcd (LCM106_LCD, optional): Shows the reading
+        sampler (BusSampler, optional): Defaults to the shared one
+        last (dict, optional): Name -> last metrics, kept up to date here. Sensors that aren't due
+            send these again, since the server reads a missing value as 0. Failed ones are dropped.
 
     Returns:
-        str: The ID
+        Reading: The reading
     """
-    return '{}-{}'.format(platform.uname().node, getmac.get_mac_address())
-
-
-def read_sensors(sensors: dict, lcd=None) -> dict:
-    # Target JSON
-    reading = {
-        'sensorId': get_machine_id(),
-        # Metrics will come from Sensor object
-        'tempC': None,
-        'visLight': None,
-        'irLight': None,
-        'uvIx': None,
-        'rawMoisture': None,
-        'voltMoisture': None,
-        'lumen': None,
+    # Target JSON. Metrics will come from Sensor object
+    reading = Reading(
+        sensorId=get_machine_id(),
         # RFC 3339
-        'measurementTs': datetime.now(timezone.utc).isoformat()
-    }
+        measurementTs=datetime.now(timezone.utc).isoformat())
 
     # Read all
-    for k in sensors:
-        try:
-            sensor = sensors[k]
-            logger.debug(f'Reading {sensor.name}')
-            metrics = sensor.read_metric()
-            if not metrics:
-                logger.error(f'No data for sensor {k}')
-                continue
-        except Exception as e:
-            logger.error(f'Error reading sensor {k}: {e}')
+    sampler = sampler or SAMPLER
+    logger.debug('Reading %s', sensors.keys())
+    if last:
+        for k, metrics in last.items():
+            if k not in sensors:
+                reading.update(metrics)
+    for k, metrics in sampler.read_all(sensors).items():
+        if isinstance(metrics, Exception):
+            logger.error('Error reading sensor %s: %s', k, metrics, extra={'sensor': k})
+            metrics = None
+        elif not metrics:
+            logger.error('No data for sensor %s', k, extra={'sensor': k})
+        if not metrics:
+            if last is not None:
+                last.pop(k, None)
             continue
-        # Combine
-        reading = {**reading, **metrics}
+        if last is not None:
+            last[k] = metrics
+        # Combine, in place
+        reading.update(metrics)
 
     # Power the LCD, if it's enabled
     if lcd:
@@ -255,13 +401,49 @@ def read_sensors(sensors: dict, lcd=None) -> dict:
 
     return reading
 
-def main(rest_endpoint: str, frequency_s=1, buffer_max=10, spi_in=0x0, disable_rest=False, enable_lcd=True, *sensor_keys):
+def main(rest_endpoint: str, frequency_s=1, buffer_max=10, spi_in=0x0, disable_rest=False, enable_lcd=True, *sensor_keys, read_timeout_s=3.0, spool_dir=None, http_timeout_s=10.0, intervals=None, wire_format='json', compress=False, sensor_id=None, id_file=None, aggregate_s=0, simulate=False, max_ticks=None, sensor_options=None, lcd_options=None, history_file=None, history_bytes=16 * 1024 * 1024,
+         metrics_port=None, metrics_file=None, metrics_interval_s=15.0,
+         report_mode=None, tolerances=None, heartbeat_s=900.0, isolate=False, batch_wait_s=30.0, dead_letter_file=None):
     if disable_rest:
         logger.warning('Rest endpoint disabled')
-    buffer = []
+    # Resolve the ID once, not per reading
+    logger.warning('Sensor ID: %s', init_machine_id(sensor_id, id_file))
+    # Readings wait here until the server acknowledged them
+    if spool_dir:
+        spool = Spool(spool_dir)
+        if len(spool) > 0:
+            logger.warning('Replaying %d spooled readings', len(spool))
+    else:
+        spool = MemorySpool()
+    # Sending happens in the background, so the network can't hold up sampling
+    uploader = None
+    if not disable_rest:
+        from uploader import Uploader
+        uploader = Uploader(rest_endpoint, spool,
+                            batch_size=buffer_max, timeout_s=http_timeout_s,
+                            wire_format=wire_format, compress=compress,
+                            dead_letter_path=dead_letter_file)
+        uploader.start()
+    # When the oldest reading of a partial batch was spooled
+    pending_since = None
+    # Sensor -> last metrics, for sensors on a slower interval
+    last = {}
+    if isolate:
+        # Hung reads get their worker killed, instead of a thread stuck forever
+        from workers import WorkerPool
+        sampler = WorkerPool(timeout_s=read_timeout_s)
+    else:
+        sampler = BusSampler(timeout_s=read_timeout_s)
+
+    # Fake buses and chips instead of the real thing
+    if simulate:
+        from simulated import Simulation
+        logger.warning('Simulating all sensors')
+        Simulation().install()
 
     # Create sensor objects
-    sensors = create_sensors(*sensor_keys, spi_in=spi_in)
+    sensors = create_sensors(*sensor_keys, spi_in=spi_in, pool=sampler if isolate else None,
+                             **(sensor_options or {}))
 
     if len(sensors) == 0:
         logger.error('No sensors specified')
@@ -270,48 +452,115 @@ def main(rest_endpoint: str, frequency_s=1, buffer_max=10, spi_in=0x0, disable_r
     # Create an LCD if we need it
     lcd = None
     if enable_lcd:
-        lcd = LCM106_LCD()
-
-    while True:
         try:
+            lcd = LCM106_LCD(**(lcd_options or {}))
+        except Exception as e:
+            logger.error('Error creating LCD: %s', e)
+
+    # Raw readings, for looking at the node offline
+    history = None
+    if history_file:
+        from history import History
+        history = History(history_file, max_bytes=history_bytes)
+        logger.warning('History: %d of %d readings in %s', len(history), history.capacity, history_file)
+
+    # Where the time goes, on http://127.0.0.1:<metrics_port>/metrics and/or in a file
+    exporter = None
+    if metrics_port is not None or metrics_file:
+        exporter = MetricsExporter(port=metrics_port, path=metrics_file, interval_s=metrics_interval_s).start()
+        logger.warning('Metrics: port %s, file %s', exporter.port, metrics_file)
+    tick_hist = METRICS.histogram('loop_tick_seconds', 'Time from a tick to the reading being queued')
+
+    # Absolute deadlines, so read and send times don't add up
+    if isolate:
+        # Forked now, so the workers get the simulation, if any. Once they created
+        # their sensors, the plan below can use the instances' min_interval_s
+        sampler.start({k: (intervals or {}).get(k, frequency_s) for k in sensors})
+    intervals = plan_intervals(sensors.values(), frequency_s, intervals)
+    logger.warning('Read intervals: %s', intervals)
+    if isolate:
+        sampler.set_intervals(intervals)
+    scheduler = FixedRateScheduler(frequency_s, intervals)
+    # Raw pass-through unless a window is set
+    aggregator = Aggregator(aggregate_s) if aggregate_s else None
+    # Only send what the server can't rebuild within the tolerances
+    reporter = None
+    if report_mode:
+        from deadband import ExceptionReporter
+        reporter = ExceptionReporter(report_mode, tolerances, heartbeat_s)
+
+    while max_ticks is None or scheduler.ticks < max_ticks:
+        tick = scheduler.wait()
+        tick_start = time.perf_counter()
+        try:
+            # Only read the sensors whose interval is up
+            due = {k: sensors[k] for k in scheduler.due(tick, sensors)}
+            if not due:
+                continue
             # Read
-            reading = read_sensors(sensors, lcd)
+            reading = read_sensors(due, lcd, sampler, last)
+            if history:
+                history.append(reading)
+            # Downsample, if enabled. Emits once a window closes
+            readings = aggregator.add(reading) if aggregator else [reading]
+            if reporter:
+                readings = [out for r in readings for out in reporter.add(r)]
 
             # Only send if its not disabled
             if not disable_rest:
-                buffer.append(reading)
-                logger.debug(reading)
-                if len(buffer) >= buffer_max:
+                for r in readings:
+                    spool.append(r)
+                    logger.debug('%s', r)
+                if readings and pending_since is None:
+                    pending_since = time.monotonic()
+                full = len(spool) >= buffer_max
+                # With --report or --aggregate, a batch can take long to fill
+                waited = pending_since is not None and time.monotonic() - pending_since >= batch_wait_s
+                if full or waited:
                     logger.debug('Flushing buffer')
                     # Send
-                    logger.debug('Sending: {}'.format(json.dumps(buffer)))
-                    response = requests.post(rest_endpoint, json=buffer)
-                    logger.debug(response)
-                    # Reset
-                    buffer = []
+                    uploader.notify(flush=not full)
+                    pending_since = None
+                    # Only build the stats if someone's going to see them
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug('Bus stats: %s', BUSES.stats())
+                        logger.debug('Uploader stats: %s', uploader.stats())
+                        logger.debug('Scheduler stats: %s', scheduler.stats())
+                        if reporter:
+                            logger.debug('Report by exception: %s', reporter.stats())
             else:
-                logger.info(reading)
+                for r in readings:
+                    logger.info('%s', r)
         except Exception as e:
             logger.exception(e)
         finally:
-            time.sleep(frequency_s)
-
-
-# Logging
-fmt = '%(asctime)s - %(name)s - %(levelname)s %(filename)s:%(funcName)s():%(lineno)d - %(message)s'
-logging.basicConfig(
-    format=fmt,
-    level=logging.WARN,
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-formatter = logging.Formatter(fmt=fmt)
-handler = logging.StreamHandler()
-handler.setFormatter(formatter)
+            tick_hist.observe(time.perf_counter() - tick_start)
+
+    # Only reached with max_ticks, e.g. in benchmarks
+    # The last, partial window, and whatever the reporter held back
+    leftover = aggregator.flush() if aggregator else []
+    if reporter:
+        leftover = [out for r in leftover for out in reporter.add(r)] + reporter.flush()
+    if not disable_rest:
+        for r in leftover:
+            spool.append(r)
+    if uploader:
+        uploader.stop()
+        uploader.flush()
+    spool.close()
+    sampler.shutdown()
+    if lcd:
+        lcd.close()
+    if history:
+        history.close()
+    if exporter:
+        exporter.stop()
+
+
+# Shared by all callers of read_sensors that don't bring their own
+SAMPLER = BusSampler()
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.WARN)
-if (logger.hasHandlers()):
-    logger.handlers.clear()
-logger.addHandler(handler)
 
 if __name__ == '__main__':
     # Args
@@ -321,25 +570,117 @@ if __name__ == '__main__':
     parser.add_argument('--sensors', dest='sensors', required=False,
                         default=list(['uv', 'temp', 'lumen', 'moisture']), type=str, nargs='+', help='Sensors to use. Need to be connected')
     parser.add_argument('--frequency', dest='frequency_s',
-                        required=False, default=1, type=int, help='Frequency in seconds in which to collect data')
+                        required=False, default=1, type=float, help='Frequency in seconds in which to collect data. Can be < 1')
+    parser.add_argument('--sensor_frequency', dest='sensor_frequency', required=False,
+                        default=[], type=str, nargs='+', help='Per-sensor frequency in seconds, e.g. moisture=60 lumen=1. Defaults to --frequency. Readings in between repeat the last values')
     parser.add_argument('--buffer_max', dest='buffer_max',
                         required=False, default=10, type=int, help='Max buffer before sending data to REST endpoint')
+    parser.add_argument('--batch_wait', dest='batch_wait_s', required=False, default=30.0, type=float,
+                        help='Send a partial batch once its oldest reading waited this many seconds')
+    parser.add_argument('--dead_letter_file', dest='dead_letter_file', required=False, default=None, type=str,
+                        help='Append batches the REST endpoint rejects for good (4xx) to this file, as JSON lines. Dropped if not set')
     parser.add_argument('--spi_in', dest='spi_in',
                         required=False, default=0, type=int, help='Input SPI address. Default is 0x0.')
+    parser.add_argument('--oversample', dest='oversample', required=False, default=1, type=int,
+                        help='ADC conversions per moisture reading, filtered down to one value')
+    parser.add_argument('--oversample_filter', dest='oversample_filter', required=False, default='median',
+                        choices=sorted(FILTERS), help='How to combine oversampled conversions')
+    parser.add_argument('--hysteresis', dest='hysteresis_v', required=False, default=0.0, type=float,
+                        help='Volts past a threshold before relMoisture changes, e.g. 0.05')
+    parser.add_argument('--probe_channels', dest='probe_channels', required=False, default=[], type=int, nargs='+',
+                        help='probes: MCP3008 channels with a moisture probe, e.g. 0 1 2 3. Defaults to --spi_in')
+    parser.add_argument('--probe_ids', dest='probe_ids', required=False, default=[], type=str, nargs='+',
+                        help='probes: an ID per channel, e.g. bed1 bed2 bed3 bed4. Defaults to ch<channel>')
+    parser.add_argument('--uv_mode', dest='uv_mode', required=False, default='auto', choices=['auto', 'forced'],
+                        help='SI1145: read the latest autonomous measurement, or force one per reading so all values are from the same cycle')
+    parser.add_argument('--lux_auto_range', dest='lux_auto_range', required=False, default=False,
+                        action='store_true', help='Run the MAX44009 in continuous mode and adapt its integration time to the light')
     parser.add_argument('--enable_lcd', dest='enable_lcd',
                         required=False, default=True, action='store_true', help='Enable the LCD?')
+    parser.add_argument('--lcd_update_frequency_s', dest='lcd_update_frequency_s', required=False, default=1.0,
+                        type=float, help='How often to update the LCD, in seconds')
+    parser.add_argument('--lcd_pages', dest='lcd_pages', required=False, default=['soil'], nargs='+',
+                        choices=['soil', 'light', 'spectrum'], help='Pages to rotate through on the LCD')
+    parser.add_argument('--lcd_page_s', dest='lcd_page_s', required=False, default=5.0, type=float,
+                        help='Seconds per LCD page')
     parser.add_argument('--disable_rest', dest='disable_rest',
                         required=False, default=False, action='store_true', help='Whether to disable the REST sender')
+    parser.add_argument('--read_timeout', dest='read_timeout_s',
+                        required=False, default=3.0, type=float, help='Max time in seconds a single sensor read may take')
+    parser.add_argument('--isolate', dest='isolate', required=False, default=False, action='store_true',
+                        help='Run every sensor in a worker process of its own, killed and restarted if a read takes longer than --read_timeout')
+    parser.add_argument('--spool_dir', dest='spool_dir',
+                        required=False, default=None, type=str, help='Directory to spool readings to until the server acknowledged them. In-memory if not set')
+    parser.add_argument('--http_timeout', dest='http_timeout_s',
+                        required=False, default=10.0, type=float, help='Timeout in seconds for requests to the REST endpoint')
+    parser.add_argument('--wire_format', dest='wire_format', required=False, default='json',
+                        choices=['json', 'columnar'], help='Batch encoding for the REST endpoint. columnar needs a matching server')
+    parser.add_argument('--compress', dest='compress',
+                        required=False, default=False, action='store_true', help='gzip batches sent to the REST endpoint')
+    parser.add_argument('--history_file', dest='history_file', required=False, default=None, type=str,
+                        help='Keep raw readings in this ring file, see history.py to query it')
+    parser.add_argument('--history_mb', dest='history_mb', required=False, default=16, type=float,
+                        help='Size of a new history file. Oldest readings are overwritten')
+    parser.add_argument('--metrics_port', dest='metrics_port', required=False, default=None, type=int,
+                        help='Serve Prometheus-style metrics on 127.0.0.1:<port>/metrics')
+    parser.add_argument('--metrics_file', dest='metrics_file', required=False, default=None, type=str,
+                        help='Also write them to this file, e.g. for node_exporter\'s textfile collector')
+    parser.add_argument('--metrics_interval', dest='metrics_interval_s', required=False, default=15.0, type=float,
+                        help='How often to rewrite --metrics_file, in seconds')
+    parser.add_argument('--sensor_id', dest='sensor_id', required=False,
+                        default=None, type=str, help='Fixed sensor ID. Defaults to hostname and MAC')
+    parser.add_argument('--id_file', dest='id_file', required=False,
+                        default=None, type=str, help='File to persist the sensor ID to, so it survives NIC changes')
+    parser.add_argument('--aggregate', dest='aggregate_s', required=False, default=0, type=float,
+                        help='Send the mean per window of this many seconds instead of raw readings, plus raw readings that cross an alert threshold. 0 (default) sends raw readings')
+    parser.add_argument('--report', dest='report_mode', required=False, default=None,
+                        choices=['deadband', 'swinging_door'], help='Report by exception: only send readings once a value leaves its tolerance. Off by default')
+    parser.add_argument('--tolerance', dest='tolerance', required=False, default=[], type=str, nargs='+',
+                        help='Per-column tolerance for --report, e.g. tempC=0.2 voltMoisture=0.05. See deadband.TOLERANCES')
+    parser.add_argument('--heartbeat', dest='heartbeat_s', required=False, default=900.0, type=float,
+                        help='With --report, send at least every this many seconds. 0 disables it')
+    parser.add_argument('--simulate', dest='simulate', required=False, default=False,
+                        action='store_true', help='Use simulated sensors instead of real hardware')
     parser.add_argument('--verbose', dest='verbose',
                         required=False, default=False, action='store_true', help='Verbose mode')
+    parser.add_argument('--log_format', dest='log_format', required=False, default='text', choices=['text', 'json'],
+                        help='json writes one JSON object per line')
+    parser.add_argument('--log_sync', dest='log_sync', required=False, default=False, action='store_true',
+                        help='Format and write logs in the calling thread, instead of in the background')
+    parser.add_argument('--log_throttle', dest='log_throttle_s', required=False, default=60.0, type=float,
+                        help='Log the same warning or error at most once per this many seconds. 0 logs all')
+    parser.add_argument('--log_sample', dest='log_sample', required=False, default=1, type=int,
+                        help='Only log every nth identical debug/info message')
     args = parser.parse_args()
 
     # Logger
-    if args.verbose:
-        logger.setLevel(logging.DEBUG)
+    from logs import setup_logging
+    log_listener = setup_logging(logging.DEBUG if args.verbose else logging.WARNING,
+                                 fmt=args.log_format, background=not args.log_sync,
+                                 throttle_s=args.log_throttle_s, sample_every=args.log_sample)
 
     # Start
     logger.warning('Starting')
 
     main(args.rest_endpoint, args.frequency_s, args.buffer_max,
-         args.spi_in, args.disable_rest, args.enable_lcd, *args.sensors)
+         args.spi_in, args.disable_rest, args.enable_lcd, *args.sensors,
+         read_timeout_s=args.read_timeout_s, spool_dir=args.spool_dir,
+         http_timeout_s=args.http_timeout_s,
+         intervals=parse_intervals(args.sensor_frequency),
+         wire_format=args.wire_format, compress=args.compress,
+         sensor_id=args.sensor_id, id_file=args.id_file,
+         aggregate_s=args.aggregate_s, simulate=args.simulate,
+         report_mode=args.report_mode, tolerances=parse_intervals(args.tolerance),
+         heartbeat_s=args.heartbeat_s, isolate=args.isolate,
+         batch_wait_s=args.batch_wait_s, dead_letter_file=args.dead_letter_file,
+         sensor_options={'oversample': args.oversample, 'oversample_filter': args.oversample_filter,
+                         'hysteresis_v': args.hysteresis_v, 'lux_auto_range': args.lux_auto_range,
+                         'uv_mode': args.uv_mode, 'probe_channels': args.probe_channels,
+                         'probe_ids': args.probe_ids},
+         metrics_port=args.metrics_port, metrics_file=args.metrics_file,
+         metrics_interval_s=args.metrics_interval_s,
+         history_file=args.history_file, history_bytes=int(args.history_mb * 1024 * 1024),
+         lcd_options={'refresh_s': args.lcd_update_frequency_s, 'pages': args.lcd_pages,
+                      'page_s': args.lcd_page_s})
+    if log_listener:
+        log_listener.stop()
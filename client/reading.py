@@ -0,0 +1,154 @@
+import json
+from collections.abc import MutableMapping
+
+# Columns of the server's `data` table
+FIELDS = ('sensorId', 'tempC', 'visLight', 'irLight', 'uvIx', 'rawMoisture', 'voltMoisture', 'lumen',
+          'measurementTs')
+# int32 in the server's Sensor struct (server/server.go); it rejects 1.0 for these
+INT_FIELDS = ('visLight', 'irLight', 'rawMoisture')
+# Not columns, but reported often enough to deserve a slot. Only part of the
+# reading once set.
+OPTIONAL = ('relMoisture', 'probes')
+_SLOTS = frozenset(FIELDS + OPTIONAL)
+_FIELDS = frozenset(FIELDS)
+
+
+class Reading(MutableMapping):
+    """One row for the `data` table
+
+    The schema's fields are slots, so a reading is a small fixed-size object
+    instead of a dict, and sensors' metrics are written into it in place.
+    Known optional values (OPTIONAL) get a slot too; anything else a sensor
+    reports goes into `extra`, which only exists once needed.
+
+    Behaves like a dict (`reading['tempC']`, `.get`, `.items()`, ...), so
+    everything downstream takes either.
+    """
+    __slots__ = FIELDS + OPTIONAL + ('extra',)
+
+    def __init__(self, sensorId=None, measurementTs=None, **values):
+        self.sensorId = sensorId
+        self.tempC = None
+        self.visLight = None
+        self.irLight = None
+        self.uvIx = None
+        self.rawMoisture = None
+        self.voltMoisture = None
+        self.lumen = None
+        self.measurementTs = measurementTs
+        self.relMoisture = None
+        self.probes = None
+        self.extra = None
+        if values:
+            self.update(values)
+
+    def __getitem__(self, key):
+        if key in _FIELDS:
+            return getattr(self, key)
+        if key in _SLOTS:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _SLOTS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELDS:
+            raise KeyError(f'{key} is part of the schema')
+        if key in _SLOTS:
+            if getattr(self, key) is None:
+                raise KeyError(key)
+            setattr(self, key, None)
+            return
+        if self.extra is None:
+            raise KeyError(key)
+        del self.extra[key]
+
+    def __iter__(self):
+        yield from FIELDS
+        for k in OPTIONAL:
+            if getattr(self, k) is not None:
+                yield k
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return (len(FIELDS) + sum(getattr(self, k) is not None for k in OPTIONAL)
+                + (len(self.extra) if self.extra else 0))
+
+    def __contains__(self, key):
+        if key in _SLOTS:
+            return key in _FIELDS or getattr(self, key) is not None
+        return self.extra is not None and key in self.extra
+
+    def get(self, key, default=None):
+        if key in _FIELDS:
+            return getattr(self, key)
+        if key in _SLOTS:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.extra is None:
+            return default
+        return self.extra.get(key, default)
+
+    def update(self, metrics: dict):
+        """Write a sensor's metrics into this reading"""
+        for k, v in metrics.items():
+            if k in _SLOTS:
+                setattr(self, k, v)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[k] = v
+
+    def items(self):
+        return self.to_dict().items()
+
+    def to_dict(self) -> dict:
+        # Spelled out: a literal is about 3x faster than zip(FIELDS, ...),
+        # and this is what JSON encoding costs on top of a plain dict
+        d = {
+            'sensorId': self.sensorId,
+            'tempC': self.tempC,
+            'visLight': self.visLight,
+            'irLight': self.irLight,
+            'uvIx': self.uvIx,
+            'rawMoisture': self.rawMoisture,
+            'voltMoisture': self.voltMoisture,
+            'lumen': self.lumen,
+            'measurementTs': self.measurementTs,
+        }
+        if self.relMoisture is not None:
+            d['relMoisture'] = self.relMoisture
+        if self.probes is not None:
+            d['probes'] = self.probes
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    def __eq__(self, other):
+        if isinstance(other, (Reading, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f'Reading({self.to_dict()})'
+
+
+def to_jsonable(reading):
+    """What `json.dumps` can take: dicts as they are, Readings as a dict"""
+    return reading.to_dict() if isinstance(reading, Reading) else reading
+
+
+def dumps(reading, separators=(',', ':')) -> str:
+    return json.dumps(to_jsonable(reading), separators=separators)
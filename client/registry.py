@@ -0,0 +1,155 @@
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Third-party drivers register under this entry point group, e.g. in setup.py:
+# entry_points={'raspberry_gardener.sensors': ['soil2 = mydriver:Soil2_S']}
+ENTRY_POINT_GROUP = 'raspberry_gardener.sensors'
+
+
+class SensorRegistry():
+    """All known sensor drivers, by name
+
+    Subclasses of `Sensor` register themselves; third-party drivers can also
+    come in via the `raspberry_gardener.sensors` entry point group.
+    """
+
+    def __init__(self, group=ENTRY_POINT_GROUP):
+        self.group = group
+        self._drivers = {}
+        self._entry_points_loaded = False
+
+    def register(self, cls, name: str = None):
+        """Register a driver
+
+        Args:
+            cls (type): The Sensor class
+            name (str, optional): Defaults to `cls.name`.
+
+        Raises:
+            ValueError: If a different driver already took the name
+        """
+        name = name or cls.name
+        if not name:
+            raise ValueError(f'{cls.__qualname__} has no name')
+        existing = self._drivers.get(name)
+        if existing is not None and existing is not cls:
+            raise ValueError(f'Sensor name {name} is taken by {existing.__module__}.{existing.__qualname__}, '
+                             f'cannot register {cls.__module__}.{cls.__qualname__}')
+        self._drivers[name] = cls
+        return cls
+
+    def replace(self, name: str, cls):
+        """Swap out a driver on purpose, e.g. for a simulated one
+
+        Returns:
+            type: The previous driver, or None
+        """
+        previous = self._drivers.get(name)
+        self._drivers[name] = cls
+        return previous
+
+    def get(self, name: str):
+        """Look up a driver by name
+
+        Returns:
+            type: The Sensor class, or None
+        """
+        return self._drivers.get(name)
+
+    def names(self) -> list:
+        return list(self._drivers)
+
+    def load_entry_points(self):
+        """Import and register all drivers from installed packages. Runs once."""
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            # Python < 3.8
+            return
+        eps = entry_points()
+        if hasattr(eps, 'select'):
+            eps = eps.select(group=self.group)
+        else:
+            eps = eps.get(self.group, [])
+        for ep in eps:
+            try:
+                self.register(ep.load(), ep.name)
+            except ValueError:
+                # Name clash, don't hide it
+                raise
+            except Exception as e:
+                logger.error('Cannot load sensor plugin %s: %s', ep.name, e)
+
+
+SENSORS = SensorRegistry()
+
+
+class Sensor():
+    # We define a unique name per sensor, so we can spawn instances
+    name = None
+    # Bus the sensor sits on. Sensors on different buses are read in parallel
+    bus = 'i2c'
+    # Don't poll faster than this, e.g. the conversion time of the chip
+    min_interval_s = 0.0
+    # Columns of the `data` table this sensor fills
+    columns = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Subclasses without a name of their own are base classes or
+        # variants of a driver, not new drivers
+        if cls.__dict__.get('name'):
+            SENSORS.register(cls)
+
+    def __init__(self, **kwargs):
+        """Implemented in each sensor (constructor, duh)
+
+        Should set `self.sensor` at least. Import the driver's libraries
+        in here, not at the top of the module: that way, we only ever load
+        what `--sensors` asked for.
+        """
+        pass
+
+    def read_metric(self) -> dict:
+        """Implemented in each sensor
+
+        Returns a `dict` of readings, mapping to the SQL schema.
+
+        Return None if no reading. Equals NULL in DB.
+
+        Returns:
+            dict: Column -> Reading
+        """
+        pass
+
+
+def plan_intervals(sensors, period_s: float, intervals: dict = None) -> dict:
+    """Work out how often to read each sensor
+
+    Uses the requested interval (or the base period), but never faster than
+    what the driver declared as `min_interval_s` (rounded up to a multiple of
+    the period, since that's what the scheduler runs on).
+
+    Args:
+        sensors (iterable): Sensor classes or instances. Instances can override
+            `min_interval_s`, e.g. depending on their options
+        period_s (float): Base period
+        intervals (dict, optional): Requested name -> seconds. Defaults to None.
+
+    Returns:
+        dict: Name -> seconds
+    """
+    intervals = intervals or {}
+    plan = {}
+    for cls in sensors:
+        wanted = intervals.get(cls.name, period_s)
+        if wanted < cls.min_interval_s:
+            logger.warning('%s can only be read every %ss, not %ss', cls.name, cls.min_interval_s, wanted)
+            wanted = math.ceil(cls.min_interval_s / period_s) * period_s
+        plan[cls.name] = wanted
+    return plan
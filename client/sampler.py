@@ -0,0 +1,120 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class SensorTimeout(Exception):
+    pass
+
+
+def instruments(name: str, metrics=METRICS) -> tuple:
+    """Per-sensor read metrics, the same for every sampler
+
+    Returns:
+        tuple: (latency, errors, empty, timeouts)
+    """
+    return (
+        metrics.histogram('sensor_read_seconds', 'Time per read_metric call', sensor=name),
+        metrics.counter('sensor_read_errors_total', 'read_metric raised', sensor=name),
+        metrics.counter('sensor_read_empty_total', 'read_metric returned no data', sensor=name),
+        metrics.counter('sensor_read_timeouts_total', 'Read blew the timeout, or was skipped because of one', sensor=name),
+    )
+
+
+class BusSampler():
+    """Reads sensors on independent buses in parallel
+
+    Every bus gets a single worker thread, so reads on the same bus stay
+    serialized (in order), while e.g. the SPI moisture read no longer waits
+    for an 800ms MAX44009 conversion on I2C.
+
+    Python can't interrupt a hung read. If a sensor blows its timeout, we give
+    up on its bus for this tick and hand the bus a fresh worker; the stuck
+    thread is abandoned and exits whenever the call returns. For drivers
+    that hang for good, see workers.WorkerPool.
+    """
+
+    def __init__(self, timeout_s=3.0, metrics=METRICS):
+        self.timeout_s = timeout_s
+        self._executors = {}
+        self.timeouts = 0
+        self.metrics = metrics
+        # Sensor name -> (latency, errors, empty, timeouts), looked up once
+        self._instruments = {}
+
+    def _instrument(self, name: str) -> tuple:
+        if name not in self._instruments:
+            self._instruments[name] = instruments(name, self.metrics)
+        return self._instruments[name]
+
+    def _timed_read(self, name: str, sensor):
+        latency, errors, empty, _ = self._instrument(name)
+        start = time.perf_counter()
+        try:
+            metrics = sensor.read_metric()
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - start)
+        if not metrics:
+            empty.inc()
+        return metrics
+
+    def _executor(self, bus: str) -> ThreadPoolExecutor:
+        if bus not in self._executors:
+            self._executors[bus] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f'sampler-{bus}')
+        return self._executors[bus]
+
+    def _abandon(self, bus: str):
+        ex = self._executors.pop(bus, None)
+        if ex:
+            ex.shutdown(wait=False)
+
+    def read_all(self, sensors: dict) -> dict:
+        """Read all sensors, in parallel across buses
+
+        Args:
+            sensors (dict): Name -> Sensor
+
+        Returns:
+            dict: Name -> metrics (dict or None), or the Exception the read raised
+        """
+        # Submit everything up front, grouped by bus
+        by_bus = {}
+        for k, sensor in sensors.items():
+            bus = getattr(sensor, 'bus', None) or 'i2c'
+            by_bus.setdefault(bus, []).append(
+                (k, self._executor(bus).submit(self._timed_read, k, sensor)))
+
+        results = {}
+        for bus, futures in by_bus.items():
+            for i, (k, f) in enumerate(futures):
+                # Each sensor gets its own budget once the previous one on this bus is done
+                try:
+                    results[k] = f.result(timeout=self.timeout_s)
+                except FutureTimeout:
+                    self.timeouts += 1
+                    self._instrument(k)[3].inc()
+                    results[k] = SensorTimeout(
+                        f'{k} did not answer within {self.timeout_s}s on {bus}')
+                    # Everything queued behind it is stuck, too
+                    for k2, f2 in futures[i+1:]:
+                        f2.cancel()
+                        self._instrument(k2)[3].inc()
+                        results[k2] = SensorTimeout(f'{k2} skipped, {bus} is hung')
+                    self._abandon(bus)
+                    break
+                except Exception as e:
+                    results[k] = e
+        # Keep the caller's order
+        return {k: results[k] for k in sensors}
+
+    def shutdown(self):
+        for bus in list(self._executors):
+            self._executors.pop(bus).shutdown(wait=False)
@@ -0,0 +1,125 @@
+import logging
+import time
+from collections import namedtuple
+
+from metrics import LatencyStats, METRICS
+
+logger = logging.getLogger(__name__)
+
+# index: tick number since start, deadline: monotonic time it was due, late_s: how late it fired
+Tick = namedtuple('Tick', ['index', 'deadline', 'late_s'])
+
+
+class FixedRateScheduler():
+    """Fixed-rate ticks on the monotonic clock
+
+    Deadlines are absolute (`start + n * period_s`), so time spent reading and
+    sending doesn't add up over the day the way `time.sleep(period)` does.
+    If we fall behind by more than a period, the missed ticks are skipped
+    (and counted) instead of firing in a burst.
+
+    Sensors can run slower than the base rate via `intervals`
+    (e.g. `{'moisture': 60}`), rounded to a multiple of the period. Rounding
+    is logged, incl. intervals shorter than the period, which become every tick.
+    """
+
+    def __init__(self, period_s: float, intervals: dict = None, clock=time.monotonic, sleep=time.sleep,
+                 metrics=METRICS):
+        if period_s <= 0:
+            raise ValueError(f'Period must be > 0, got {period_s}')
+        self.period_s = period_s
+        self._every = {}
+        for k, v in (intervals or {}).items():
+            every = max(1, round(v / period_s))
+            if abs(every * period_s - v) > 1e-6:
+                logger.warning('%s: reading every %gs (a multiple of the %gs period), not %gs',
+                               k, every * period_s, period_s, v)
+            self._every[k] = every
+        self._next_due = {}
+        self._clock = clock
+        self._sleep = sleep
+        self._start = None
+        self._index = 0
+        self.missed = 0
+        self.lag = LatencyStats()
+        self._lag_hist = metrics.histogram('scheduler_lag_seconds', 'How late ticks fire')
+        self._missed = metrics.counter('scheduler_missed_ticks_total', 'Ticks skipped because we fell behind')
+
+    def wait(self) -> Tick:
+        """Block until the next deadline
+
+        Returns:
+            Tick: The tick that's due now
+        """
+        now = self._clock()
+        if self._start is None:
+            self._start = now
+        deadline = self._start + self._index * self.period_s
+        if now < deadline:
+            self._sleep(deadline - now)
+            now = self._clock()
+        late = now - deadline
+        if late >= self.period_s:
+            skipped = int(late // self.period_s)
+            logger.warning('Running %.3fs behind, skipping %d ticks', late, skipped)
+            self.missed += skipped
+            self._missed.inc(skipped)
+            self._index += skipped
+            deadline += skipped * self.period_s
+            late = now - deadline
+        tick = Tick(self._index, deadline, late)
+        self.lag.observe(late)
+        self._lag_hist.observe(late)
+        self._index += 1
+        return tick
+
+    @property
+    def ticks(self) -> int:
+        """Ticks handed out (or skipped) so far"""
+        return self._index
+
+    def due(self, tick: Tick, names) -> list:
+        """Which of `names` should be read on this tick
+
+        Args:
+            tick (Tick): Current tick
+            names (iterable): Sensor names
+
+        Returns:
+            list: Names that are due
+        """
+        due = []
+        for name in names:
+            every = self._every.get(name, 1)
+            if tick.index >= self._next_due.get(name, 0):
+                due.append(name)
+                self._next_due[name] = tick.index + every
+        return due
+
+    def stats(self) -> dict:
+        return {
+            'ticks': self._index,
+            'missed': self.missed,
+            'lag': self.lag.as_dict(),
+        }
+
+
+def parse_intervals(specs) -> dict:
+    """Parse `name=seconds` pairs, e.g. from the command line
+
+    Args:
+        specs (list): e.g. ['moisture=60', 'lumen=1']
+
+    Raises:
+        ValueError: On malformed input
+
+    Returns:
+        dict: Name -> seconds
+    """
+    intervals = {}
+    for spec in specs or []:
+        name, sep, seconds = spec.partition('=')
+        if not sep or not name:
+            raise ValueError(f'Expected name=seconds, got {spec}')
+        intervals[name] = float(seconds)
+    return intervals
@@ -0,0 +1,435 @@
+"""Simulated buses and chips, so the client runs without a Pi
+
+The fakes work at the register / SPI transfer level: `MCP9808_S` and
+`MAX44009_S` run their real drivers against `FakeI2C`. The SI1145 and MCP3008
+libraries need real hardware to even construct, so those sensors get thin
+drivers that talk to the fake chips the same way the libraries do. `moisture`
+and `probes` run their real scanner (`adc.py`) against `FakeSPI`.
+
+Every chip has a `Behavior` (latency per transaction, error rate) and a
+`Wave` per measured value.
+
+Usage:
+    sim = Simulation(seed=42, latency_s=0.001)
+    sim.install()
+    sensors = create_sensors('temp', 'lumen', 'uv', 'moisture')
+    ...
+    sim.uninstall()
+"""
+import errno
+import math
+import random
+import threading
+import time
+
+from bus import BUSES, Bus
+from registry import SENSORS
+
+
+class Wave():
+    """A signal over time: mean + sine + gaussian noise"""
+
+    def __init__(self, mean: float, amplitude=0.0, period_s=3600.0, noise=0.0):
+        self.mean = mean
+        self.amplitude = amplitude
+        self.period_s = period_s
+        self.noise = noise
+
+    def __call__(self, t: float, rng: random.Random) -> float:
+        v = self.mean + self.amplitude * math.sin(2 * math.pi * t / self.period_s)
+        if self.noise:
+            v += rng.gauss(0, self.noise)
+        return v
+
+
+class Behavior():
+    """How a chip misbehaves: latency per transaction and a chance of EREMOTEIO"""
+
+    def __init__(self, latency_s=0.0, error_rate=0.0):
+        self.latency_s = latency_s
+        self.error_rate = error_rate
+
+    def transact(self, rng: random.Random):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if self.error_rate and rng.random() < self.error_rate:
+            raise OSError(errno.EREMOTEIO, 'Remote I/O error')
+
+
+class FakeChip():
+    address = None
+
+    def __init__(self, sim, behavior: Behavior):
+        self.sim = sim
+        self.behavior = behavior
+        self.reads = 0
+        self.writes = 0
+
+    def read(self, reg: int, n: int) -> bytes:
+        self.behavior.transact(self.sim.rng)
+        self.reads += 1
+        return bytes(n)
+
+    def write(self, reg: int, data: bytes):
+        self.behavior.transact(self.sim.rng)
+        self.writes += 1
+
+
+class FakeMCP9808(FakeChip):
+    address = 0x18
+
+    def __init__(self, sim, behavior, temp: Wave):
+        super().__init__(sim, behavior)
+        self.temp = temp
+
+    def read(self, reg: int, n: int) -> bytes:
+        # 16 bit registers, big endian
+        self.behavior.transact(self.sim.rng)
+        self.reads += 1
+        if reg == 0x05:
+            t = self.temp(self.sim.now(), self.sim.rng)
+            if t < 0:
+                val = int(round((t + 256) * 16)) & 0x0FFF | 0x1000
+            else:
+                val = int(round(t * 16)) & 0x0FFF
+        elif reg == 0x06:
+            val = 0x0054
+        elif reg == 0x07:
+            val = 0x0400
+        else:
+            val = 0x0000
+        return bytes([(val >> 8) & 0xFF, val & 0xFF])[:n]
+
+
+class FakeMAX44009(FakeChip):
+    address = 0x4A
+
+    def __init__(self, sim, behavior, lux: Wave):
+        super().__init__(sim, behavior)
+        self.lux = lux
+        self.config = 0x03
+
+    def write(self, reg: int, data: bytes):
+        super().write(reg, data)
+        if reg == 0x02 and data:
+            self.config = data[0]
+
+    def read(self, reg: int, n: int) -> bytes:
+        self.behavior.transact(self.sim.rng)
+        self.reads += 1
+        lux = max(0.0, self.lux(self.sim.now(), self.sim.rng))
+        exponent = 0
+        if self.config & 0x40:
+            # Manual mode: a shorter integration time or divided current is what makes room for bright light
+            timer, cdr = self.config & 0x07, self.config & 0x08
+            lux = min(lux, 1000 * 2 ** timer * (8 if cdr else 1))
+        mantissa = lux / 0.045
+        while mantissa > 255 and exponent < 14:
+            mantissa /= 2
+            exponent += 1
+        mantissa = min(255, int(round(mantissa)))
+        regs = {
+            0x02: self.config,
+            0x03: (exponent << 4) | (mantissa >> 4),
+            0x04: mantissa & 0x0F,
+        }
+        return bytes(regs.get(reg + i, 0) for i in range(n))
+
+
+class FakeSI1145(FakeChip):
+    address = 0x60
+
+    def __init__(self, sim, behavior, vis: Wave, ir: Wave, uv: Wave):
+        super().__init__(sim, behavior)
+        self.vis = vis
+        self.ir = ir
+        self.uv = uv
+        # Autonomous: every read sees a new measurement cycle.
+        # Paused: only ALS_FORCE updates the values
+        self.paused = False
+        self.irqstat = 0
+        self.forced = 0
+        self._values = self._measure()
+
+    def _measure(self) -> dict:
+        t = self.sim.now()
+        return {
+            0x22: self.vis(t, self.sim.rng),
+            0x24: self.ir(t, self.sim.rng),
+            0x2C: self.uv(t, self.sim.rng) * 100,
+        }
+
+    def write(self, reg: int, data: bytes):
+        super().write(reg, data)
+        if not data:
+            return
+        if reg == 0x18:
+            if data[0] == 0x0B:
+                self.paused = True
+            elif data[0] in (0x0E, 0x0F):
+                self.paused = False
+            elif data[0] in (0x06, 0x07):
+                self._values = self._measure()
+                self.irqstat |= 0x01
+                self.forced += 1
+        elif reg == 0x21:
+            # Write 1 to clear
+            self.irqstat &= ~data[0]
+
+    def read(self, reg: int, n: int) -> bytes:
+        self.behavior.transact(self.sim.rng)
+        self.reads += 1
+        if not self.paused:
+            self._values = self._measure()
+        # 16 bit little endian measurement registers
+        regs = {0x21: self.irqstat}
+        for r, v in self._values.items():
+            v = max(0, min(0xFFFF, int(round(v))))
+            regs[r] = v & 0xFF
+            regs[r + 1] = v >> 8
+        return bytes(regs.get(reg + i, 0) for i in range(n))
+
+
+class FakeMCP3008():
+    """8 channel, 10 bit ADC. Channels are voltages."""
+
+    def __init__(self, sim, behavior: Behavior, channels: dict, vref=3.3):
+        self.sim = sim
+        self.behavior = behavior
+        self.channels = channels
+        self.vref = vref
+        self.conversions = 0
+
+    def transfer(self, out: bytes) -> bytes:
+        self.behavior.transact(self.sim.rng)
+        self.conversions += 1
+        # Single-ended: [0x01, (0x8 | ch) << 4, 0x00]
+        ch = (out[1] >> 4) & 0x07
+        wave = self.channels.get(ch)
+        v = wave(self.sim.now(), self.sim.rng) if wave else 0.0
+        code = max(0, min(1023, int(round(v / self.vref * 1023))))
+        return bytes([0x00, (code >> 8) & 0x03, code & 0xFF])
+
+
+class FakeI2C():
+    """Speaks both the `busio.I2C` and the `smbus2.SMBus` API"""
+
+    def __init__(self, chips):
+        self.chips = {c.address: c for c in chips}
+        self._lock = threading.Lock()
+        self.transactions = 0
+
+    def _chip(self, addr: int) -> FakeChip:
+        self.transactions += 1
+        if addr not in self.chips:
+            raise OSError(errno.EREMOTEIO, 'Remote I/O error')
+        return self.chips[addr]
+
+    # busio
+    def try_lock(self) -> bool:
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self) -> list:
+        return sorted(self.chips)
+
+    def writeto(self, addr, buf, *, start=0, end=None):
+        buf = bytes(buf[start:end])
+        chip = self._chip(addr)
+        if buf:
+            chip.write(buf[0], buf[1:])
+
+    def readfrom_into(self, addr, buf, *, start=0, end=None):
+        end = len(buf) if end is None else end
+        buf[start:end] = self._chip(addr).read(0, end - start)
+
+    def writeto_then_readfrom(self, addr, out_buffer, in_buffer, *, out_start=0, out_end=None,
+                              in_start=0, in_end=None):
+        in_end = len(in_buffer) if in_end is None else in_end
+        reg = out_buffer[out_start]
+        in_buffer[in_start:in_end] = self._chip(addr).read(reg, in_end - in_start)
+
+    def deinit(self):
+        pass
+
+    # smbus2
+    def read_i2c_block_data(self, addr, reg, length, force=None) -> list:
+        return list(self._chip(addr).read(reg, length))
+
+    def read_byte_data(self, addr, reg, force=None) -> int:
+        return self._chip(addr).read(reg, 1)[0]
+
+    def write_byte_data(self, addr, reg, value, force=None):
+        self._chip(addr).write(reg, bytes([value]))
+
+    def write_i2c_block_data(self, addr, reg, data, force=None):
+        self._chip(addr).write(reg, bytes(data))
+
+    def close(self):
+        pass
+
+
+class FakeSPI():
+    """`busio.SPI` with a single MCP3008 on CE0"""
+
+    def __init__(self, adc: FakeMCP3008):
+        self.adc = adc
+        self._lock = threading.Lock()
+        self.locks = 0
+
+    def try_lock(self) -> bool:
+        if self._lock.acquire(blocking=False):
+            self.locks += 1
+            return True
+        return False
+
+    def unlock(self):
+        self._lock.release()
+
+    def configure(self, **kwargs):
+        pass
+
+    def write_readinto(self, out_buffer, in_buffer, **kwargs):
+        in_buffer[:] = self.adc.transfer(bytes(out_buffer))
+
+    def deinit(self):
+        pass
+
+
+class SimChipSelect():
+    """Stand-in for `digitalio.DigitalInOut`, counts selects"""
+
+    def __init__(self):
+        self.value = True
+        self.selects = 0
+
+    def switch_to_output(self, value=False):
+        self.value = value
+
+    def __setattr__(self, name, value):
+        if name == 'value' and not value and getattr(self, 'value', True):
+            self.selects += 1
+        super().__setattr__(name, value)
+
+
+class SimGPIODevice():
+    """Same interface as `Adafruit_GPIO.I2C.Device`, which the SI1145 lib uses"""
+
+    def __init__(self, i2c: FakeI2C, address: int):
+        self.i2c = i2c
+        self.address = address
+
+    def readList(self, reg, length):
+        return bytearray(self.i2c.read_i2c_block_data(self.address, reg, length))
+
+    def readU8(self, reg):
+        return self.i2c.read_byte_data(self.address, reg)
+
+    def readU16LE(self, reg):
+        lo, hi = self.i2c.read_i2c_block_data(self.address, reg, 2)
+        return (hi << 8) | lo
+
+    def write8(self, reg, value):
+        self.i2c.write_byte_data(self.address, reg, value)
+
+
+class SimSI1145Driver():
+    """Stand-in for `SI1145.SI1145`, reading the same registers"""
+
+    def __init__(self, i2c: FakeI2C, address=0x60):
+        self._device = SimGPIODevice(i2c, address)
+
+    def readVisible(self):
+        return self._device.readU16LE(0x22)
+
+    def readIR(self):
+        return self._device.readU16LE(0x24)
+
+    def readUV(self):
+        return self._device.readU16LE(0x2C)
+
+
+_SIM = None
+
+
+def current():
+    """The installed Simulation, if any"""
+    return _SIM
+
+
+def _sim_drivers():
+    # Subclass whatever is registered, so this works with monitor.py as __main__, too
+    SI1145_S, HD38_S, HD38_Multi_S = SENSORS.get('uv'), SENSORS.get('moisture'), SENSORS.get('probes')
+
+    class SimSI1145_S(SI1145_S):
+        def _connect(self):
+            self.sensor = SimSI1145Driver(current().i2c)
+
+    class SimHD38_S(HD38_S):
+        def _chip_select(self):
+            return SimChipSelect()
+
+    class SimHD38_Multi_S(HD38_Multi_S):
+        def _chip_select(self):
+            return SimChipSelect()
+
+    return [SimSI1145_S, SimHD38_S, SimHD38_Multi_S]
+
+
+class Simulation():
+    """All four sensors on fake buses
+
+    Args:
+        seed (int, optional): For reproducible noise/errors. Defaults to None.
+        latency_s (float, optional): Per transaction, all chips. Defaults to 0.0.
+        error_rate (float, optional): Per transaction, all chips. Defaults to 0.0.
+        behaviors (dict, optional): Override per chip: 'temp', 'lumen', 'uv', 'moisture'
+        clock (callable, optional): Time source for the waves. Defaults to time.monotonic.
+    """
+
+    def __init__(self, seed=None, latency_s=0.0, error_rate=0.0, behaviors: dict = None,
+                 clock=time.monotonic):
+        self.rng = random.Random(seed)
+        self._clock = clock
+        self._t0 = clock()
+        behaviors = behaviors or {}
+
+        def behavior(name):
+            return behaviors.get(name) or Behavior(latency_s, error_rate)
+
+        self.temp = FakeMCP9808(self, behavior('temp'), Wave(21.0, 4.0, 86400, 0.05))
+        self.lux = FakeMAX44009(self, behavior('lumen'), Wave(12000, 10000, 86400, 50))
+        self.uv = FakeSI1145(self, behavior('uv'), Wave(300, 50, 86400, 2),
+                             Wave(400, 80, 86400, 2), Wave(2.5, 2.0, 86400, 0.05))
+        self.adc = FakeMCP3008(self, behavior('moisture'),
+                               {ch: Wave(1.3 + 0.1 * ch, 0.2, 3 * 86400, 0.02) for ch in range(8)})
+        self.i2c = FakeI2C([self.temp, self.lux, self.uv])
+        self.spi = FakeSPI(self.adc)
+        self._saved = None
+
+    def now(self) -> float:
+        return self._clock() - self._t0
+
+    def install(self):
+        """Point the shared buses and the `uv`/`moisture`/`probes` drivers at the fakes"""
+        global _SIM
+        i2c = Bus('i2c', busio=lambda: self.i2c, smbus=lambda: self.i2c)
+        spi = Bus('spi', busio=lambda: self.spi)
+        saved_drivers = {cls.name: SENSORS.replace(cls.name, cls)
+                         for cls in _sim_drivers()}
+        self._saved = (BUSES.i2c, BUSES.spi, saved_drivers)
+        BUSES.i2c, BUSES.spi = i2c, spi
+        _SIM = self
+        return self
+
+    def uninstall(self):
+        global _SIM
+        if not self._saved:
+            return
+        BUSES.i2c, BUSES.spi, drivers = self._saved
+        for name, cls in drivers.items():
+            SENSORS.replace(name, cls)
+        self._saved = None
+        _SIM = None
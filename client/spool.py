@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from reading import to_jsonable
+
+logger = logging.getLogger(__name__)
+
+
+class MemorySpool():
+    """In-memory stand-in for `Spool`, for when there's no spool directory
+
+    Same contract (nothing is removed until `ack`), but doesn't survive a restart.
+    """
+
+    def __init__(self, max_items=10000):
+        self.max_items = max_items
+        self._items = []
+        # Absolute index of _items[0], so a drop while a batch is in flight doesn't shift the ack
+        self._head = 0
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def append(self, reading: dict):
+        with self._lock:
+            self._items.append(reading)
+            if len(self._items) > self.max_items:
+                # Oldest data goes first
+                self._items.pop(0)
+                self._head += 1
+                self.dropped += 1
+
+    def peek(self, n: int):
+        with self._lock:
+            batch = self._items[:n]
+            return batch, self._head + len(batch)
+
+    def ack(self, token):
+        with self._lock:
+            del self._items[:max(0, token - self._head)]
+            self._head = max(self._head, token)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Spool():
+    """Write-ahead spool for readings, on disk (SD card)
+
+    Readings are appended as JSON lines to numbered segment files. Nothing is
+    ever rewritten: appends go to the end of the active segment, consumed
+    segments are deleted as a whole, and only a tiny cursor file is replaced
+    when a batch is acknowledged. fsync runs every `fsync_every` appends or
+    `fsync_interval_s`, whichever comes first.
+
+    Once the spool is over `max_bytes`, the oldest segment is dropped.
+    """
+    CURSOR = 'cursor.json'
+
+    def __init__(self, path: str, segment_bytes=256 * 1024, max_bytes=64 * 1024 * 1024,
+                 fsync_every=10, fsync_interval_s=5.0):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval_s = fsync_interval_s
+        self._lock = threading.RLock()
+        self.dropped = 0
+        # Bumped by every `_drop_oldest`, so `ack` knows its count is stale
+        self._drops = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(path, exist_ok=True)
+
+        self._segments = sorted(self._list_segments())
+        self._cursor = self._load_cursor()
+        self._pending = self._count_pending()
+        # Never append to a segment that may have a torn tail from a crash
+        self._open_segment(max([s + 1 for s in self._segments] + [self._cursor[0] + 1]))
+
+    def _seg_path(self, seq: int) -> str:
+        return os.path.join(self.path, f'{seq:012d}.jsonl')
+
+    def _list_segments(self):
+        for f in os.listdir(self.path):
+            if f.endswith('.jsonl'):
+                try:
+                    yield int(f[:-len('.jsonl')])
+                except ValueError:
+                    continue
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.path, self.CURSOR)) as f:
+                c = json.load(f)
+                cursor = (c['seq'], c['offset'])
+        except (OSError, ValueError, KeyError):
+            cursor = (self._segments[0], 0) if self._segments else (0, 0)
+        # Segments before the cursor may have been dropped in the meantime
+        if self._segments and cursor[0] < self._segments[0]:
+            cursor = (self._segments[0], 0)
+        return cursor
+
+    def _save_cursor(self):
+        tmp = os.path.join(self.path, self.CURSOR + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'seq': self._cursor[0], 'offset': self._cursor[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, self.CURSOR))
+
+    def _count_lines(self, seq: int, offset=0, end=None) -> int:
+        try:
+            with open(self._seg_path(seq), 'rb') as f:
+                f.seek(offset)
+                if end is not None:
+                    return f.read(max(0, end - offset)).count(b'\n')
+                return sum(1 for ln in f if ln.endswith(b'\n'))
+        except OSError:
+            return 0
+
+    def _count_range(self, start: tuple, end: tuple) -> int:
+        """Records from `start` up to `end`, both (seq, offset)"""
+        return sum(self._count_lines(s, start[1] if s == start[0] else 0, end[1] if s == end[0] else None)
+                   for s in self._segments if start[0] <= s <= end[0])
+
+    def _count_pending(self) -> int:
+        seq, offset = self._cursor
+        return sum(self._count_lines(s, offset if s == seq else 0)
+                   for s in self._segments if s >= seq)
+
+    def _open_segment(self, seq: int):
+        self._seq = seq
+        self._file = open(self._seg_path(seq), 'ab')
+        self._size = self._file.tell()
+        if seq not in self._segments:
+            self._segments.append(seq)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _disk_usage(self) -> int:
+        total = 0
+        for s in self._segments:
+            try:
+                total += os.path.getsize(self._seg_path(s))
+            except OSError:
+                continue
+        return total
+
+    def _drop_oldest(self):
+        seq = self._segments.pop(0)
+        offset = self._cursor[1] if self._cursor[0] == seq else 0
+        lost = self._count_lines(seq, offset) if seq >= self._cursor[0] else 0
+        os.remove(self._seg_path(seq))
+        self.dropped += lost
+        self._drops += 1
+        self._pending -= lost
+        if self._cursor[0] <= seq:
+            self._cursor = (self._segments[0], 0)
+            self._save_cursor()
+        logger.warning('Spool over %d bytes, dropped %d readings', self.max_bytes, lost)
+
+    def __len__(self):
+        return self._pending
+
+    def append(self, reading: dict):
+        """Append a reading. Durable after the next fsync."""
+        line = (json.dumps(reading, default=to_jsonable) + '\n').encode('utf-8')
+        with self._lock:
+            if self._size + len(line) > self.segment_bytes and self._size > 0:
+                self._sync()
+                self._file.close()
+                self._open_segment(self._seq + 1)
+                while len(self._segments) > 1 and self._disk_usage() > self.max_bytes:
+                    self._drop_oldest()
+            self._file.write(line)
+            # Push to the page cache so `peek` sees it; fsync is batched
+            self._file.flush()
+            self._size += len(line)
+            self._pending += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or \
+                    time.monotonic() - self._last_sync >= self.fsync_interval_s:
+                self._sync()
+
+    def peek(self, n: int):
+        """Get up to `n` of the oldest readings, without removing them
+
+        Args:
+            n (int): Max readings
+
+        Returns:
+            tuple: (list of readings, token to pass to `ack`)
+        """
+        batch = []
+        consumed = 0
+        with self._lock:
+            seq, offset = self._cursor
+            while len(batch) < n and seq <= self._seq:
+                if seq not in self._segments:
+                    seq, offset = seq + 1, 0
+                    continue
+                with open(self._seg_path(seq), 'rb') as f:
+                    f.seek(offset)
+                    while len(batch) < n:
+                        ln = f.readline()
+                        if not ln.endswith(b'\n'):
+                            break
+                        offset += len(ln)
+                        consumed += 1
+                        try:
+                            batch.append(json.loads(ln))
+                        except ValueError:
+                            logger.warning('Skipping corrupt spool record in segment %s', seq)
+                if len(batch) < n and seq < self._seq:
+                    seq, offset = seq + 1, 0
+                else:
+                    break
+            return batch, (seq, offset, consumed, self._drops)
+
+    def ack(self, token):
+        """Remove everything up to `token` (from `peek`), e.g. after a 2xx"""
+        seq, offset, consumed, drops = token
+        with self._lock:
+            if seq < self._segments[0]:
+                # The batch's segment was dropped while it was in flight
+                self._cursor = (self._segments[0], 0)
+                self._pending = self._count_pending()
+            else:
+                if drops != self._drops:
+                    # Part of the batch may be gone, and already off _pending
+                    consumed = self._count_range(self._cursor, (seq, offset))
+                self._cursor = (seq, offset)
+                self._pending -= consumed
+            while self._segments and self._segments[0] < self._cursor[0]:
+                os.remove(self._seg_path(self._segments.pop(0)))
+            self._save_cursor()
+
+    def flush(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
@@ -0,0 +1,39 @@
+import pytest
+from adc import MCP3008Scanner
+from simulated import Behavior, FakeMCP3008, FakeSPI, SimChipSelect
+
+
+class Const():
+    def __init__(self, v):
+        self.v = v
+
+    def __call__(self, t, rng):
+        return self.v
+
+
+def _scanner(channels, volts):
+    sim = type('Sim', (), {'rng': None, 'now': lambda self: 0.0})()
+    adc = FakeMCP3008(sim, Behavior(), {ch: Const(v) for ch, v in volts.items()})
+    spi = FakeSPI(adc)
+    cs = SimChipSelect()
+    return MCP3008Scanner(spi, cs, channels), spi, cs
+
+
+def test_scan_one_lock():
+    scanner, spi, cs = _scanner([0, 3, 7], {0: 1.0, 3: 2.0, 7: 3.3})
+    samples = scanner.scan(passes=4)
+    assert spi.locks == 1
+    # A chip select per conversion, released at the end
+    assert cs.selects == 12 and cs.value
+    assert spi.adc.conversions == 12
+    assert [len(s) for s in samples] == [4, 4, 4]
+    assert samples[2][0] == 1023 << 6
+    assert scanner.volts(samples[1][0]) == pytest.approx(2.0, abs=0.01)
+    assert scanner.volts(samples[0][0]) == pytest.approx(1.0, abs=0.01)
+
+
+def test_bad_channels():
+    with pytest.raises(ValueError):
+        _scanner([8], {})
+    with pytest.raises(ValueError):
+        _scanner([], {})
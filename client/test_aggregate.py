@@ -0,0 +1,92 @@
+import pytest
+from aggregate import Aggregator
+
+
+def _r(second, tempC, relMoisture='ok', sensorId='unit_test'):
+    return {
+        'sensorId': sensorId,
+        'tempC': tempC,
+        'relMoisture': relMoisture,
+        'measurementTs': f'2021-07-01T10:00:{second:02d}.5+00:00',
+    }
+
+
+def test_window_stats():
+    a = Aggregator(10)
+    assert a.add(_r(0, 20.0)) == []
+    assert a.add(_r(1, None)) == []
+    assert a.add(_r(2, 22.0, 'dry')) == []
+    out = a.add(_r(10, 30.0))
+    assert len(out) == 1
+    r = out[0]
+    # None doesn't drag the mean down
+    assert r['tempC'] == 21.0
+    # Nothing the server doesn't store
+    assert set(r) == {'sensorId', 'tempC', 'relMoisture', 'measurementTs'}
+    assert r['relMoisture'] == 'dry'
+    assert r['measurementTs'] == '2021-07-01T10:00:00+00:00'
+    assert a.flush()[0]['tempC'] == 30.0
+    assert a.flush() == []
+
+
+def test_all_none():
+    a = Aggregator(60)
+    a.add(_r(0, None))
+    r = a.flush()[0]
+    assert r['tempC'] is None
+
+
+def test_per_sensor_windows():
+    a = Aggregator(60)
+    a.add(_r(0, 1.0, sensorId='a'))
+    a.add(_r(0, 2.0, sensorId='b'))
+    assert sorted(r['tempC'] for r in a.flush()) == [1.0, 2.0]
+
+
+def test_threshold_crossings_are_sent_raw():
+    a = Aggregator(60)
+    assert a.add(_r(0, 20.0)) == []
+    # A cold spike, averaged away in the window
+    spike = _r(1, 4.0)
+    assert a.add(spike) == [spike]
+    assert a.add(_r(2, 4.5)) == []
+    back = _r(3, 20.0)
+    assert a.add(back) == [back]
+    r = a.flush()[0]
+    assert r['tempC'] > 5
+
+
+def test_invalid_window():
+    with pytest.raises(ValueError):
+        Aggregator(0)
+
+
+def _server_types() -> dict:
+    """Field -> Go type of the server's Sensor struct, lowercased"""
+    import os
+    import re
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server', 'server.go')
+    if not os.path.exists(path):
+        pytest.skip('No server/server.go')
+    with open(path) as f:
+        body = re.search(r'type Sensor struct \{(.*?)\n\}', f.read(), re.S).group(1)
+    return {name.lower(): kind for name, kind in re.findall(r'^\s*(\w+)\s+(\S+)', body, re.M)}
+
+
+def test_types_match_server_schema():
+    from reading import FIELDS, INT_FIELDS
+    types = _server_types()
+    assert {k for k in FIELDS if types.get(k.lower()) == 'int32'} == set(INT_FIELDS)
+
+    a = Aggregator(60)
+    for i, raw in enumerate((26000, 26001, 26001)):
+        a.add({'sensorId': 'unit_test', 'measurementTs': f'2021-07-01T10:00:{i:02d}+00:00',
+               'tempC': 21.5, 'visLight': 300 + i, 'irLight': 400, 'uvIx': 2.5,
+               'rawMoisture': raw, 'voltMoisture': 1.3, 'lumen': 1000.0})
+    r = a.flush()[0]
+    assert r['rawMoisture'] == 26001 and r['visLight'] == 301
+    for k in FIELDS:
+        if k in ('sensorId', 'measurementTs'):
+            continue
+        expected = int if types[k.lower()] == 'int32' else float
+        assert type(r[k]) is expected, k
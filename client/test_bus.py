@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+from bus import Bus
+
+
+class FakeHandle():
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_borrow_reuses_handle():
+    opened = []
+
+    def factory():
+        opened.append(FakeHandle())
+        return opened[-1]
+
+    bus = Bus('i2c', smbus=factory)
+    for _ in range(3):
+        with bus.borrow('smbus', 'lumen') as h:
+            assert h is opened[0]
+    assert len(opened) == 1
+    assert bus.stats['lumen'].count == 3
+
+
+def test_borrow_reconnects_on_io_error():
+    bus = Bus('i2c', smbus=FakeHandle)
+    with bus.borrow('smbus') as first:
+        pass
+    with pytest.raises(OSError):
+        with bus.borrow('smbus', 'lumen'):
+            raise OSError(121, 'Remote I/O error')
+    assert first.closed
+    assert bus.reconnects == 1
+    assert bus.generation == 1
+    assert bus.stats['lumen'].errors == 1
+    with bus.borrow('smbus') as second:
+        assert second is not first
+
+
+def test_borrow_times_out_on_held_bus():
+    bus = Bus('spi', lock_timeout_s=0.01)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with bus.borrow():
+            held.set()
+            release.wait()
+
+    t = threading.Thread(target=hold)
+    t.start()
+    held.wait()
+    with pytest.raises(TimeoutError):
+        with bus.borrow():
+            pass
+    release.set()
+    t.join()
@@ -0,0 +1,75 @@
+import random
+from datetime import datetime, timezone
+
+import pytest
+from deadband import ExceptionReporter, metrics_of, rebuild
+
+
+def _r(second, **values):
+    ts = datetime.fromtimestamp(1625133600 + second, tz=timezone.utc).isoformat()
+    return {'sensorId': 'unit_test', 'measurementTs': ts, **values}
+
+
+def _walk(n, seed=1):
+    rng = random.Random(seed)
+    v, out = 20.0, []
+    for _ in range(n):
+        v += rng.gauss(0, 0.02) + 0.01
+        out.append(v + rng.gauss(0, 0.03))
+    return out
+
+
+@pytest.mark.parametrize('mode', ['deadband', 'swinging_door'])
+def test_rebuild_within_tolerance(mode):
+    values = _walk(2000)
+    reporter = ExceptionReporter(mode, {'tempC': 0.1}, heartbeat_s=0)
+    sent = []
+    for i, v in enumerate(values):
+        sent += reporter.add(_r(i, tempC=v))
+    sent += reporter.flush()
+    points = [(datetime.fromisoformat(r['measurementTs']).timestamp(), r['tempC']) for r in sent]
+    assert points == sorted(points)
+    for i, v in enumerate(values):
+        assert abs(rebuild(points, 1625133600 + i, mode) - v) <= 0.1 + 1e-9
+    assert reporter.ratio > 3
+    # A line is cheaper than steps on a trend
+    if mode == 'swinging_door':
+        assert reporter.ratio > 10
+
+
+def test_alert_threshold_forces_send():
+    reporter = ExceptionReporter('swinging_door', {'voltMoisture': 1.0}, heartbeat_s=0)
+    assert reporter.add(_r(0, voltMoisture=2.0))
+    assert reporter.add(_r(1, voltMoisture=2.1)) == []
+    # Within the tolerance, but the server alerts on it
+    out = reporter.add(_r(2, voltMoisture=2.25))
+    assert out[-1]['voltMoisture'] == 2.25
+    assert reporter.add(_r(3, voltMoisture=2.26)) == []
+    # And back
+    assert reporter.add(_r(4, voltMoisture=2.1))[-1]['voltMoisture'] == 2.1
+
+
+def test_heartbeat_labels_new_metrics():
+    reporter = ExceptionReporter('deadband', heartbeat_s=10)
+    assert reporter.add(_r(0, tempC=20.0, relMoisture='ok'))
+    assert reporter.add(_r(5, tempC=20.0, relMoisture='ok')) == []
+    assert reporter.add(_r(6, tempC=20.0, relMoisture='dry'))
+    assert reporter.add(_r(7, tempC=20.0, relMoisture='dry', lumen=5.0))
+    assert reporter.add(_r(16, tempC=20.0, relMoisture='dry', lumen=5.0)) == []
+    assert reporter.add(_r(17, tempC=20.0, relMoisture='dry', lumen=5.0))
+
+
+def test_probes_are_metrics():
+    probes = [{'probeId': 'bed1', 'voltMoisture': 1.2, 'relMoisture': 'ok'}]
+    numbers, labels = metrics_of(_r(0, tempC=None, probes=probes))
+    assert numbers == {'bed1/voltMoisture': 1.2}
+    assert labels == {'bed1/relMoisture': 'ok'}
+    reporter = ExceptionReporter('deadband')
+    reporter.add(_r(0, probes=probes))
+    assert reporter.add(_r(1, probes=[{'probeId': 'bed1', 'voltMoisture': 1.21, 'relMoisture': 'ok'}])) == []
+    assert reporter.add(_r(2, probes=[{'probeId': 'bed1', 'voltMoisture': 1.3, 'relMoisture': 'ok'}]))
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        ExceptionReporter('nope')
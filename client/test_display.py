@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+from display import FrameBuffer, LcdRenderer, soil_page, light_page
+
+
+class FakeLCD():
+    def __init__(self, fail=False):
+        self.screen = [bytearray(b' ' * 16) for _ in range(2)]
+        self.cursor = (0, 0)
+        self.writes = 0
+        self.fail = fail
+
+    def move_cursor(self, line, column):
+        self.cursor = (line, column)
+
+    def print(self, text):
+        if self.fail:
+            raise OSError(121, 'Remote I/O error')
+        line, col = self.cursor
+        self.screen[line][col:col + len(text)] = text
+        self.writes += len(text)
+
+    def lines(self):
+        return [bytes(l).decode().rstrip() for l in self.screen]
+
+
+@contextmanager
+def borrow():
+    yield
+
+
+def test_framebuffer_diff():
+    fb = FrameBuffer()
+    runs, new = fb.diff(['Temp: 21.50C', 'x'])
+    # Nothing known yet, full lines
+    assert [(l, c, len(t)) for l, c, t in runs] == [(0, 0, 16), (1, 0, 16)]
+    fb.commit(new)
+    runs, new = fb.diff(['Temp: 21.75C', 'x'])
+    assert runs == [(0, 9, b'75')]
+    # Close changes merge into one run, distant ones don't
+    runs, _ = fb.diff(['Tamp: 21.50C', 'x          y'])
+    assert runs == [(0, 1, b'a'), (1, 11, b'y')]
+    runs, _ = fb.diff(['Temp: 22.50C', 'x'])
+    assert runs == [(0, 7, b'2')]
+    runs, _ = fb.diff(['Temp: 22.60C', 'x'])
+    assert runs == [(0, 7, b'2.6')]
+
+
+def test_renderer_only_writes_changes():
+    lcd = FakeLCD()
+    r = LcdRenderer(lcd, borrow)
+    assert r.render() == 0
+    r.update({'tempC': 21.5, 'relMoisture': 'ok', 'voltMoisture': 1.2})
+    assert r.render() == 32
+    assert lcd.lines() == ['Soil: ok [1.20]', 'Temp: 21.50C']
+    # Same after rounding: no I/O
+    r.update({'tempC': 21.501, 'relMoisture': 'ok', 'voltMoisture': 1.2})
+    assert r.render() == 0
+    r.update({'tempC': 21.6, 'relMoisture': 'ok', 'voltMoisture': 1.2})
+    assert r.render() == 1
+    assert lcd.lines()[1] == 'Temp: 21.60C'
+
+
+def test_renderer_rotates_pages():
+    t = [0.0]
+    lcd = FakeLCD()
+    r = LcdRenderer(lcd, borrow, pages=[soil_page, light_page], page_s=5, clock=lambda: t[0])
+    r.update({'tempC': 20.0, 'lumen': 1234.4, 'uvIx': 0.5})
+    r.render()
+    assert lcd.lines()[1] == 'Temp: 20.00C'
+    t[0] = 5.0
+    r.render()
+    assert lcd.lines() == ['Lux: 1234', 'UV: 0.50']
+
+
+def test_renderer_redraws_after_error():
+    lcd = FakeLCD(fail=True)
+    r = LcdRenderer(lcd, borrow)
+    r.update({'tempC': 20.0})
+    assert r.render() == 0
+    assert r.draw.errors == 1
+    lcd.fail = False
+    assert r.render() == 32
+
+
+def test_renderer_thread():
+    lcd = FakeLCD()
+    r = LcdRenderer(lcd, borrow, refresh_s=0.01)
+    r.update({'tempC': 20.0})
+    r.start()
+    r.stop(1)
+    assert lcd.lines()[1] == 'Temp: 20.00C'
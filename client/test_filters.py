@@ -0,0 +1,37 @@
+import pytest
+from filters import FILTERS, Hysteresis, median, trimmed_mean
+
+
+def test_median_ignores_spike():
+    assert median([500, 501, 499, 4000, 500]) == 500
+
+
+def test_trimmed_mean():
+    # 10 samples, 20% trim drops 2 from each end
+    samples = [0, 1, 10, 10, 10, 10, 10, 10, 99, 1000]
+    assert trimmed_mean(samples) == 10
+    # Too few to trim
+    assert trimmed_mean([1, 3]) == 2
+    assert set(FILTERS) == {'median', 'trimmed', 'mean'}
+
+
+def test_hysteresis_no_band_is_plain_thresholds():
+    h = Hysteresis([0.77, 1.5], ['wet', 'ok', 'dry'])
+    assert [h(v) for v in (0.5, 0.77, 0.78, 1.5, 1.51, 0.1)] == ['wet', 'wet', 'ok', 'ok', 'dry', 'wet']
+
+
+def test_hysteresis_band():
+    h = Hysteresis([0.77, 1.5], ['wet', 'ok', 'dry'], band=0.05)
+    assert h(1.4) == 'ok'
+    # Jitter around the threshold doesn't flip it
+    assert [h(v) for v in (1.52, 1.48, 1.54, 1.49)] == ['ok'] * 4
+    assert h(1.56) == 'dry'
+    assert [h(v) for v in (1.49, 1.46)] == ['dry', 'dry']
+    assert h(1.44) == 'ok'
+    # Big jumps skip levels
+    assert h(0.2) == 'wet'
+
+
+def test_hysteresis_label_count():
+    with pytest.raises(ValueError):
+        Hysteresis([1], ['a'])
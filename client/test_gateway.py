@@ -0,0 +1,147 @@
+import asyncio
+import gzip
+import json
+import threading
+import time
+
+from gateway import Gateway
+from spool import MemorySpool
+from test_uploader import FakeSession
+from uploader import Uploader
+from wire import encode_batch
+
+
+def _batch(node, n):
+    return [{'sensorId': f'node-{node}', 'tempC': 20.0 + i,
+             'measurementTs': f'2021-07-01T10:00:{i:02d}+00:00'} for i in range(n)]
+
+
+async def _post(port, body, headers=None, method='POST'):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = [f'{method} / HTTP/1.1', 'Host: gw', f'Content-Length: {len(body)}', 'Connection: close']
+    head += [f'{k}: {v}' for k, v in (headers or {}).items()]
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    writer.close()
+    return status
+
+
+def _run(session, coro_fn, batch_max=20, batch_wait_s=0.1, max_buffered=1000, spool=None):
+    async def main():
+        uploader = Uploader('http://upstream', MemorySpool() if spool is None else spool, batch_size=batch_max, session=session)
+        uploader.start()
+        gw = Gateway(uploader, batch_wait_s=batch_wait_s, max_buffered=max_buffered)
+        port = await gw.start('127.0.0.1', 0)
+        try:
+            return await coro_fn(gw, port)
+        finally:
+            await gw.stop()
+            uploader.stop(1)
+    return asyncio.run(main())
+
+
+def _wait_for(cond, timeout_s=2.0):
+    deadline = time.monotonic() + timeout_s
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_coalesces_batches():
+    session = FakeSession([])
+
+    async def scenario(gw, port):
+        for node in range(5):
+            assert await _post(port, json.dumps(_batch(node, 10)).encode()) == 200
+        # Two full batches right away, the rest after batch_wait_s
+        await asyncio.sleep(0.5)
+        return gw.received
+
+    assert _run(session, scenario) == 50
+    _wait_for(lambda: sum(len(b) for b in session.sent) == 50)
+    assert [len(b) for b in session.sent] == [20, 20, 10]
+    assert session.sent[0][:10] == _batch(0, 10)
+
+
+def test_columnar_gzip_and_errors():
+    session = FakeSession([])
+
+    async def scenario(gw, port):
+        body, headers = encode_batch(_batch(1, 3), 'columnar', compress=True)
+        statuses = [await _post(port, body, headers)]
+        statuses.append(await _post(port, b'not json'))
+        statuses.append(await _post(port, b'{"a": 1}'))
+        statuses.append(await _post(port, b'', method='GET'))
+        await asyncio.sleep(0.3)
+        return statuses
+
+    assert _run(session, scenario) == [200, 400, 400, 405]
+    _wait_for(lambda: session.sent)
+    assert session.sent[0] == _batch(1, 3)
+
+
+def test_backpressure_when_upstream_is_down():
+    # Upstream keeps failing, so nothing leaves the spool
+    session = FakeSession([500] * 100)
+
+    async def scenario(gw, port):
+        first = await _post(port, gzip.compress(json.dumps(_batch(0, 10)).encode()), {'Content-Encoding': 'gzip'})
+        second = await _post(port, json.dumps(_batch(1, 10)).encode())
+        return first, second, len(gw.spool)
+
+    assert _run(session, scenario, batch_max=100, batch_wait_s=10, max_buffered=10) == (200, 503, 10)
+
+
+def test_bad_content_length():
+    async def scenario(gw, port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'POST / HTTP/1.1\r\nHost: gw\r\nContent-Length: lots\r\n\r\n')
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        writer.close()
+        return status
+
+    assert _run(FakeSession([]), scenario) == 400
+
+
+class ThreadSpool(MemorySpool):
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def append(self, reading: dict):
+        self.threads.add(threading.current_thread().name)
+        super().append(reading)
+
+
+def test_spool_writes_off_the_event_loop():
+    spool = ThreadSpool()
+
+    async def scenario(gw, port):
+        return await _post(port, json.dumps(_batch(0, 5)).encode())
+
+    assert _run(FakeSession([]), scenario, spool=spool) == 200
+    assert len(spool.threads) == 1
+    assert threading.current_thread().name not in spool.threads
+
+
+def test_batch_that_does_not_fit_is_refused():
+    session = FakeSession([500] * 100)
+
+    async def scenario(gw, port):
+        statuses = [await _post(port, json.dumps(_batch(node, 6)).encode()) for node in range(2)]
+        statuses.append(await _post(port, json.dumps(_batch(2, 4)).encode()))
+        return statuses, len(gw.spool), gw.spool.dropped
+
+    spool = MemorySpool(max_items=10)
+    assert _run(session, scenario, batch_max=100, batch_wait_s=10, max_buffered=10, spool=spool) == \
+        ([200, 503, 200], 10, 0)
+
+
+def test_gzip_bomb_is_refused():
+    async def scenario(gw, port):
+        gw.max_inflated_bytes = 1000
+        body = gzip.compress(b'[' + b' ' * 100000 + b']')
+        return await _post(port, body, {'Content-Encoding': 'gzip'}), len(gw.spool)
+
+    assert _run(FakeSession([]), scenario) == (413, 0)
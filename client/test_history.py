@@ -0,0 +1,65 @@
+import math
+import pytest
+from datetime import datetime, timezone
+from history import History
+
+T0 = 1625133600  # 2021-07-01T10:00:00Z
+
+
+def reading(t, **values):
+    r = {'sensorId': 'pi', 'measurementTs': datetime.fromtimestamp(t, tz=timezone.utc).isoformat(),
+         'tempC': None, 'voltMoisture': None, 'relMoisture': 'ok'}
+    r.update(values)
+    return r
+
+
+def test_append_and_query(tmp_path):
+    h = History(str(tmp_path / 'h.bin'))
+    for i in range(100):
+        h.append(reading(T0 + i, voltMoisture=1.0 + i / 100, tempC=None if i % 2 else 20.0))
+    assert len(h) == 100
+    rows = h.query('voltMoisture', T0 + 10, T0 + 13)
+    assert [t for t, _ in rows] == [T0 + 10, T0 + 11, T0 + 12]
+    assert rows[0][1] == pytest.approx(1.1)
+    # Empty readings are left out
+    assert len(h.query('tempC')) == 50
+    assert len(h.last('voltMoisture', 5, now=T0 + 100)) == 5
+    with pytest.raises(KeyError):
+        h.query('relMoisture')
+    h.close()
+
+
+def test_ring_wraps(tmp_path):
+    # Room for 10 rows
+    h = History(str(tmp_path / 'h.bin'), max_bytes=4096 + 10 * 8 * 8)
+    assert h.capacity == 10
+    for i in range(25):
+        h.append(reading(T0 + i, voltMoisture=float(i)))
+    assert len(h) == 10
+    assert [v for _, v in h.query('voltMoisture')] == [float(i) for i in range(15, 25)]
+    assert h.query('voltMoisture', T0 + 20, T0 + 22) == [(T0 + 20, 20.0), (T0 + 21, 21.0)]
+    h.close()
+
+
+def test_reopen(tmp_path):
+    path = str(tmp_path / 'h.bin')
+    h = History(path, max_bytes=4096 + 10 * 8 * 8)
+    for i in range(12):
+        h.append(reading(T0 + i, tempC=float(i)))
+    h.close()
+    h = History(path)
+    assert h.capacity == 10 and len(h) == 10
+    assert h.query('tempC')[0] == (T0 + 2, 2.0)
+    assert math.isnan(h._cols['voltMoisture'][0])
+    h.close()
+    with pytest.raises(ValueError):
+        History(path, columns=('tempC',))
+
+
+def test_downsample(tmp_path):
+    h = History(str(tmp_path / 'h.bin'))
+    for i in range(120):
+        h.append(reading(T0 + i, tempC=float(i % 60)))
+    rows = h.downsample('tempC', 60)
+    assert rows == [(T0, 29.5, 0.0, 59.0, 60), (T0 + 60, 29.5, 0.0, 59.0, 60)]
+    h.close()
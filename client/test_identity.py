@@ -0,0 +1,45 @@
+import sys
+import types
+
+import identity
+
+
+def test_machine_id_resolved_once(monkeypatch):
+    calls = []
+
+    def derive():
+        calls.append(1)
+        return 'pi-b8:27:eb:00:00:01'
+    monkeypatch.setattr(identity, 'derive_machine_id', derive)
+    monkeypatch.setattr(identity, '_MACHINE_ID', None)
+    for _ in range(3):
+        assert identity.get_machine_id() == 'pi-b8:27:eb:00:00:01'
+    assert len(calls) == 1
+
+
+def test_machine_id_override_and_persist(monkeypatch, tmp_path):
+    monkeypatch.setattr(identity, '_MACHINE_ID', None)
+    path = str(tmp_path / 'sensor_id')
+    monkeypatch.setattr(identity, 'derive_machine_id', lambda: 'pi-old-nic')
+    assert identity.init_machine_id(path=path) == 'pi-old-nic'
+    # New NIC, same ID
+    monkeypatch.setattr(identity, 'derive_machine_id', lambda: 'pi-new-nic')
+    assert identity.init_machine_id(path=path) == 'pi-old-nic'
+    assert identity.init_machine_id('bed-3', path=path) == 'bed-3'
+    assert identity.get_machine_id() == 'bed-3'
+
+
+def test_no_mac_is_retried_then_random(monkeypatch, tmp_path):
+    macs = [None, None, 'b8:27:eb:00:00:02']
+    monkeypatch.setitem(sys.modules, 'getmac', types.SimpleNamespace(get_mac_address=lambda: macs.pop(0)))
+    assert identity.derive_machine_id(sleep=lambda s: None).endswith('-b8:27:eb:00:00:02')
+
+    monkeypatch.setitem(sys.modules, 'getmac', types.SimpleNamespace(get_mac_address=lambda: None))
+    monkeypatch.setattr(identity, '_MACHINE_ID', None)
+    monkeypatch.setattr(identity.time, 'sleep', lambda s: None)
+    path = tmp_path / 'sensor_id'
+    first = identity.init_machine_id(path=str(path))
+    assert 'None' not in first
+    # Random, but it stays
+    assert path.read_text().strip() == first
+    assert identity.init_machine_id(path=str(path)) == first
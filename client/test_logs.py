@@ -0,0 +1,123 @@
+import io
+import json
+import logging
+from logs import JsonFormatter, ThrottleFilter, LazyQueueHandler, setup_logging
+from monitor import create_sensors, read_sensors
+from simulated import Simulation, Behavior
+
+
+def record(msg='Error reading sensor %s: %s', args=('temp', 'gone'), level=logging.ERROR, lineno=10, **extra):
+    r = logging.LogRecord('monitor', level, 'monitor.py', lineno, msg, args, None)
+    r.__dict__.update(extra)
+    return r
+
+
+def test_json_formatter():
+    out = json.loads(JsonFormatter().format(record(sensor='temp')))
+    assert out['msg'] == 'Error reading sensor temp: gone'
+    assert out['level'] == 'ERROR'
+    assert out['sensor'] == 'temp'
+    assert out['src'] == 'monitor.py:10'
+
+
+def test_throttle():
+    t = [0.0]
+    f = ThrottleFilter(interval_s=60, clock=lambda: t[0])
+    assert f.filter(record())
+    assert not f.filter(record())
+    assert not f.filter(record())
+    # Different line, different kind
+    assert f.filter(record(lineno=11))
+    t[0] = 61
+    r = record()
+    assert f.filter(r)
+    assert r.suppressed == 2
+
+
+def test_sampling():
+    f = ThrottleFilter(sample_every=3)
+    passed = [f.filter(record('Reading %s', ('x',), level=logging.DEBUG)) for _ in range(6)]
+    assert passed == [True, False, False, True, False, False]
+
+
+def test_throttle_unhashable_msg():
+    f = ThrottleFilter(interval_s=60, sample_every=2)
+    assert f.filter(record({'tempC': 21.0}, ()))
+    assert not f.filter(record({'tempC': 21.0}, ()))
+    assert f.filter(record({'tempC': 21.5}, (), level=logging.DEBUG))
+
+
+def test_throttle_forgets_kinds():
+    f = ThrottleFilter(sample_every=2)
+    f.max_kinds = 10
+    for i in range(100):
+        f.filter(record(f'Reading {i}', (), level=logging.DEBUG))
+    assert len(f._samples) <= 10
+
+
+def test_throttle_per_sensor():
+    sim = Simulation(seed=1, behaviors={'temp': Behavior(error_rate=1.0), 'uv': Behavior(error_rate=1.0)}).install()
+    logged = []
+    handler = logging.Handler()
+    handler.emit = logged.append
+    handler.addFilter(ThrottleFilter(interval_s=60))
+    logger = logging.getLogger('monitor')
+    logger.addHandler(handler)
+    try:
+        sensors = create_sensors('temp', 'uv', 'moisture')
+        for _ in range(3):
+            read_sensors(sensors)
+    finally:
+        logger.removeHandler(handler)
+        sim.uninstall()
+    # Both failing sensors show up, once each
+    assert sorted(r.sensor for r in logged if hasattr(r, 'sensor')) == ['temp', 'uv']
+
+
+def test_lazy_queue_handler_drops_when_full():
+    import queue
+    h = LazyQueueHandler(queue.Queue(1))
+    r = record()
+    h.handle(r)
+    h.handle(record())
+    assert h.dropped == 1
+    # Not formatted yet
+    assert not hasattr(r, 'message')
+
+
+def test_setup_logging_background():
+    stream = io.StringIO()
+    root = logging.getLogger()
+    saved = (root.handlers[:], root.level)
+    try:
+        listener = setup_logging(logging.INFO, fmt='json', stream=stream)
+        log = logging.getLogger('test_logs')
+        log.debug('hidden')
+        for _ in range(5):
+            log.error('Sensor %s failed', 'uv', extra={'sensor': 'uv'})
+        listener.stop()
+    finally:
+        root.handlers[:] = saved[0]
+        root.setLevel(saved[1])
+    lines = [json.loads(l) for l in stream.getvalue().splitlines()]
+    assert len(lines) == 1
+    assert lines[0]['sensor'] == 'uv'
+
+
+def test_after_fork_writes_directly():
+    from logs import after_fork
+    stream = io.StringIO()
+    root = logging.getLogger()
+    saved = (root.handlers[:], root.level)
+    try:
+        listener = setup_logging(logging.INFO, stream=stream)
+        listener.stop()
+        after_fork()
+        assert not any(isinstance(h, LazyQueueHandler) for h in root.handlers)
+        for _ in range(3):
+            logging.getLogger('test_logs').error('Worker read failed')
+    finally:
+        root.handlers[:] = saved[0]
+        root.setLevel(saved[1])
+    # Still throttled
+    assert stream.getvalue().count('Worker read failed') == 1
@@ -0,0 +1,124 @@
+import pytest
+from max44009.max44009 import MAX44009, SensorUnavailable
+from simulated import Simulation, Wave
+
+
+def make(lux, auto_range=True):
+    sim = Simulation(seed=0)
+    sim.lux.lux = Wave(lux)
+    return sim, MAX44009(sim.i2c, auto_range=auto_range)
+
+
+def test_manual_mode_unchanged():
+    sim, m = make(500, auto_range=False)
+    assert sim.lux.config == MAX44009.MAX44009_REG_CONFIG_MANUAL_ON
+    assert abs(m.read_lumen() - 500) < 5
+    assert m.integration_ms == 800
+
+
+def test_auto_range_bright():
+    sim, m = make(50000)
+    assert sim.lux.config & MAX44009.MAX44009_REG_CONFIG_CONTMODE_CONTINUOUS
+    # Saturated at 800ms, but tells us to go shorter
+    first = m.read_lumen()
+    assert first < 50000 and m.integration_ms == 800
+    for _ in range(10):
+        lux = m.read_lumen()
+    assert abs(lux - 50000) / 50000 < 0.01
+    assert m.integration_ms == 12.5
+    changes = m.range_changes
+    # Steady light, steady range
+    m.read_lumen()
+    assert m.range_changes == changes
+
+
+def test_auto_range_dark_with_hysteresis():
+    sim, m = make(50000)
+    for _ in range(10):
+        m.read_lumen()
+    sim.lux.lux = Wave(5000)
+    for _ in range(10):
+        m.read_lumen()
+    # Only steps down while below 40% of the next longer step's range
+    assert m.integration_ms == 50
+    sim.lux.lux = Wave(0.4 * 8000 + 100)
+    changes = m.range_changes
+    m.read_lumen()
+    assert m.range_changes == changes
+    sim.lux.lux = Wave(10)
+    for _ in range(10):
+        m.read_lumen()
+    assert m.integration_ms == 800
+    assert m._config_byte() == (MAX44009.MAX44009_REG_CONFIG_CONTMODE_CONTINUOUS
+                                | MAX44009.MAX44009_REG_CONFIG_MANUAL_ON)
+
+
+class Clock():
+    def __init__(self):
+        self.t = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.t
+
+    def sleep(self, s):
+        self.slept.append(s)
+        self.t += s
+
+
+def make_retrying(**kwargs):
+    sim = Simulation(seed=0)
+    sim.lux.lux = Wave(500)
+    clock = Clock()
+    m = MAX44009(sim.i2c, clock=clock, sleep=clock.sleep, **kwargs)
+    return sim, m, clock
+
+
+def move(sim, addr):
+    chip = sim.i2c.chips.pop(sim.lux.address)
+    chip.address = addr
+    sim.i2c.chips[addr] = chip
+
+
+def test_probe_finds_fallback_address_once():
+    sim = Simulation(seed=0)
+    move(sim, 0x4B)
+    m = MAX44009(sim.i2c)
+    assert m.addr == 0x4B
+    assert m.address_flips == 1
+    writes = sim.lux.writes
+    m.read_lumen_with_retry()
+    m.read_lumen_with_retry()
+    # No more reconfiguring once we know where it is
+    assert sim.lux.writes == writes
+    assert m.retries == 0
+
+
+def test_retry_follows_address_change():
+    sim, m, clock = make_retrying()
+    move(sim, 0x4B)
+    assert abs(m.read_lumen_with_retry() - 500) < 5
+    assert m.retries == 1
+    assert m.address_flips == 1
+    assert clock.slept == [0.01]
+
+
+def test_circuit_breaker():
+    sim, m, clock = make_retrying(attempts=3, cooldown_s=30)
+    chip = sim.i2c.chips.pop(sim.lux.address)
+    with pytest.raises(SensorUnavailable):
+        m.read_lumen_with_retry()
+    assert m.retries == 2
+    assert clock.slept == [0.01, 0.02]
+    assert m.stats()['breaker_open']
+    # Doesn't touch the bus while open
+    transactions = sim.i2c.transactions
+    with pytest.raises(SensorUnavailable):
+        m.read_lumen_with_retry()
+    assert sim.i2c.transactions == transactions
+    # Back after the cool-down
+    sim.i2c.chips[chip.address] = chip
+    clock.t += 30
+    assert m.read_lumen_with_retry() > 0
+    assert m.breaker_trips == 1
+    assert not m.stats()['breaker_open']
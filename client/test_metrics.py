@@ -0,0 +1,68 @@
+import urllib.request
+from metrics import Histogram, MetricsRegistry, MetricsExporter
+from sampler import BusSampler
+
+
+def test_histogram():
+    h = Histogram(buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 2.0):
+        h.observe(v)
+    cumulative, total, count = h.snapshot()
+    # le is inclusive
+    assert cumulative == [2, 3, 4]
+    assert total == 2.65 and count == 4
+
+
+def test_render():
+    m = MetricsRegistry()
+    m.histogram('read_seconds', 'Reads', buckets=(0.5,), sensor='temp').observe(0.2)
+    m.counter('errors_total', sensor='te"mp').inc(2)
+    m.gauge('depth', lambda: 3)
+    m.gauge('broken', lambda: 1 / 0)
+    text = m.render()
+    assert '# HELP read_seconds Reads\n# TYPE read_seconds histogram\n' in text
+    assert 'read_seconds_bucket{sensor="temp",le="0.5"} 1\n' in text
+    assert 'read_seconds_bucket{sensor="temp",le="+Inf"} 1\n' in text
+    assert 'read_seconds_sum{sensor="temp"} 0.2\n' in text
+    assert 'errors_total{sensor="te\\"mp"} 2\n' in text
+    assert 'depth 3\n' in text
+    assert 'broken NaN\n' in text
+    # Same name and labels, same object
+    assert m.counter('errors_total', sensor='te"mp').value == 2
+
+
+def test_exporter(tmp_path):
+    m = MetricsRegistry()
+    m.counter('ticks_total').inc()
+    path = str(tmp_path / 'client.prom')
+    e = MetricsExporter(m, port=0, path=path, interval_s=60).start()
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{e.port}/metrics') as r:
+            assert r.headers['Content-Type'].startswith('text/plain')
+            assert 'ticks_total 1' in r.read().decode()
+    finally:
+        m.counter('ticks_total').inc()
+        e.stop()
+    # Final dump on stop
+    assert 'ticks_total 2' in open(path).read()
+
+
+class Sensor():
+    def __init__(self, result):
+        self.result = result
+
+    def read_metric(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_sampler_instrumentation():
+    m = MetricsRegistry()
+    s = BusSampler(metrics=m)
+    s.read_all({'temp': Sensor({'tempC': 1}), 'uv': Sensor(None), 'lumen': Sensor(OSError('gone'))})
+    s.shutdown()
+    assert m.histogram('sensor_read_seconds', sensor='temp').count == 1
+    assert m.counter('sensor_read_empty_total', sensor='uv').value == 1
+    assert m.counter('sensor_read_errors_total', sensor='lumen').value == 1
+    assert m.counter('sensor_read_errors_total', sensor='temp').value == 0
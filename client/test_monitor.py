@@ -1,4 +1,7 @@
 import pytest 
+import os
+import subprocess
+import sys
 from monitor import gen_sensors_by_name, create_sensors, read_sensors, SI1145_S, MCP9808_S
 
 def test_gen_sensors_by_name():
@@ -23,4 +26,13 @@ def test_read_sensors():
     # We don't have sensors for unit tests, but at least should get some values
     assert reading['sensorId'] != None 
     assert reading['measurementTs'] != None 
-    assert reading['tempC'] == None
\ No newline at end of file
+    assert reading['tempC'] == None
+
+def test_import_is_lazy():
+    # Driver libraries only load once a sensor that needs them is created
+    heavy = ['busio', 'board', 'adafruit_mcp9808', 'adafruit_mcp3xxx', 'SI1145',
+             'i2clcd', 'smbus2', 'getmac', 'requests']
+    code = 'import sys, monitor; print(",".join(m for m in {} if m in sys.modules))'.format(heavy)
+    out = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert out.stdout.decode().strip() == ''
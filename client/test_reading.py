@@ -0,0 +1,52 @@
+import json
+import pytest
+from reading import Reading, FIELDS, dumps
+from spool import Spool
+from wire import encode_batch, encode_columnar
+
+
+def make():
+    r = Reading(sensorId='pi', measurementTs='2021-07-01T10:00:00+00:00')
+    r.update({'tempC': 21.5})
+    r.update({'rawMoisture': 23360, 'voltMoisture': 1.17, 'relMoisture': 'ok'})
+    return r
+
+
+def test_mapping():
+    r = make()
+    assert r['tempC'] == 21.5
+    assert r.get('lumen') is None
+    assert r['relMoisture'] == 'ok'
+    assert r.get('nope', 1) == 1
+    with pytest.raises(KeyError):
+        r['nope']
+    assert list(r)[:len(FIELDS)] == list(FIELDS)
+    assert 'relMoisture' in r and 'nope' not in r
+    assert len(r) == len(FIELDS) + 1
+    r['lumen'] = 5.0
+    assert r.lumen == 5.0
+    # Same as the dict read_sensors used to build
+    assert r == {'sensorId': 'pi', 'tempC': 21.5, 'visLight': None, 'irLight': None, 'uvIx': None,
+                 'rawMoisture': 23360, 'voltMoisture': 1.17, 'lumen': 5.0,
+                 'measurementTs': '2021-07-01T10:00:00+00:00', 'relMoisture': 'ok'}
+    # No per-instance dict
+    assert not hasattr(r, '__dict__')
+
+
+def test_serializers():
+    r = make()
+    # to_dict spells the fields out; keep it in step with FIELDS
+    assert list(r.to_dict()) == list(FIELDS) + ['relMoisture']
+    assert json.loads(dumps(r)) == r.to_dict()
+    body, _ = encode_batch([r, r.to_dict()])
+    a, b = json.loads(body)
+    assert a == b
+    assert encode_columnar([r]) == encode_columnar([r.to_dict()])
+
+
+def test_spool_roundtrip(tmp_path):
+    s = Spool(str(tmp_path))
+    s.append(make())
+    batch, _ = s.peek(1)
+    assert batch == [make().to_dict()]
+    s.close()
@@ -0,0 +1,66 @@
+import pytest
+import registry
+from registry import Sensor, SensorRegistry, plan_intervals, SENSORS
+
+
+def test_subclasses_register_themselves():
+    class Fake_S(Sensor):
+        name = 'unit_test_fake'
+        columns = ('tempC',)
+
+    assert SENSORS.get('unit_test_fake') is Fake_S
+    assert SENSORS.get('does_not_exist') is None
+
+
+def test_duplicate_names():
+    r = SensorRegistry()
+
+    class A(Sensor):
+        name = None
+    A.name = 'dup'
+
+    class B(Sensor):
+        name = None
+    B.name = 'dup'
+
+    r.register(A)
+    # Same class again is fine
+    r.register(A)
+    with pytest.raises(ValueError):
+        r.register(B)
+
+
+def test_entry_points(monkeypatch):
+    class Plugin(Sensor):
+        name = None
+
+    class EP():
+        name = 'plugin'
+        group = registry.ENTRY_POINT_GROUP
+
+        def load(self):
+            return Plugin
+
+    class EPs(list):
+        def select(self, group):
+            return [ep for ep in self if ep.group == group]
+
+    import importlib.metadata
+    monkeypatch.setattr(importlib.metadata, 'entry_points', lambda: EPs([EP()]))
+    r = SensorRegistry()
+    r.load_entry_points()
+    assert r.get('plugin') is Plugin
+
+
+def test_plan_intervals():
+    class Slow(Sensor):
+        name = None
+        min_interval_s = 0.8
+    Slow.name = 'slow'
+
+    class Fast(Sensor):
+        name = None
+    Fast.name = 'fast'
+
+    assert plan_intervals([Slow, Fast], 0.6, {'fast': 5}) == {'slow': 1.2, 'fast': 5}
+    assert plan_intervals([Slow], 1) == {'slow': 1}
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from sampler import BusSampler, SensorTimeout
+
+
+class FakeSensor():
+    def __init__(self, name, bus, delay_s=0.0, metrics=None, log=None):
+        self.name = name
+        self.bus = bus
+        self.delay_s = delay_s
+        self.metrics = metrics or {name: 1}
+        self.log = log
+
+    def read_metric(self):
+        if self.log is not None:
+            self.log.append(('start', self.name))
+        time.sleep(self.delay_s)
+        if self.log is not None:
+            self.log.append(('end', self.name))
+        return self.metrics
+
+
+def test_read_all_parallel_across_buses():
+    sensors = {
+        'lumen': FakeSensor('lumen', 'i2c', delay_s=0.2),
+        'moisture': FakeSensor('moisture', 'spi', delay_s=0.2),
+    }
+    sampler = BusSampler(timeout_s=1)
+    start = time.monotonic()
+    res = sampler.read_all(sensors)
+    assert time.monotonic() - start < 0.35
+    assert res == {'lumen': {'lumen': 1}, 'moisture': {'moisture': 1}}
+    sampler.shutdown()
+
+
+def test_read_all_serial_on_same_bus():
+    log = []
+    sensors = {
+        'temp': FakeSensor('temp', 'i2c', delay_s=0.05, log=log),
+        'lumen': FakeSensor('lumen', 'i2c', delay_s=0.05, log=log),
+    }
+    sampler = BusSampler(timeout_s=1)
+    sampler.read_all(sensors)
+    assert log == [('start', 'temp'), ('end', 'temp'),
+                   ('start', 'lumen'), ('end', 'lumen')]
+    sampler.shutdown()
+
+
+def test_read_all_timeout():
+    hang = threading.Event()
+
+    class Hung(FakeSensor):
+        def read_metric(self):
+            hang.wait()
+
+    sensors = {
+        'uv': Hung('uv', 'i2c'),
+        'temp': FakeSensor('temp', 'i2c'),
+        'moisture': FakeSensor('moisture', 'spi'),
+    }
+    sampler = BusSampler(timeout_s=0.1)
+    res = sampler.read_all(sensors)
+    assert isinstance(res['uv'], SensorTimeout)
+    assert isinstance(res['temp'], SensorTimeout)
+    assert res['moisture'] == {'moisture': 1}
+    assert sampler.timeouts == 1
+    # The next tick gets a fresh worker
+    hang.set()
+    res = sampler.read_all({'temp': FakeSensor('temp', 'i2c')})
+    assert res == {'temp': {'temp': 1}}
+    sampler.shutdown()
+
+
+def test_read_all_errors():
+    class Broken(FakeSensor):
+        def read_metric(self):
+            raise OSError('Remote I/O error')
+
+    sampler = BusSampler()
+    res = sampler.read_all({'lumen': Broken('lumen', 'i2c')})
+    assert isinstance(res['lumen'], OSError)
+    sampler.shutdown()
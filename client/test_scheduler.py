@@ -0,0 +1,65 @@
+import logging
+
+import pytest
+from scheduler import FixedRateScheduler, parse_intervals
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, s):
+        self.now += s
+
+
+def test_wait_hits_absolute_deadlines():
+    clock = FakeClock()
+    s = FixedRateScheduler(0.5, clock=clock, sleep=clock.sleep)
+    deadlines = []
+    for _ in range(5):
+        tick = s.wait()
+        deadlines.append(tick.deadline)
+        # Work takes a while, but doesn't push the next tick back
+        clock.now += 0.3
+    assert deadlines == [100.0, 100.5, 101.0, 101.5, 102.0]
+    assert s.missed == 0
+
+
+def test_wait_skips_missed_ticks():
+    clock = FakeClock()
+    s = FixedRateScheduler(1, clock=clock, sleep=clock.sleep)
+    s.wait()
+    clock.now += 3.25
+    tick = s.wait()
+    assert tick.index == 3
+    assert tick.late_s == pytest.approx(0.25)
+    assert s.missed == 2
+    assert s.wait().deadline == 104.0
+
+
+def test_due_per_sensor_intervals():
+    clock = FakeClock()
+    s = FixedRateScheduler(1, {'moisture': 60, 'temp': 2.1},
+                           clock=clock, sleep=clock.sleep)
+    seen = {'moisture': 0, 'temp': 0, 'lumen': 0}
+    for _ in range(120):
+        for name in s.due(s.wait(), seen):
+            seen[name] += 1
+    assert seen == {'moisture': 2, 'temp': 60, 'lumen': 120}
+
+
+def test_rounded_intervals_are_logged(caplog):
+    with caplog.at_level(logging.WARNING, logger='scheduler'):
+        FixedRateScheduler(1, {'moisture': 60, 'temp': 2.1, 'lumen': 0.2})
+    assert sorted(r.args[0] for r in caplog.records) == ['lumen', 'temp']
+
+
+def test_parse_intervals():
+    assert parse_intervals(['moisture=60', 'lumen=0.5']) == {'moisture': 60, 'lumen': 0.5}
+    with pytest.raises(ValueError):
+        parse_intervals(['moisture'])
+    with pytest.raises(ValueError):
+        FixedRateScheduler(0)
@@ -0,0 +1,232 @@
+import logging
+
+import pytest
+from bus import BUSES
+from monitor import create_sensors, read_sensors
+from registry import SENSORS
+from simulated import Simulation, Behavior
+
+
+@pytest.fixture
+def sim():
+    s = Simulation(seed=42).install()
+    yield s
+    s.uninstall()
+
+
+def test_read_sensors_simulated(sim):
+    sensors = create_sensors('temp', 'lumen', 'uv', 'moisture')
+    assert len(sensors) == 4
+    reading = read_sensors(sensors)
+    assert 10 < reading['tempC'] < 30
+    assert reading['lumen'] > 0
+    assert reading['visLight'] > 0 and reading['irLight'] > 0
+    assert 0 < reading['uvIx'] < 5
+    assert reading['rawMoisture'] > 0
+    assert 1.0 < reading['voltMoisture'] < 1.6
+    assert reading['relMoisture'] in ('ok', 'dry')
+    assert sim.temp.reads > 0
+    assert sim.adc.conversions == 1
+
+
+def test_simulated_errors_reconnect():
+    sim = Simulation(seed=1, behaviors={'temp': Behavior(error_rate=1.0)}).install()
+    try:
+        sensors = create_sensors('temp')
+        reading = read_sensors(sensors)
+        assert reading['tempC'] is None
+        assert BUSES.i2c.reconnects == 1
+        sim.temp.behavior.error_rate = 0.0
+        assert read_sensors(sensors)['tempC'] is not None
+    finally:
+        sim.uninstall()
+
+
+def test_uninstall_restores_drivers():
+    uv = SENSORS.get('uv')
+    i2c = BUSES.i2c
+    sim = Simulation().install()
+    assert SENSORS.get('uv') is not uv
+    sim.uninstall()
+    assert SENSORS.get('uv') is uv
+    assert BUSES.i2c is i2c
+
+
+def test_main_simulated_terminates():
+    import simulated
+    from monitor import main
+    try:
+        main(None, 0.01, 10, 0, True, False, 'temp', 'lumen', 'uv', 'moisture',
+             simulate=True, max_ticks=5)
+        # temp and lumen have a min interval, moisture is read every tick
+        assert simulated.current().adc.conversions == 5
+    finally:
+        simulated.current().uninstall()
+
+
+def test_main_logs_readings_when_rest_disabled():
+    # Readings are arguments, not the message; the throttle keys on the message
+    import io
+    import logging
+    import simulated
+    from logs import setup_logging
+    from monitor import main
+    stream = io.StringIO()
+    root = logging.getLogger()
+    saved = (root.handlers[:], root.level)
+    try:
+        setup_logging(logging.INFO, background=False, stream=stream)
+        main(None, 0.01, 10, 0, True, False, 'moisture', simulate=True, max_ticks=2)
+    finally:
+        root.handlers[:] = saved[0]
+        root.setLevel(saved[1])
+        simulated.current().uninstall()
+    assert 'unhashable' not in stream.getvalue()
+    assert stream.getvalue().count("'sensorId'") == 2
+
+
+
+@pytest.fixture
+def collector():
+    """A stand-in server on localhost. Yields (url, list of POSTed batches)"""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    posts = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            posts.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', posts
+    server.shutdown()
+
+
+def test_main_sends_partial_batches_after_batch_wait(collector):
+    import simulated
+    from monitor import main
+    url, posts = collector
+    try:
+        # buffer_max is never reached, only batch_wait sends
+        main(url, 0.01, 1000, 0, False, False, 'moisture', simulate=True, max_ticks=30, batch_wait_s=0.05)
+    finally:
+        simulated.current().uninstall()
+    assert len(posts) > 1
+    # Ticks are skipped, not queued, when the scheduler falls behind
+    assert 0 < sum(len(p) for p in posts) <= 30
+
+
+def test_main_logs_stats_on_full_batches(collector, caplog):
+    import simulated
+    from monitor import main
+    url, posts = collector
+    try:
+        with caplog.at_level(logging.DEBUG, logger='monitor'):
+            # Only buffer_max sends
+            main(url, 0.01, 2, 0, False, False, 'moisture', simulate=True, max_ticks=4, batch_wait_s=3600)
+    finally:
+        simulated.current().uninstall()
+    assert any(r.getMessage().startswith('Uploader stats') for r in caplog.records)
+
+
+def test_main_repeats_sensors_that_are_not_due(collector):
+    import simulated
+    from monitor import main
+    url, posts = collector
+    try:
+        main(url, 0.01, 2, 0, False, False, 'temp', 'moisture', simulate=True, max_ticks=6,
+             intervals={'moisture': 3600})
+        assert simulated.current().adc.conversions == 1
+    finally:
+        simulated.current().uninstall()
+    sent = [r for p in posts for r in p]
+    assert sent and all(r['tempC'] is not None for r in sent)
+    assert len({r['rawMoisture'] for r in sent}) == 1 and sent[0]['rawMoisture'] > 0
+
+
+def test_main_flushes_last_window(collector):
+    import simulated
+    from monitor import main
+    url, posts = collector
+    try:
+        # The window never closes while running
+        main(url, 0.01, 10, 0, False, False, 'moisture', simulate=True, max_ticks=5, aggregate_s=3600)
+    finally:
+        simulated.current().uninstall()
+    sent = [r for p in posts for r in p]
+    assert len(sent) == 1
+    assert isinstance(sent[0]['rawMoisture'], int)
+
+
+def test_moisture_oversampling(sim):
+    sensors = create_sensors('moisture', oversample=16, oversample_filter='trimmed', hysteresis_v=0.05)
+    locks = sim.spi.locks
+    reading = read_sensors(sensors)
+    assert sim.adc.conversions == 16
+    # One scan, not a lock per conversion
+    assert sim.spi.locks - locks == 1
+    assert 1.0 < reading['voltMoisture'] < 1.6
+    assert isinstance(reading['rawMoisture'], int)
+
+
+def test_moisture_reconnect_keeps_chip_select(sim):
+    for name in ('moisture', 'probes'):
+        sensor = create_sensors(name)[name]
+        cs = sensor.scanner.cs
+        BUSES.spi.reset()
+        assert sensor.read_metric()['rawMoisture'] > 0
+        assert sensor.scanner.cs is cs
+
+
+def test_uv_block_read(sim):
+    uv = create_sensors('uv')['uv']
+    before = sim.i2c.transactions
+    metrics = uv.read_metric()
+    # One block read instead of three word reads
+    assert sim.i2c.transactions - before == 1
+    assert metrics['visLight'] > 0 and metrics['irLight'] > 0 and metrics['uvIx'] > 0
+
+
+def test_uv_forced(sim):
+    uv = create_sensors('uv', uv_mode='forced')['uv']
+    assert sim.uv.paused
+    first = uv.read_metric()
+    second = uv.read_metric()
+    assert sim.uv.forced == 2
+    assert first != second
+    # Paused: nothing changes without a forced measurement
+    assert uv._read_block() == (second['visLight'], second['irLight'], round(second['uvIx'] * 100))
+
+
+def test_probes_one_spi_pass(sim):
+    sensors = create_sensors('probes', probe_channels=[0, 2, 5], probe_ids=['bed1', 'bed2', 'bed3'], oversample=4)
+    locks = sim.spi.locks
+    reading = read_sensors(sensors)
+    assert sim.spi.locks - locks == 1
+    assert sim.adc.conversions == 12
+    probes = reading['probes']
+    assert [p['probeId'] for p in probes] == ['bed1', 'bed2', 'bed3']
+    # The simulated channels sit at 1.3V + 0.1V per channel
+    assert probes[0]['voltMoisture'] < probes[1]['voltMoisture'] < probes[2]['voltMoisture']
+    assert reading['voltMoisture'] == probes[0]['voltMoisture']
+    assert all(p['relMoisture'] in ('ok', 'dry') for p in probes)
+
+
+def test_probes_unplugged(sim):
+    del sim.adc.channels[2]
+    probes = create_sensors('probes', probe_channels=[0, 2])['probes']
+    metrics = probes.read_metric()
+    assert metrics['probes'][1] == {'probeId': 'ch2', 'rawMoisture': None, 'voltMoisture': None, 'relMoisture': None}
+    assert metrics['rawMoisture'] > 0
+
+
+def test_probes_bad_ids(sim):
+    assert create_sensors('probes', probe_channels=[0, 1], probe_ids=['a']) == {}
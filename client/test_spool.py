@@ -0,0 +1,104 @@
+import os
+
+from spool import Spool, MemorySpool
+
+
+def _r(i):
+    return {'sensorId': 'unit_test', 'tempC': i}
+
+
+def test_spool_peek_ack_in_order(tmp_path):
+    s = Spool(str(tmp_path), segment_bytes=100)
+    for i in range(10):
+        s.append(_r(i))
+    assert len(s) == 10
+    batch, token = s.peek(4)
+    assert [r['tempC'] for r in batch] == [0, 1, 2, 3]
+    # Not removed before ack
+    assert s.peek(4)[0] == batch
+    s.ack(token)
+    assert len(s) == 6
+    batch, token = s.peek(100)
+    assert [r['tempC'] for r in batch] == list(range(4, 10))
+    s.ack(token)
+    assert len(s) == 0
+    # Consumed segments are gone
+    assert len([f for f in os.listdir(str(tmp_path)) if f.endswith('.jsonl')]) <= 2
+
+
+def test_spool_survives_restart(tmp_path):
+    s = Spool(str(tmp_path))
+    for i in range(5):
+        s.append(_r(i))
+    _, token = s.peek(2)
+    s.ack(token)
+    s.close()
+
+    s = Spool(str(tmp_path))
+    assert len(s) == 3
+    s.append(_r(5))
+    batch, _ = s.peek(10)
+    assert [r['tempC'] for r in batch] == [2, 3, 4, 5]
+
+
+def test_spool_skips_torn_tail(tmp_path):
+    s = Spool(str(tmp_path))
+    s.append(_r(0))
+    s.close()
+    # Power cut mid-write
+    seg = sorted(f for f in os.listdir(str(tmp_path)) if f.endswith('.jsonl'))[-1]
+    with open(os.path.join(str(tmp_path), seg), 'ab') as f:
+        f.write(b'{"sensorId": "unit')
+    s = Spool(str(tmp_path))
+    s.append(_r(1))
+    batch, _ = s.peek(10)
+    assert [r['tempC'] for r in batch] == [0, 1]
+
+
+def test_spool_bounded(tmp_path):
+    s = Spool(str(tmp_path), segment_bytes=200, max_bytes=600)
+    for i in range(100):
+        s.append(_r(i))
+    assert s.dropped > 0
+    assert len(s) + s.dropped == 100
+    batch, _ = s.peek(1000)
+    assert len(batch) == len(s)
+    assert batch[-1]['tempC'] == 99
+
+
+def test_spool_drop_while_in_flight(tmp_path):
+    # Two records per segment
+    s = Spool(str(tmp_path), segment_bytes=100, max_bytes=300)
+    for i in range(4):
+        s.append(_r(i))
+    batch, token = s.peek(3)
+    # The first segment (0, 1) goes while the batch is being sent
+    for i in range(4, 9):
+        s.append(_r(i))
+    assert s.dropped == 2
+    s.ack(token)
+    batch, _ = s.peek(100)
+    assert [r['tempC'] for r in batch] == list(range(3, 9))
+    assert len(s) == 6
+
+
+def test_memory_spool():
+    s = MemorySpool(max_items=3)
+    for i in range(5):
+        s.append(_r(i))
+    assert s.dropped == 2
+    batch, token = s.peek(2)
+    assert [r['tempC'] for r in batch] == [2, 3]
+    s.ack(token)
+    assert len(s) == 1
+
+
+def test_memory_spool_drop_while_in_flight():
+    s = MemorySpool(max_items=3)
+    for i in range(3):
+        s.append(_r(i))
+    batch, token = s.peek(2)
+    # Sampler keeps going while the batch is being sent
+    s.append(_r(3))
+    s.ack(token)
+    assert [r['tempC'] for r in s.peek(10)[0]] == [2, 3]
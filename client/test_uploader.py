@@ -0,0 +1,144 @@
+import gzip
+import json
+import time
+
+import requests
+from spool import MemorySpool
+from uploader import Uploader
+from wire import COLUMNAR, decode_columnar
+
+
+class Response():
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeSession():
+    def __init__(self, codes):
+        self.codes = list(codes)
+        self.sent = []
+
+    def post(self, url, data, headers, timeout):
+        self.headers = headers
+        if headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        self.sent.append(json.loads(data))
+        code = self.codes.pop(0) if self.codes else 200
+        if code is None:
+            raise requests.ConnectionError('Connection refused')
+        return Response(code)
+
+
+def _spool(n):
+    spool = MemorySpool()
+    for i in range(n):
+        spool.append({'sensorId': 'unit_test', 'tempC': i,
+                      'measurementTs': f'2021-07-01T10:00:0{i}+00:00'})
+    return spool
+
+
+def test_flush_keeps_data_on_error():
+    spool = _spool(4)
+    session = FakeSession([500, None, 200, 200])
+    u = Uploader('http://localhost', spool, batch_size=2, session=session)
+    assert u.flush() == 0
+    assert u.flush() == 0
+    assert len(spool) == 4
+    assert u.flush() == 4
+    assert len(spool) == 0
+    assert session.sent[0] == session.sent[2]
+    stats = u.stats()
+    assert stats['failures'] == 2
+    assert stats['sent'] == 4
+    assert stats['send_latency']['count'] == 4
+
+
+def test_background_upload():
+    spool = _spool(4)
+    session = FakeSession([500])
+    u = Uploader('http://localhost', spool, batch_size=2,
+                 backoff_base_s=0.01, session=session)
+    u.start()
+    u.notify()
+    deadline = time.monotonic() + 2
+    while len(spool) > 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    u.stop(1)
+    assert len(spool) == 0
+    assert u.failures == 1
+    assert [r['tempC'] for b in session.sent[1:] for r in b] == [0, 1, 2, 3]
+
+
+def test_backoff_is_bounded():
+    u = Uploader('http://localhost', _spool(0), backoff_base_s=1, backoff_max_s=5)
+    u._attempt = 20
+    for _ in range(100):
+        assert 0 <= u._backoff_s() <= 5
+
+
+def test_columnar_gzip():
+    spool = _spool(3)
+    session = FakeSession([200])
+    u = Uploader('http://localhost', spool, batch_size=3, session=session,
+                 wire_format='columnar', compress=True)
+    assert u.flush() == 3
+    assert session.headers['Content-Type'] == COLUMNAR
+    assert [r['tempC'] for r in decode_columnar(session.sent[0])] == [0, 1, 2]
+    assert u.bytes_sent > 0
+
+
+def test_flush_request_sends_partial_batch():
+    spool = _spool(3)
+    session = FakeSession([])
+    u = Uploader('http://localhost', spool, batch_size=10, session=session)
+    u.start()
+    u.notify()
+    time.sleep(0.05)
+    assert session.sent == []
+    u.notify(flush=True)
+    for _ in range(100):
+        if not len(spool):
+            break
+        time.sleep(0.01)
+    u.stop(1)
+    assert len(session.sent) == 1 and len(session.sent[0]) == 3
+
+
+def test_rejected_batch_is_dead_lettered(tmp_path):
+    spool = _spool(4)
+    session = FakeSession([400, 429, 200])
+    path = tmp_path / 'rejected.jsonl'
+    u = Uploader('http://localhost', spool, batch_size=2, session=session, dead_letter_path=str(path))
+    # 400 is final, the next batch goes out
+    assert u.send_batch()
+    assert len(spool) == 2
+    assert [json.loads(l)['tempC'] for l in path.read_text().splitlines()] == [0, 1]
+    # 429 is retried
+    assert not u.send_batch()
+    assert u.send_batch()
+    assert len(spool) == 0
+    assert u.stats()['rejected'] == 2
+
+
+def test_background_upload_survives_errors():
+    spool = _spool(2)
+    session = FakeSession([])
+    u = Uploader('http://localhost', spool, batch_size=2, backoff_base_s=0.01, session=session)
+    peek = spool.peek
+    calls = []
+
+    def flaky_peek(n):
+        calls.append(n)
+        if len(calls) == 1:
+            raise RuntimeError('corrupt spool')
+        return peek(n)
+
+    spool.peek = flaky_peek
+    u.start()
+    u.notify()
+    deadline = time.monotonic() + 2
+    while len(spool) > 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    u.stop(1)
+    assert len(spool) == 0
+    assert len(session.sent) == 1
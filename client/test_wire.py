@@ -0,0 +1,64 @@
+import gzip
+import json
+
+import pytest
+from wire import encode_batch, encode_columnar, decode_columnar, COLUMNAR, JSON
+
+
+def _readings(n):
+    return [{
+        'sensorId': 'pi-b8:27:eb:00:00:01',
+        'tempC': 21.5 + i / 100,
+        'visLight': None,
+        'irLight': None,
+        'uvIx': None,
+        'rawMoisture': 26000 + i,
+        'voltMoisture': 1.31,
+        'lumen': 1200.5,
+        'measurementTs': f'2021-07-01T10:00:{i:02d}.123456+00:00',
+    } for i in range(n)]
+
+
+def test_columnar_roundtrip():
+    readings = _readings(10)
+    batch = encode_columnar(readings)
+    assert batch['sensorIds'] == ['pi-b8:27:eb:00:00:01']
+    assert batch['dt'] == [0] + [1000000] * 9
+    assert decode_columnar(batch) == readings
+
+
+def test_columnar_mixed_sensors_and_columns():
+    readings = [
+        {'sensorId': 'a', 'tempC': 1.0, 'measurementTs': '2021-07-01T10:00:00+00:00'},
+        {'sensorId': 'b', 'lumen': 2.0, 'measurementTs': '2021-07-01T10:00:01+00:00'},
+    ]
+    batch = encode_columnar(readings)
+    assert batch['sensor'] == [0, 1]
+    assert batch['columns'] == {'tempC': [1.0, None], 'lumen': [None, 2.0]}
+
+
+def test_encode_batch():
+    readings = _readings(10)
+    body, headers = encode_batch(readings)
+    assert headers == {'Content-Type': JSON}
+    assert json.loads(body) == readings
+
+    small, headers = encode_batch(readings, 'columnar', compress=True)
+    assert headers == {'Content-Type': COLUMNAR, 'Content-Encoding': 'gzip'}
+    assert decode_columnar(json.loads(gzip.decompress(small))) == readings
+    assert len(small) < len(body) / 4
+
+    with pytest.raises(ValueError):
+        encode_batch(readings, 'protobuf')
+
+
+def test_probes_ride_in_one_row():
+    probes = [{'probeId': 'bed1', 'rawMoisture': 23360, 'voltMoisture': 1.17, 'relMoisture': 'ok'},
+              {'probeId': 'bed2', 'rawMoisture': None, 'voltMoisture': None, 'relMoisture': None}]
+    readings = _readings(2)
+    readings[1]['probes'] = probes
+    batch = encode_columnar(readings)
+    assert batch['columns']['probes'] == [None, probes]
+    assert decode_columnar(json.loads(json.dumps(batch)))[1]['probes'] == probes
+    body, _ = encode_batch(readings)
+    assert len(json.loads(body)) == 2
@@ -0,0 +1,166 @@
+import time
+
+import pytest
+from monitor import create_sensors, read_sensors
+from registry import plan_intervals
+from sampler import SensorTimeout
+from simulated import Simulation, Behavior
+from workers import Ring, WorkerError, WorkerPool
+
+
+@pytest.fixture
+def sim():
+    s = Simulation(seed=42).install()
+    yield s
+    s.uninstall()
+
+
+def wait_for(cond, timeout_s=5.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_ring_roundtrip():
+    ring = Ring(('rawMoisture', 'voltMoisture', 'relMoisture', 'probes', 'missing'))
+    assert ring.latest() is None
+    probes = [{'probeId': 'bed1', 'rawMoisture': 1}]
+    ring.publish({'rawMoisture': 25472, 'voltMoisture': 1.28, 'relMoisture': 'ok', 'probes': probes,
+                  'extra': True}, took=0.01)
+    s = ring.latest()
+    assert s.n == 1 and s.error is None and s.took == 0.01
+    assert s.metrics == {'rawMoisture': 25472, 'voltMoisture': 1.28, 'relMoisture': 'ok', 'probes': probes,
+                         'extra': True}
+    assert type(s.metrics['rawMoisture']) is int
+
+
+def test_ring_strings_and_none():
+    ring = Ring(('a', 'b', 'c'))
+    ring.publish({'a': None, 'b': 'too long for 8 bytes', 'c': ''})
+    assert ring.latest().metrics == {'a': None, 'b': 'too long for 8 bytes', 'c': ''}
+
+
+def test_ring_errors_and_empty():
+    ring = Ring(('tempC',))
+    ring.publish(None, error='OSError: [Errno 121] Remote I/O error')
+    assert ring.latest().error == 'OSError: [Errno 121] Remote I/O error'
+    ring.publish({})
+    s = ring.latest()
+    assert s.metrics is None and s.error is None
+    ring.publish({'tempC': 'x' * 4096})
+    assert 'too large' in ring.latest().error
+
+
+def test_ring_newest_after_wrap():
+    ring = Ring(('tempC',), slots=4)
+    for i in range(10):
+        ring.publish({'tempC': float(i)})
+    s = ring.latest()
+    assert s.n == 10 and s.metrics == {'tempC': 9.0}
+
+
+def test_ring_recovers_from_torn_write():
+    ring = Ring(('tempC',), slots=2)
+    ring.publish({'tempC': 1.0})
+    # Killed between the two sequence writes of the next slot
+    ring._mm[ring._offset(1):ring._offset(1) + 8] = (7).to_bytes(8, 'little')
+    for i in range(4):
+        ring.publish({'tempC': float(i)})
+        assert ring.latest().metrics == {'tempC': float(i)}
+
+
+def test_pool_reads_simulated(sim):
+    pool = WorkerPool(timeout_s=1.0, check_s=0.05)
+    try:
+        sensors = create_sensors('temp', 'lumen', 'uv', 'moisture', pool=pool)
+        pool.start({k: 0.05 for k in sensors})
+        reading = read_sensors(sensors, sampler=pool)
+        assert 10 < reading['tempC'] < 30
+        assert reading['lumen'] > 0
+        assert isinstance(reading['visLight'], int)
+        assert reading['relMoisture'] in ('ok', 'dry')
+        # Read in the workers, not here
+        assert sim.temp.reads == 0
+    finally:
+        pool.shutdown()
+    assert all(w.process is None for w in pool.workers.values())
+
+
+def test_min_interval_from_the_instance(sim):
+    pool = WorkerPool(timeout_s=1.0, check_s=0.05)
+    try:
+        lumen = create_sensors('lumen', pool=pool, lux_auto_range=True)['lumen']
+        # The class says 0.8s, until the worker created the sensor
+        assert lumen.min_interval_s == 0.8
+        pool.start({'lumen': 0.05})
+        assert lumen.min_interval_s == 0.0
+        assert plan_intervals([lumen], 0.1) == {'lumen': 0.1}
+    finally:
+        pool.shutdown()
+
+
+def test_hung_worker_is_restarted():
+    # Fixed before the restart, which forks the parent's state again
+    sim = Simulation(seed=1, behaviors={'temp': Behavior(latency_s=30)}).install()
+    pool = WorkerPool(timeout_s=0.3, check_s=0.05)
+    try:
+        sensors = create_sensors('temp', 'moisture', pool=pool)
+        pool.start({k: 0.05 for k in sensors})
+        assert wait_for(lambda: pool.workers['temp'].restarts >= 1)
+        start = time.monotonic()
+        res = pool.read_all(sensors)
+        assert time.monotonic() - start < 0.1
+        assert isinstance(res['temp'], SensorTimeout)
+        assert res['moisture']['rawMoisture'] > 0
+        assert pool.workers['moisture'].restarts == 0
+
+        sim.temp.behavior.latency_s = 0.0
+        assert wait_for(lambda: not isinstance(pool.read_all(sensors)['temp'], Exception))
+    finally:
+        pool.shutdown()
+        sim.uninstall()
+
+
+class Broken():
+    # Not a Sensor subclass, so it stays out of the registry
+    name = 'broken'
+    bus = 'i2c'
+    min_interval_s = 0.0
+    columns = ('tempC',)
+
+    def __init__(self, **kwargs):
+        raise OSError('not there')
+
+
+def test_worker_failing_to_start_backs_off():
+    pool = WorkerPool(timeout_s=1.0, check_s=0.02, max_backoff_s=0.1)
+    sensors = {'broken': pool.add(Broken)}
+    try:
+        pool.start({'broken': 0.05}, wait_s=1.0)
+        res = pool.read_all(sensors)['broken']
+        assert isinstance(res, WorkerError) and 'not there' in str(res)
+        assert wait_for(lambda: pool.workers['broken'].restarts >= 3)
+    finally:
+        pool.shutdown()
+
+
+def test_stale_result_times_out():
+    pool = WorkerPool()
+    w = pool.add(Broken)
+    w.max_age_s = 1.0
+    w.ring.publish({'tempC': 20.0})
+    assert w.latest().metrics == {'tempC': 20.0}
+    with pytest.raises(SensorTimeout):
+        w.latest(time.monotonic() + 2)
+
+
+def test_main_isolated_terminates():
+    import simulated
+    from monitor import main
+    try:
+        main(None, 0.05, 10, 0, True, False, 'temp', 'moisture', simulate=True, max_ticks=3, isolate=True)
+    finally:
+        simulated.current().uninstall()
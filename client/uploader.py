@@ -0,0 +1,217 @@
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from metrics import LatencyStats, METRICS
+from reading import to_jsonable
+from wire import encode_batch
+
+logger = logging.getLogger(__name__)
+
+# Seconds from measurement to acknowledgement: one batch interval to a day of backlog
+AGE_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 86400.0)
+
+# 4xx that are worth retrying; any other means the batch itself is bad
+RETRY_4XX = (408, 429)
+
+
+def _age_s(ts: str, now: float) -> float:
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return now - dt.timestamp()
+
+
+class Uploader():
+    """Ships spooled readings to the REST endpoint from a background thread
+
+    The sampling loop only appends to the spool and calls `notify`, so a slow
+    or dead server never delays the next reading. The spool is the bounded
+    queue: once it's full, the oldest readings are dropped (and counted)
+    rather than blocking the sampler.
+
+    Uses one keep-alive `requests.Session`, and backs off exponentially (with
+    full jitter) while the server is unavailable. Batches are encoded as per
+    `wire_format` (see `wire.py`), optionally gzipped.
+
+    Only full batches are sent, unless `notify(flush=True)` asks for whatever
+    is spooled, e.g. once a batch waited long enough.
+
+    A batch the server rejects for good (4xx, except 408 and 429) would
+    block everything behind it, so it leaves the spool: appended to
+    `dead_letter_path` as JSON lines if set, dropped otherwise, and counted
+    either way.
+    """
+
+    def __init__(self, rest_endpoint: str, spool, batch_size=10, timeout_s=10.0,
+                 backoff_base_s=1.0, backoff_max_s=300.0, session=None,
+                 wire_format='json', compress=False, dead_letter_path=None, metrics=METRICS):
+        self.rest_endpoint = rest_endpoint
+        self.spool = spool
+        self.batch_size = batch_size
+        self.timeout_s = timeout_s
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.session = session or requests.Session()
+        self.wire_format = wire_format
+        self.compress = compress
+        self.dead_letter_path = dead_letter_path
+        self.send_latency = LatencyStats()
+        self.sent = 0
+        self.bytes_sent = 0
+        self.failures = 0
+        self.rejected = 0
+        self._send_hist = metrics.histogram('upload_send_seconds', 'Time per POST to the REST endpoint')
+        self._sent_total = metrics.counter('upload_readings_sent_total', 'Readings the server acknowledged')
+        self._bytes_total = metrics.counter('upload_bytes_sent_total', 'Request bytes of acknowledged batches')
+        self._failures_total = metrics.counter('upload_failures_total', 'Batches the server did not acknowledge')
+        self._rejected_total = metrics.counter('upload_readings_rejected_total',
+                                               'Readings in batches the server rejected for good (4xx)')
+        self._age_hist = metrics.histogram('upload_reading_age_seconds',
+                                           'Time from measurement to the server acknowledging it', AGE_BUCKETS)
+        metrics.gauge('spool_depth', lambda: len(spool), 'Readings waiting to be sent')
+        metrics.gauge('spool_dropped', lambda: spool.dropped, 'Readings dropped because the spool was full')
+        self._attempt = 0
+        self._flush_requested = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='uploader', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout_s=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout_s)
+
+    def notify(self, flush=False):
+        """Tell the uploader there's new data in the spool
+
+        Args:
+            flush (bool, optional): Send what's there, even if it's not a full batch. Defaults to False.
+        """
+        if flush:
+            self._flush_requested = True
+        self._wake.set()
+
+    def _backoff_s(self) -> float:
+        cap = min(self.backoff_max_s, self.backoff_base_s * (2 ** self._attempt))
+        return random.uniform(0, cap)
+
+    def _reject(self, batch: list, token, status: int):
+        """Take a batch the server won't ever accept out of the spool"""
+        logger.error('Server rejected a batch of %d readings with %d, %s', len(batch), status,
+                     f'moving it to {self.dead_letter_path}' if self.dead_letter_path else 'dropping it')
+        if self.dead_letter_path:
+            with open(self.dead_letter_path, 'a') as f:
+                for r in batch:
+                    f.write(json.dumps(r, default=to_jsonable) + '\n')
+        self.spool.ack(token)
+        self.rejected += len(batch)
+        self._rejected_total.inc(len(batch))
+
+    def send_batch(self) -> bool:
+        """Send the oldest batch from the spool
+
+        Readings only leave the spool once the server answered with a 2xx, or
+        rejected them for good.
+
+        Returns:
+            bool: Whether the batch is done with, i.e. acknowledged or rejected
+        """
+        batch, token = self.spool.peek(self.batch_size)
+        if not batch:
+            # Only corrupt records left
+            self.spool.ack(token)
+            return True
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Sending: %s', json.dumps(batch, default=to_jsonable))
+        body, headers = encode_batch(batch, self.wire_format, self.compress)
+        start = time.monotonic()
+        try:
+            response = self.session.post(
+                self.rest_endpoint, data=body, headers=headers, timeout=self.timeout_s)
+            status = response.status_code
+            ok = 200 <= status < 300
+            if not ok:
+                logger.error('Server answered %d, keeping %d readings spooled', status, len(self.spool))
+        except requests.RequestException as e:
+            logger.error('Error sending to %s: %s', self.rest_endpoint, e)
+            status = None
+            ok = False
+        took = time.monotonic() - start
+        self.send_latency.observe(took, error=not ok)
+        self._send_hist.observe(took)
+        if status is not None and 400 <= status < 500 and status not in RETRY_4XX:
+            self.failures += 1
+            self._failures_total.inc()
+            self._reject(batch, token, status)
+            return True
+        if not ok:
+            self.failures += 1
+            self._failures_total.inc()
+            return False
+        self.spool.ack(token)
+        self.sent += len(batch)
+        self.bytes_sent += len(body)
+        self._sent_total.inc(len(batch))
+        self._bytes_total.inc(len(body))
+        now = time.time()
+        for r in batch:
+            ts = r.get('measurementTs')
+            if ts:
+                try:
+                    self._age_hist.observe(_age_s(ts, now))
+                except ValueError:
+                    pass
+        return True
+
+    def flush(self) -> int:
+        """Send everything that's spooled, oldest first. Stops at the first failure.
+
+        Returns:
+            int: Number of readings sent
+        """
+        sent = self.sent
+        while len(self.spool) > 0:
+            if not self.send_batch():
+                break
+        return self.sent - sent
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            flush, self._flush_requested = self._flush_requested, False
+            while not self._stop.is_set() and (len(self.spool) >= self.batch_size or (flush and len(self.spool) > 0)):
+                try:
+                    if self.send_batch():
+                        self._attempt = 0
+                        continue
+                except Exception as e:
+                    # e.g. from the spool or encoding; don't let it end the thread
+                    logger.exception(e)
+                delay = self._backoff_s()
+                self._attempt += 1
+                logger.warning('Backing off for %.1fs', delay)
+                self._stop.wait(delay)
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': len(self.spool),
+            'dropped': self.spool.dropped,
+            'sent': self.sent,
+            'bytes_sent': self.bytes_sent,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'send_latency': self.send_latency.as_dict(),
+        }
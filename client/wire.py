@@ -0,0 +1,134 @@
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+from reading import Reading, to_jsonable
+
+# Default: a JSON array of readings, one object per row
+JSON = 'application/json'
+# Columnar: keys and sensor IDs are sent once, values as one array per column,
+# and timestamps as microsecond deltas. See `encode_columnar`.
+COLUMNAR = 'application/vnd.raspberry-gardener.columnar+json'
+
+FORMATS = {
+    'json': JSON,
+    'columnar': COLUMNAR,
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _to_us(ts: str) -> int:
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_us(us: int) -> str:
+    return (_EPOCH + timedelta(microseconds=us)).isoformat()
+
+
+def encode_columnar(readings: list) -> dict:
+    """Turn a batch of readings into columns
+
+    {
+        "v": 1,
+        "sensorIds": ["pi-b8:27:eb:00:00:01"],  # unique IDs
+        "sensor": [0, 0, ...],                  # index into sensorIds, per row
+        "t0": 1625133600000000,                 # first measurementTs, us since epoch
+        "dt": [0, 1000000, ...],                # us since the previous row
+        "columns": {"tempC": [21.5, 21.5, ...], ...}
+    }
+
+    Args:
+        readings (list): Reading dicts, as produced by `read_sensors`
+
+    Returns:
+        dict: Columnar batch
+    """
+    sensor_ids = {}
+    sensor = []
+    dt = []
+    columns = {}
+    t0 = prev = None
+    for i, r in enumerate(readings):
+        if isinstance(r, Reading):
+            # Once, rather than a Python-level lookup per key below
+            r = r.to_dict()
+        sid = r.get('sensorId')
+        if sid not in sensor_ids:
+            sensor_ids[sid] = len(sensor_ids)
+        sensor.append(sensor_ids[sid])
+        ts = _to_us(r['measurementTs'])
+        if t0 is None:
+            t0 = prev = ts
+        dt.append(ts - prev)
+        prev = ts
+        for k, v in r.items():
+            if k in ('sensorId', 'measurementTs'):
+                continue
+            if k not in columns:
+                # Column showed up late, backfill
+                columns[k] = [None] * i
+            columns[k].append(v)
+        for k, col in columns.items():
+            if len(col) == i:
+                col.append(None)
+    return {
+        'v': 1,
+        'sensorIds': list(sensor_ids),
+        'sensor': sensor,
+        't0': t0,
+        'dt': dt,
+        'columns': columns,
+    }
+
+
+def decode_columnar(batch: dict) -> list:
+    """Inverse of `encode_columnar`
+
+    Args:
+        batch (dict): Columnar batch
+
+    Returns:
+        list: Reading dicts
+    """
+    ids = batch['sensorIds']
+    columns = batch['columns']
+    readings = []
+    ts = batch['t0']
+    for i, (s, d) in enumerate(zip(batch['sensor'], batch['dt'])):
+        ts += d
+        r = {'sensorId': ids[s]}
+        for k, col in columns.items():
+            r[k] = col[i]
+        r['measurementTs'] = _from_us(ts)
+        readings.append(r)
+    return readings
+
+
+def encode_batch(readings: list, fmt='json', compress=False):
+    """Serialize a batch for the REST endpoint
+
+    Args:
+        readings (list): Readings or reading dicts
+        fmt (str, optional): 'json' or 'columnar'. Defaults to 'json'.
+        compress (bool, optional): gzip the body. Defaults to False.
+
+    Raises:
+        ValueError: On an unknown format
+
+    Returns:
+        tuple: (body as bytes, headers)
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown wire format {fmt}, expected one of {list(FORMATS)}')
+    payload = encode_columnar(readings) if fmt == 'columnar' else readings
+    # Readings are copied into a dict each (`to_jsonable`), then encoded like one
+    body = json.dumps(payload, separators=(',', ':'), default=to_jsonable).encode('utf-8')
+    headers = {'Content-Type': FORMATS[fmt]}
+    if compress:
+        body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
@@ -0,0 +1,518 @@
+"""Sensors in worker processes, for drivers that can hang the whole process
+
+`BusSampler` gives up on a read that blew its timeout, but its thread stays
+stuck, and a C-level I2C call that never returns can hold the GIL or the
+bus with it. Here, every sensor runs in a process of its own:
+
+- The worker creates the sensor (the parent never touches the hardware),
+  reads it at its interval, and publishes each result into a `Ring` in
+  shared memory. Values are packed with `struct`; nothing is pickled.
+- `WorkerPool.read_all` hands the main loop the latest result of each
+  worker, without waiting for one.
+- A supervisor thread kills workers stuck in a read (or in creating the
+  sensor) for longer than `timeout_s`, and starts new ones. The main loop
+  and the other workers keep going.
+
+Workers are forked, so they get the parent's drivers and options, incl. a
+`Simulation`. Linux only, like the rest of the client.
+"""
+import json
+import logging
+import math
+import multiprocessing
+import mmap
+import os
+import shutil
+import signal
+import struct
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from bus import BUSES
+from metrics import METRICS
+from sampler import SensorTimeout, instruments
+
+logger = logging.getLogger(__name__)
+
+# Ring header: results published, monotonic time the current read started (0 when idle),
+# the sensor's min_interval_s (from the worker, NaN until known), seconds between reads (from the parent)
+_HEADER = struct.Struct('<Qddd')
+# Slot header: sequence (odd while being written), monotonic time of the result,
+# seconds the read took, status, length of the JSON after the packed values
+_SLOT = struct.Struct('<QddBH')
+# Packed value, one per column: tag, then 8 bytes
+_VALUE = struct.Struct('<B8s')
+_AS_INT = struct.Struct('<Bq')
+_AS_FLOAT = struct.Struct('<Bd')
+
+# Tags
+_MISSING, _NONE, _INT, _FLOAT, _STR = range(5)
+# Status
+OK, EMPTY, ERROR = range(3)
+
+# One result, as read from the ring. `n` counts up per result
+Sample = namedtuple('Sample', 'n at took metrics error')
+
+
+class WorkerError(Exception):
+    """A read raised in the worker. Carries its message"""
+    pass
+
+
+def _pack(v) -> bytes:
+    """A column value as tag and 8 bytes, or None if it doesn't fit"""
+    if v is None:
+        return _VALUE.pack(_NONE, b'')
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, int):
+        return _AS_INT.pack(_INT, v) if -2**63 <= v < 2**63 else None
+    if isinstance(v, float):
+        return _AS_FLOAT.pack(_FLOAT, v)
+    if isinstance(v, str):
+        # e.g. relMoisture
+        b = v.encode()
+        return _VALUE.pack(_STR, b) if len(b) <= 8 and b'\0' not in b else None
+    return None
+
+
+def _unpack(b: bytes):
+    tag = b[0]
+    if tag == _INT:
+        return _AS_INT.unpack(b)[1]
+    if tag == _FLOAT:
+        return _AS_FLOAT.unpack(b)[1]
+    if tag == _STR:
+        return b[1:].rstrip(b'\0').decode()
+    return None
+
+
+class Ring():
+    """Latest results of one worker, in shared memory
+
+    One writer (the worker), any number of readers. Columns the sensor
+    declared are packed at fixed offsets; anything else (e.g. the `probes`
+    list) goes into a bit of JSON after them.
+
+    Each slot has a sequence number that's odd while it's being written.
+    Readers copy the newest slot and try again if the number changed
+    meanwhile. The writer always moves on to the next slot, so it only gets
+    in a reader's way if it laps the whole ring during one copy.
+
+    Args:
+        columns (tuple): Sensor.columns
+        slots (int, optional): Defaults to 4.
+        slot_bytes (int, optional): Defaults to 2048.
+    """
+
+    def __init__(self, columns: tuple, slots=4, slot_bytes=2048):
+        self.columns = tuple(columns)
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self._values_end = _SLOT.size + len(self.columns) * _VALUE.size
+        if self._values_end > slot_bytes:
+            raise ValueError(f'{len(self.columns)} columns don\'t fit into {slot_bytes} bytes')
+        # Anonymous and MAP_SHARED, so forked workers write into the same pages
+        self._mm = mmap.mmap(-1, _HEADER.size + slots * slot_bytes)
+        struct.pack_into('<dd', self._mm, 16, math.nan, 1.0)
+
+    def _offset(self, n: int) -> int:
+        return _HEADER.size + (n % self.slots) * self.slot_bytes
+
+    @property
+    def published(self) -> int:
+        return struct.unpack_from('<Q', self._mm, 0)[0]
+
+    @property
+    def busy_since(self) -> float:
+        return struct.unpack_from('<d', self._mm, 8)[0]
+
+    def busy(self, since: float):
+        """Mark the worker as in a read since `since` (monotonic), 0 when done"""
+        struct.pack_into('<d', self._mm, 8, since)
+
+    @property
+    def min_interval_s(self) -> float:
+        """What the worker's sensor instance declared, None until it's created"""
+        v = struct.unpack_from('<d', self._mm, 16)[0]
+        return None if math.isnan(v) else v
+
+    @min_interval_s.setter
+    def min_interval_s(self, v: float):
+        struct.pack_into('<d', self._mm, 16, v)
+
+    @property
+    def interval_s(self) -> float:
+        """Seconds between reads. The worker picks up changes on its next read"""
+        return struct.unpack_from('<d', self._mm, 24)[0]
+
+    @interval_s.setter
+    def interval_s(self, v: float):
+        struct.pack_into('<d', self._mm, 24, v)
+
+    def publish(self, metrics: dict, took=0.0, error: str = None):
+        """Write a result into the next slot (worker side)
+
+        Args:
+            metrics (dict): What read_metric returned
+            took (float, optional): Seconds the read took. Defaults to 0.0.
+            error (str, optional): What the read raised, instead of metrics
+        """
+        values = []
+        extra = {}
+        if error is not None:
+            status, extra = ERROR, {'error': error}
+        elif not metrics:
+            status = EMPTY
+        else:
+            status = OK
+            metrics = dict(metrics)
+            for k in self.columns:
+                if k not in metrics:
+                    values.append(_VALUE.pack(_MISSING, b''))
+                    continue
+                v = metrics.pop(k)
+                packed = _pack(v)
+                if packed is None:
+                    packed = _VALUE.pack(_MISSING, b'')
+                    extra[k] = v
+                values.append(packed)
+            # Not declared in columns
+            extra.update(metrics)
+        blob = json.dumps(extra).encode() if extra else b''
+        if self._values_end + len(blob) > self.slot_bytes:
+            status, values = ERROR, []
+            blob = json.dumps({'error': f'Result too large for the ring ({len(blob)} bytes of JSON)'}).encode()
+
+        mm = self._mm
+        published = self.published
+        off = self._offset(published)
+        seq = struct.unpack_from('<Q', mm, off)[0]
+        # Odd if a worker got killed mid-write; readers would skip the slot for good
+        seq += seq & 1
+        struct.pack_into('<Q', mm, off, seq + 1)
+        _SLOT.pack_into(mm, off, seq + 1, time.monotonic(), took, status, len(blob))
+        pos = off + _SLOT.size
+        for packed in values:
+            mm[pos:pos + _VALUE.size] = packed
+            pos += _VALUE.size
+        pos = off + self._values_end
+        mm[pos:pos + len(blob)] = blob
+        struct.pack_into('<Q', mm, off, seq + 2)
+        struct.pack_into('<Q', mm, 0, published + 1)
+
+    def latest(self) -> Sample:
+        """The newest result (reader side), never waits
+
+        Returns:
+            Sample: None if there's none yet, or the writer kept getting in the way
+        """
+        mm = self._mm
+        for _ in range(3):
+            published = self.published
+            if not published:
+                return None
+            off = self._offset(published - 1)
+            seq = struct.unpack_from('<Q', mm, off)[0]
+            if seq & 1:
+                continue
+            raw = mm[off:off + self.slot_bytes]
+            if struct.unpack_from('<Q', mm, off)[0] == seq:
+                return self._decode(published, raw)
+        return None
+
+    def _decode(self, n: int, raw: bytes) -> Sample:
+        _, at, took, status, blob_len = _SLOT.unpack_from(raw, 0)
+        extra = json.loads(raw[self._values_end:self._values_end + blob_len]) if blob_len else {}
+        if status == ERROR:
+            return Sample(n, at, took, None, extra.get('error', ''))
+        if status == EMPTY:
+            return Sample(n, at, took, None, None)
+        metrics = {}
+        pos = _SLOT.size
+        for k in self.columns:
+            b = raw[pos:pos + _VALUE.size]
+            pos += _VALUE.size
+            if b[0] != _MISSING:
+                metrics[k] = _unpack(b)
+            elif k in extra:
+                metrics[k] = extra.pop(k)
+        metrics.update(extra)
+        return Sample(n, at, took, metrics, None)
+
+
+def _die_with_parent():
+    """Have the kernel SIGKILL this process if the parent goes, even mid-read"""
+    try:
+        import ctypes
+        PR_SET_PDEATHSIG = 1
+        ctypes.CDLL(None).prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    except (OSError, AttributeError):
+        pass
+
+
+def _run_worker(cls, options: dict, ring: Ring, lock_timeout_s: float):
+    """Worker process: create the sensor and publish a result every `ring.interval_s`
+
+    Never faster than the instance's `min_interval_s`, which it also puts into
+    the ring for the parent to plan with.
+
+    Waiting for a bus that another worker hangs on fails after
+    `lock_timeout_s`, so only the one that hangs gets killed.
+    """
+    parent = os.getppid()
+    # Ctrl+C goes to the whole process group; the parent stops us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _die_with_parent()
+    from logs import after_fork
+    after_fork()
+    BUSES.after_fork(lock_timeout_s)
+
+    start = time.monotonic()
+    ring.busy(start)
+    try:
+        sensor = cls(**options)
+    except Exception as e:
+        ring.publish(None, time.monotonic() - start, f'Error creating sensor: {e}')
+        ring.busy(0.0)
+        raise SystemExit(1)
+    ring.min_interval_s = sensor.min_interval_s
+    while os.getppid() == parent:
+        start = time.monotonic()
+        ring.busy(start)
+        try:
+            ring.publish(sensor.read_metric(), time.monotonic() - start)
+        except Exception as e:
+            ring.publish(None, time.monotonic() - start, f'{type(e).__name__}: {e}')
+        ring.busy(0.0)
+        # Next multiple of the interval, skipping any we overran
+        interval_s = max(ring.interval_s, sensor.min_interval_s)
+        time.sleep(interval_s - time.monotonic() % interval_s)
+
+
+class WorkerSensor():
+    """Stands in for a sensor that runs in a worker
+
+    Has what the scheduler and samplers look at: `name`, `bus`,
+    `min_interval_s`, and a `read_metric` that returns the latest result.
+    """
+
+    def __init__(self, cls, options: dict, ring: Ring):
+        self.cls = cls
+        self.name = cls.name
+        self.bus = cls.bus
+        self.options = options
+        self.ring = ring
+        # Set by WorkerPool.start
+        self.interval_s = None
+        self.max_age_s = None
+        self.process = None
+        self.restarts = 0
+        # Restarts since the last result, for the backoff
+        self.failures = 0
+        self.next_start = 0.0
+        self._progress = 0
+        self._last_read = 0
+
+    @property
+    def min_interval_s(self) -> float:
+        """The instance's, e.g. MAX44009_S with auto range, once the worker created it"""
+        v = self.ring.min_interval_s
+        return self.cls.min_interval_s if v is None else v
+
+    def latest(self, now: float = None) -> Sample:
+        """The latest result, if it's fresh enough
+
+        Raises:
+            SensorTimeout: If the worker had no result for `max_age_s`
+
+        Returns:
+            Sample: Even if it was handed out before
+        """
+        now = time.monotonic() if now is None else now
+        sample = self.ring.latest()
+        if sample is None:
+            raise SensorTimeout(f'{self.name}: no result from its worker yet')
+        if self.max_age_s is not None and now - sample.at > self.max_age_s:
+            raise SensorTimeout(f'{self.name}: latest result from its worker is {now - sample.at:.1f}s old')
+        return sample
+
+    def read_metric(self) -> dict:
+        sample = self.latest()
+        if sample.error is not None:
+            raise WorkerError(sample.error)
+        return sample.metrics
+
+
+class WorkerPool():
+    """Runs sensors in worker processes, and restarts them when they hang
+
+    Use as the sampler: `read_all` hands out the latest result of each
+    worker. A worker that died or got killed is restarted after
+    `check_s`, doubling up to `max_backoff_s` while it keeps failing
+    (e.g. a sensor that's unplugged, so creating it raises).
+
+    Args:
+        timeout_s (float, optional): Longest a read may take before the worker is killed. Defaults to 3.0.
+        check_s (float, optional): How often the supervisor looks. Defaults to 0.25.
+        max_backoff_s (float, optional): Defaults to 60.0.
+    """
+
+    def __init__(self, timeout_s=3.0, check_s=0.25, max_backoff_s=60.0, metrics=METRICS):
+        self.timeout_s = timeout_s
+        self.check_s = check_s
+        self.max_backoff_s = max_backoff_s
+        self.workers = {}
+        self.metrics = metrics
+        self._instruments = {}
+        self._ctx = multiprocessing.get_context('fork')
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_dir = None
+        metrics.gauge('sensor_workers_up', lambda: sum(1 for w in self.workers.values()
+                                                       if w.process is not None and w.process.is_alive()),
+                      'Sensor worker processes running')
+
+    def add(self, cls, **options) -> WorkerSensor:
+        """Run `cls(**options)` in a worker, once started"""
+        w = WorkerSensor(cls, options, Ring(cls.columns))
+        self.workers[w.name] = w
+        return w
+
+    def start(self, intervals: dict, wait_s: float = None):
+        """Start the workers and the supervisor
+
+        Args:
+            intervals (dict): Name -> seconds between reads, see plan_intervals
+            wait_s (float, optional): Wait this long for every worker's first result. Defaults to timeout_s.
+        """
+        # Workers on the same bus still take turns, see Bus.share
+        self._lock_dir = tempfile.mkdtemp(prefix='sensor-workers-')
+        BUSES.share(self._lock_dir)
+        self.set_intervals(intervals)
+        for w in self.workers.values():
+            self._spawn(w)
+        self._thread = threading.Thread(target=self._run, name='sensor-workers', daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + (self.timeout_s if wait_s is None else wait_s)
+        while time.monotonic() < deadline and not all(w.ring.published for w in self.workers.values()):
+            time.sleep(0.01)
+        return self
+
+    def set_intervals(self, intervals: dict):
+        """Change how often the workers read, e.g. once their `min_interval_s` is known
+
+        Args:
+            intervals (dict): Name -> seconds between reads, see plan_intervals
+        """
+        for name, w in self.workers.items():
+            w.interval_s = intervals.get(name, 1.0)
+            w.max_age_s = w.interval_s + self.timeout_s
+            w.ring.interval_s = w.interval_s
+
+    def _spawn(self, w: WorkerSensor):
+        # A killed worker may have left it set
+        w.ring.busy(0.0)
+        w.process = self._ctx.Process(target=_run_worker, args=(w.cls, w.options, w.ring, self.timeout_s / 2),
+                                      name=f'sensor-{w.name}', daemon=True)
+        w.process.start()
+        logger.info('Started worker %d for %s', w.process.pid, w.name)
+
+    def _failed(self, w: WorkerSensor, now: float, reason: str):
+        w.process = None
+        w.restarts += 1
+        w.failures += 1
+        w.next_start = now + min(self.max_backoff_s, self.check_s * 2 ** (w.failures - 1))
+        self.metrics.counter('sensor_worker_restarts_total', 'Sensor workers restarted, by why',
+                             sensor=w.name, reason=reason).inc()
+
+    def _check(self):
+        now = time.monotonic()
+        for w in self.workers.values():
+            p = w.process
+            if p is not None and p.is_alive():
+                busy = w.ring.busy_since
+                if busy and now - busy > self.timeout_s:
+                    logger.error('%s stuck in a read for %.1fs, killing worker %d', w.name, now - busy, p.pid,
+                                 extra={'sensor': w.name})
+                    p.kill()
+                    # In uninterruptible sleep, it goes once the driver returns
+                    p.join(1.0)
+                    self._failed(w, now, 'hung')
+                elif w.ring.published != w._progress:
+                    w._progress = w.ring.published
+                    w.failures = 0
+                continue
+            if p is not None:
+                logger.error('Worker %d for %s exited with %s', p.pid, w.name, p.exitcode, extra={'sensor': w.name})
+                self._failed(w, now, 'exited')
+            if now >= w.next_start:
+                self._spawn(w)
+
+    def _run(self):
+        while not self._stop.wait(self.check_s):
+            try:
+                self._check()
+            except Exception as e:
+                logger.exception(e)
+
+    def _instrument(self, name: str) -> tuple:
+        if name not in self._instruments:
+            self._instruments[name] = instruments(name, self.metrics)
+        return self._instruments[name]
+
+    def read_all(self, sensors: dict) -> dict:
+        """The latest result of each worker, see BusSampler.read_all. Never waits on a read
+
+        Args:
+            sensors (dict): Name -> WorkerSensor
+
+        Returns:
+            dict: Name -> metrics (dict or None), or an Exception
+        """
+        now = time.monotonic()
+        results = {}
+        for k, s in sensors.items():
+            latency, errors, empty, timeouts = self._instrument(k)
+            try:
+                sample = s.latest(now)
+            except SensorTimeout as e:
+                timeouts.inc()
+                results[k] = e
+                continue
+            # Count each result once, however often it's handed out
+            if sample.n != s._last_read:
+                s._last_read = sample.n
+                latency.observe(sample.took)
+                if sample.error is not None:
+                    errors.inc()
+                elif not sample.metrics:
+                    empty.inc()
+            results[k] = WorkerError(sample.error) if sample.error is not None else sample.metrics
+        return results
+
+    def stats(self) -> dict:
+        return {k: {'pid': w.process.pid if w.process else None, 'restarts': w.restarts,
+                    'published': w.ring.published} for k, w in self.workers.items()}
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        running = [w.process for w in self.workers.values() if w.process is not None]
+        for p in running:
+            p.terminate()
+        for p in running:
+            p.join(1.0)
+            if p.is_alive():
+                p.kill()
+                p.join(1.0)
+        for w in self.workers.values():
+            w.process = None
+        if self._lock_dir:
+            BUSES.unshare()
+            shutil.rmtree(self._lock_dir, ignore_errors=True)
+            self._lock_dir = None
@@ -54,7 +54,7 @@ touch /opt/raspberry-gardener/.env.sensor.sh
 echo "REST_ENDPOINT=$REST_ENDPOINT" >/opt/raspberry-gardener/.env.sensor.sh
 echo "SENSORS=$SENSORS" >>/opt/raspberry-gardener/.env.sensor.sh
 echo "OPTS=$OPTS" >>/opt/raspberry-gardener/.env.sensor.sh
-cp monitor.py /opt/raspberry-gardener/
+cp monitor.py bus.py metrics.py sampler.py spool.py uploader.py scheduler.py wire.py identity.py registry.py aggregate.py filters.py logs.py display.py history.py reading.py adc.py deadband.py workers.py simulated.py /opt/raspberry-gardener/
 cp -r max44009/ /opt/raspberry-gardener/
 
 # Install packages as sudo if the sensor runs as sudo
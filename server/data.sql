@@ -12,3 +12,13 @@ CREATE OR REPLACE TABLE `sensors`.`data` (
     `MeasurementTs`         TIMESTAMP,
     `lastUpdateTimestamp`   TIMESTAMP
 );
+
+/* One row per soil probe, for nodes with several (client: `--sensors probes`) */
+CREATE OR REPLACE TABLE `sensors`.`probes` (
+    `sensorId`              TEXT,
+    `probeId`               TEXT,
+    `RawMoisture`           FLOAT,
+    `VoltMoisture`          FLOAT,
+    `MeasurementTs`         TIMESTAMP,
+    `lastUpdateTimestamp`   TIMESTAMP
+);
@@ -0,0 +1,48 @@
+package main
+
+import (
+	"database/sql"
+	"strings"
+	"sync/atomic"
+	"time"
+)
+
+// execer is what storeData needs from the database, so load tests can swap it out
+type execer interface {
+	MustExec(query string, args ...interface{}) sql.Result
+}
+
+// fakeDB stands in for MySQL in load tests (-fakeStorage). Every statement holds
+// one of maxConns connections for latency, plus rowLatency per inserted row, like
+// a multi-row INSERT on the real pool would. Nothing is stored.
+type fakeDB struct {
+	conns      chan struct{}
+	latency    time.Duration
+	rowLatency time.Duration
+	Statements int64
+	Rows       int64
+}
+
+func newFakeDB(maxConns int, latency, rowLatency time.Duration) *fakeDB {
+	return &fakeDB{
+		conns:      make(chan struct{}, maxConns),
+		latency:    latency,
+		rowLatency: rowLatency,
+	}
+}
+
+type fakeResult int64
+
+func (r fakeResult) LastInsertId() (int64, error) { return 0, nil }
+func (r fakeResult) RowsAffected() (int64, error) { return int64(r), nil }
+
+func (f *fakeDB) MustExec(query string, args ...interface{}) sql.Result {
+	// squirrel: INSERT INTO t (...) VALUES (?,?),(?,?)
+	rows := int64(strings.Count(query, "),(") + 1)
+	f.conns <- struct{}{}
+	time.Sleep(f.latency + time.Duration(rows)*f.rowLatency)
+	<-f.conns
+	atomic.AddInt64(&f.Statements, 1)
+	atomic.AddInt64(&f.Rows, rows)
+	return fakeResult(rows)
+}
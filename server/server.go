@@ -4,7 +4,6 @@ import (
 	"encoding/json"
 	"flag"
 	"fmt"
-	"io/ioutil"
 	"log"
 	"net/http"
 	"net/smtp"
@@ -25,8 +24,14 @@ var (
 	port                 = flag.Int("port", 7777, "Port")
 	disableNotifications = flag.Bool("disableNotifications", false, "Disable email notifications. Requires STMP variables to be set.")
 	disableStorage       = flag.Bool("disableStorage", false, "Disable SQL storage if only notifications are required.")
+	fakeStorage          = flag.Bool("fakeStorage", false, "Don't connect to SQL, but pretend to. For load tests, see client/benchmarks/fleet.py.")
+	fakeStorageLatency   = flag.Duration("fakeStorageLatency", 2*time.Millisecond, "With -fakeStorage: time per INSERT")
+	fakeStorageRow       = flag.Duration("fakeStorageRowLatency", 20*time.Microsecond, "With -fakeStorage: time per row of an INSERT")
 )
 
+// Connections to the database. The fake one has as many
+const MAX_OPEN_CONNS = 7
+
 func mustGetenv(k string) string {
 	v := os.Getenv(k)
 	if v == "" {
@@ -37,7 +42,7 @@ func mustGetenv(k string) string {
 
 func configureConnectionPool(dbPool *sqlx.DB) {
 	dbPool.SetMaxIdleConns(5)
-	dbPool.SetMaxOpenConns(7)
+	dbPool.SetMaxOpenConns(MAX_OPEN_CONNS)
 	dbPool.SetConnMaxLifetime(1800)
 }
 
@@ -64,7 +69,7 @@ func initTCPConnectionPool() (*sqlx.DB, error) {
 
 type App struct {
 	Router  *mux.Router
-	DB      *sqlx.DB
+	DB      execer
 	SmtpCfg *SmtpConfig
 }
 
@@ -74,6 +79,9 @@ func newApp(smtpCfg *SmtpConfig) *App {
 	//Database
 	if *disableStorage {
 		zap.S().Warn("SQL storage is disabled")
+	} else if *fakeStorage {
+		zap.S().Warnf("SQL storage is fake: %v per INSERT, %v per row", *fakeStorageLatency, *fakeStorageRow)
+		app.DB = newFakeDB(MAX_OPEN_CONNS, *fakeStorageLatency, *fakeStorageRow)
 	} else {
 		app.DB, err = initTCPConnectionPool()
 		if err != nil {
@@ -105,10 +113,23 @@ type Sensor struct {
 	VoltMoisture  float32
 	Lumen         float32
 	MeasurementTs string
+	// One per soil probe, if the node has several (client: `--sensors probes`)
+	Probes []Probe
+}
+
+// Probe is one soil probe of a reading. ProbeId is stable per node.
+type Probe struct {
+	ProbeId      string
+	RawMoisture  int32
+	VoltMoisture float32
 }
 
 func (a *App) storeData(sensors []Sensor) error {
 	q := squirrel.Insert("data").Columns("sensorId", "tempC", "visLight", "irLight", "uvIx", "rawMoisture", "voltMoisture", "lumen", "measurementTs", "lastUpdateTimestamp")
+	// Probes go to their own table, in the same request
+	pq := squirrel.Insert("probes").Columns("sensorId", "probeId", "rawMoisture", "voltMoisture", "measurementTs", "lastUpdateTimestamp")
+	nProbes := 0
+	now := time.Now()
 	for _, s := range sensors {
 		// RFC 3339
 		measurementTs, err := time.Parse(time.RFC3339, s.MeasurementTs)
@@ -116,7 +137,11 @@ func (a *App) storeData(sensors []Sensor) error {
 			zap.S().Errorf("Cannot parse TS %v to RFC3339", err)
 			continue
 		}
-		q = q.Values(s.SensorId, s.TempC, s.VisLight, s.IrLight, s.UvIx, s.RawMoisture, s.VoltMoisture, s.Lumen, measurementTs, time.Now())
+		q = q.Values(s.SensorId, s.TempC, s.VisLight, s.IrLight, s.UvIx, s.RawMoisture, s.VoltMoisture, s.Lumen, measurementTs, now)
+		for _, p := range s.Probes {
+			pq = pq.Values(s.SensorId, p.ProbeId, p.RawMoisture, p.VoltMoisture, measurementTs, now)
+			nProbes++
+		}
 	}
 	sql, args, err := q.ToSql()
 	if err != nil {
@@ -125,6 +150,16 @@ func (a *App) storeData(sensors []Sensor) error {
 
 	res := a.DB.MustExec(sql, args...)
 	zap.S().Debug(res)
+
+	if nProbes == 0 {
+		return nil
+	}
+	sql, args, err = pq.ToSql()
+	if err != nil {
+		return err
+	}
+	res = a.DB.MustExec(sql, args...)
+	zap.S().Debug(res)
 	return nil
 }
 
@@ -136,25 +171,20 @@ func (a *App) sendErr(w http.ResponseWriter, msg string, code int) {
 }
 
 func (a *App) RetrieveSensorDataHandler(w http.ResponseWriter, r *http.Request) {
-	var s []Sensor
 	defer r.Body.Close()
-	raw, err := ioutil.ReadAll(r.Body)
-	if err != nil {
-		zap.S().Error(err)
-		a.sendErr(w, "Bad Request", http.StatusBadRequest)
-		return
-	}
-
-	zap.S().Debugf("Raw: %v", string(raw))
-	err = json.Unmarshal(raw, &s)
+	// JSON array by default, columnar and/or gzip if the client asks for it
+	s, err := decodeBody(r.Header.Get("Content-Type"), r.Header.Get("Content-Encoding"), r.Body)
 	if err != nil {
 		zap.S().Error(err)
 		a.sendErr(w, "Bad Request", http.StatusBadRequest)
 		return
 	}
+	zap.S().Debugf("Decoded %v readings", len(s))
 
 	// Whether we successfully store or not, go validate those sensors
-	go a.validateAllSensors(s)
+	if a.SmtpCfg != nil {
+		go a.validateAllSensors(s)
+	}
 
 	if *disableStorage {
 		zap.S().Debug("Storing data is disabled")
@@ -169,6 +199,7 @@ func (a *App) RetrieveSensorDataHandler(w http.ResponseWriter, r *http.Request)
 }
 
 // Hard coded alert values for now
+// Clients with --report send crossings right away, see client/deadband.py. Keep in sync
 const MIN_TEMP_C = 5
 const MAX_TEMP_C = 60 // direct sun
 const LOW_MOISTURE_THRESHOLD_V = 2.2
@@ -205,6 +236,9 @@ func (a *App) notifyUser(sensor *Sensor) error {
 	Temperature: %v (Thresholds: Min: %v / Max: %v)
 	Moisture: %v (Thresholds: Min: %v / Max: N/A)`, sensor.SensorId, sensor.MeasurementTs,
 		sensor.TempC, MIN_TEMP_C, MAX_TEMP_C, sensor.VoltMoisture, LOW_MOISTURE_THRESHOLD_V)
+	for _, p := range sensor.Probes {
+		msg += fmt.Sprintf("\n\tProbe %s: %v", p.ProbeId, p.VoltMoisture)
+	}
 	zap.S().Warn(msg)
 	// Get config
 	// Auth to mail server
@@ -222,6 +256,11 @@ func (a *App) checkSensorThresholds(sensor *Sensor) bool {
 	if sensor.VoltMoisture >= LOW_MOISTURE_THRESHOLD_V || sensor.TempC <= MIN_TEMP_C || sensor.TempC >= MAX_TEMP_C {
 		return true
 	}
+	for _, p := range sensor.Probes {
+		if p.VoltMoisture >= LOW_MOISTURE_THRESHOLD_V {
+			return true
+		}
+	}
 	return false
 }
 
@@ -238,6 +277,7 @@ func (a *App) validateSensor(sensor *Sensor) error {
 		if time.Now().Sub(lastCheckedTime) < NOTIFICATION_TIMEOUT {
 			// Not time yet
 			zap.S().Debug("Timeout not reached")
+			mu.Unlock()
 			return nil
 		}
 	}
@@ -250,10 +290,11 @@ func (a *App) validateSensor(sensor *Sensor) error {
 	return err
 }
 
+// structSliceToMap keeps the latest reading per sensor
 func structSliceToMap(structSlice []Sensor) map[string]Sensor {
 	structMap := make(map[string]Sensor)
-	for i := 0; i < len(structSlice); i += 2 {
-		structMap[structSlice[i].SensorId] = structSlice[i+1]
+	for _, s := range structSlice {
+		structMap[s.SensorId] = s
 	}
 	return structMap
 }
@@ -262,6 +303,7 @@ func (a *App) validateAllSensors(sensors []Sensor) {
 	// Avoid duplicate key checks
 	sensorMap := structSliceToMap(sensors)
 	for _, sensor := range sensorMap {
+		sensor := sensor
 		go a.validateSensor(&sensor)
 	}
 }
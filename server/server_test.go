@@ -1,6 +1,9 @@
 package main
 
 import (
+	"bytes"
+	"compress/gzip"
+	"reflect"
 	"testing"
 
 	_ "github.com/go-sql-driver/mysql"
@@ -37,3 +40,85 @@ func TestApp_validateSensor(t *testing.T) {
 		})
 	}
 }
+
+func TestDecodeBody(t *testing.T) {
+	columnar := `{"v":1,"sensorIds":["pi-1"],"sensor":[0,0],"t0":1625133600000000,"dt":[0,1500000],` +
+		`"columns":{"tempC":[21.5,null],"rawMoisture":[26000,26001],"relMoisture":["ok","ok"],` +
+		`"probes":[null,[{"probeId":"bed1","rawMoisture":23360,"voltMoisture":1.5,"relMoisture":"ok"}]]}}`
+	var gz bytes.Buffer
+	zw := gzip.NewWriter(&gz)
+	zw.Write([]byte(columnar))
+	zw.Close()
+
+	tests := []struct {
+		name            string
+		contentType     string
+		contentEncoding string
+		body            []byte
+		want            []Sensor
+		wantErr         bool
+	}{
+		{
+			name:        "JSON",
+			contentType: "application/json",
+			body:        []byte(`[{"sensorId":"pi-1","tempC":21.5,"measurementTs":"2021-07-01T10:00:00+00:00"}]`),
+			want:        []Sensor{{SensorId: "pi-1", TempC: 21.5, MeasurementTs: "2021-07-01T10:00:00+00:00"}},
+		},
+		{
+			name:        "JSON, probes",
+			contentType: "application/json",
+			body: []byte(`[{"sensorId":"pi-1","measurementTs":"2021-07-01T10:00:00+00:00",` +
+				`"probes":[{"probeId":"bed1","rawMoisture":23360,"voltMoisture":1.17},{"probeId":"bed2","rawMoisture":null,"voltMoisture":null}]}]`),
+			want: []Sensor{{SensorId: "pi-1", MeasurementTs: "2021-07-01T10:00:00+00:00",
+				Probes: []Probe{{ProbeId: "bed1", RawMoisture: 23360, VoltMoisture: 1.17}, {ProbeId: "bed2"}}}},
+		},
+		{
+			name:            "Columnar, gzip",
+			contentType:     COLUMNAR_CONTENT_TYPE,
+			contentEncoding: "gzip",
+			body:            gz.Bytes(),
+			want: []Sensor{
+				{SensorId: "pi-1", TempC: 21.5, RawMoisture: 26000, MeasurementTs: "2021-07-01T10:00:00Z"},
+				{SensorId: "pi-1", RawMoisture: 26001, MeasurementTs: "2021-07-01T10:00:01.5Z",
+					Probes: []Probe{{ProbeId: "bed1", RawMoisture: 23360, VoltMoisture: 1.5}}},
+			},
+		},
+		{
+			name:        "Columnar, bad sensor index",
+			contentType: COLUMNAR_CONTENT_TYPE,
+			body:        []byte(`{"v":1,"sensorIds":[],"sensor":[0],"t0":0,"dt":[0],"columns":{}}`),
+			wantErr:     true,
+		},
+	}
+	for _, tt := range tests {
+		t.Run(tt.name, func(t *testing.T) {
+			got, err := decodeBody(tt.contentType, tt.contentEncoding, bytes.NewReader(tt.body))
+			if (err != nil) != tt.wantErr {
+				t.Fatalf("decodeBody() error = %v, wantErr %v", err, tt.wantErr)
+			}
+			if !reflect.DeepEqual(got, tt.want) && !tt.wantErr {
+				t.Errorf("decodeBody() = %v, want %v", got, tt.want)
+			}
+		})
+	}
+}
+
+func TestStructSliceToMap(t *testing.T) {
+	// Odd length used to index past the end
+	got := structSliceToMap([]Sensor{{SensorId: "a", TempC: 1}, {SensorId: "b"}, {SensorId: "a", TempC: 3}})
+	want := map[string]Sensor{"a": {SensorId: "a", TempC: 3}, "b": {SensorId: "b"}}
+	if !reflect.DeepEqual(got, want) {
+		t.Errorf("structSliceToMap() = %v, want %v", got, want)
+	}
+}
+
+func TestFakeDB(t *testing.T) {
+	db := newFakeDB(2, 0, 0)
+	res := db.MustExec("INSERT INTO data (a,b) VALUES (?,?),(?,?),(?,?)", 1, 2, 3, 4, 5, 6)
+	if n, _ := res.RowsAffected(); n != 3 {
+		t.Errorf("RowsAffected() = %v, want 3", n)
+	}
+	if db.Statements != 1 || db.Rows != 3 {
+		t.Errorf("Statements, Rows = %v, %v, want 1, 3", db.Statements, db.Rows)
+	}
+}
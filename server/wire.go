@@ -0,0 +1,126 @@
+package main
+
+import (
+	"compress/gzip"
+	"encoding/json"
+	"fmt"
+	"io"
+	"io/ioutil"
+	"mime"
+	"time"
+)
+
+// Content types understood by RetrieveSensorDataHandler
+// See client/wire.py for the encoder
+const JSON_CONTENT_TYPE = "application/json"
+const COLUMNAR_CONTENT_TYPE = "application/vnd.raspberry-gardener.columnar+json"
+
+// ColumnarBatch sends keys and sensor IDs once, values as one array per column,
+// and timestamps as microsecond deltas from T0
+type ColumnarBatch struct {
+	V         int                        `json:"v"`
+	SensorIds []string                   `json:"sensorIds"`
+	Sensor    []int                      `json:"sensor"`
+	T0        int64                      `json:"t0"`
+	Dt        []int64                    `json:"dt"`
+	Columns   map[string]json.RawMessage `json:"columns"`
+}
+
+// Columns we store. Everything else the client sends (e.g. relMoisture) is ignored,
+// except for "probes", see decodeColumnar.
+var numericColumns = []string{"tempC", "visLight", "irLight", "uvIx", "rawMoisture", "voltMoisture", "lumen"}
+
+func columnValue(col []*float64, i int) float64 {
+	if i >= len(col) || col[i] == nil {
+		return 0
+	}
+	return *col[i]
+}
+
+func decodeColumnar(raw []byte) ([]Sensor, error) {
+	var b ColumnarBatch
+	if err := json.Unmarshal(raw, &b); err != nil {
+		return nil, err
+	}
+	if b.V != 1 {
+		return nil, fmt.Errorf("Unsupported columnar version %v", b.V)
+	}
+	if len(b.Sensor) != len(b.Dt) {
+		return nil, fmt.Errorf("Columnar batch has %v sensors but %v timestamps", len(b.Sensor), len(b.Dt))
+	}
+	cols := map[string][]*float64{}
+	for _, name := range numericColumns {
+		raw, ok := b.Columns[name]
+		if !ok {
+			continue
+		}
+		var col []*float64
+		if err := json.Unmarshal(raw, &col); err != nil {
+			return nil, fmt.Errorf("Column %s: %v", name, err)
+		}
+		cols[name] = col
+	}
+	// A list of probes per row (or null), not a number
+	var probes [][]Probe
+	if raw, ok := b.Columns["probes"]; ok {
+		if err := json.Unmarshal(raw, &probes); err != nil {
+			return nil, fmt.Errorf("Column probes: %v", err)
+		}
+	}
+	sensors := make([]Sensor, len(b.Sensor))
+	ts := b.T0
+	for i, ix := range b.Sensor {
+		if ix < 0 || ix >= len(b.SensorIds) {
+			return nil, fmt.Errorf("Invalid sensor index %v", ix)
+		}
+		ts += b.Dt[i]
+		sensors[i] = Sensor{
+			SensorId:      b.SensorIds[ix],
+			TempC:         float32(columnValue(cols["tempC"], i)),
+			VisLight:      int32(columnValue(cols["visLight"], i)),
+			IrLight:       int32(columnValue(cols["irLight"], i)),
+			UvIx:          float32(columnValue(cols["uvIx"], i)),
+			RawMoisture:   int32(columnValue(cols["rawMoisture"], i)),
+			VoltMoisture:  float32(columnValue(cols["voltMoisture"], i)),
+			Lumen:         float32(columnValue(cols["lumen"], i)),
+			MeasurementTs: time.Unix(0, ts*int64(time.Microsecond)).UTC().Format(time.RFC3339Nano),
+		}
+		if i < len(probes) {
+			sensors[i].Probes = probes[i]
+		}
+	}
+	return sensors, nil
+}
+
+// decodeBody picks the decoder by Content-Encoding and Content-Type.
+// Plain JSON stays the default, so old clients keep working.
+func decodeBody(contentType, contentEncoding string, body io.Reader) ([]Sensor, error) {
+	if contentEncoding == "gzip" {
+		gz, err := gzip.NewReader(body)
+		if err != nil {
+			return nil, err
+		}
+		defer gz.Close()
+		body = gz
+	}
+	raw, err := ioutil.ReadAll(body)
+	if err != nil {
+		return nil, err
+	}
+
+	mediaType := JSON_CONTENT_TYPE
+	if contentType != "" {
+		mediaType, _, err = mime.ParseMediaType(contentType)
+		if err != nil {
+			return nil, err
+		}
+	}
+	switch mediaType {
+	case COLUMNAR_CONTENT_TYPE:
+		return decodeColumnar(raw)
+	default:
+		var s []Sensor
+		err = json.Unmarshal(raw, &s)
+		return s, err
+	}
+}